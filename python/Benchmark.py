@@ -0,0 +1,262 @@
+import logging
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import subprocess
+from multiprocessing import Pool
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+from DevTools.Plotter.utilities import isData
+from DevTools.Plotter.histParams import getHistParams
+from DevTools.Plotter.SyntheticNtuple import writeSyntheticSample, writeSyntheticFakeRates
+from DevTools.Plotter.FlattenTree import FlattenTree
+from DevTools.Plotter.Hpp3lFlattener import Hpp3lFlattener
+from DevTools.Plotter.Hpp4lFlattener import Hpp4lFlattener
+from DevTools.Plotter.WZFlattener import WZFlattener
+from DevTools.Plotter.DYFlattener import DYFlattener
+from DevTools.Plotter.Hpp3lSkimmer import Hpp3lSkimmer
+from DevTools.Plotter.Hpp4lSkimmer import Hpp4lSkimmer
+from DevTools.Plotter.WZSkimmer import WZSkimmer
+from DevTools.Plotter.Counter import Counter
+from DevTools.Plotter.Plotter import Plotter
+
+# samples of each benchmark, with names known to xsec and isData
+benchmarkSamples = {
+    'Hpp3l': ['HPlusPlusHMinusHTo3L_M-500_TuneCUETP8M1_13TeV_calchep-pythia8','WZTo3LNu_TuneCUETP8M1_13TeV-powheg-pythia8','DoubleMuon'],
+    'Hpp4l': ['HPlusPlusHMinusMinusHTo4L_M-500_TuneCUETP8M1_13TeV_pythia8','ZZTo4L_13TeV_powheg_pythia8','DoubleMuon'],
+    'WZ'   : ['WZTo3LNu_TuneCUETP8M1_13TeV-powheg-pythia8','DoubleMuon'],
+    'DY'   : ['DYJetsToLL_M-50_TuneCUETP8M1_13TeV-amcatnloFXFX-pythia8','DoubleMuon'],
+}
+
+# steps in the order they run, later steps read the outputs of earlier ones
+benchmarkSteps = ['flattenTree','ntupleFlattener','ntupleSkimmer','counter','plotter']
+
+flatteners = {
+    'Hpp3l': Hpp3lFlattener,
+    'Hpp4l': Hpp4lFlattener,
+    'WZ'   : WZFlattener,
+    'DY'   : DYFlattener,
+}
+
+skimmers = {
+    'Hpp3l': Hpp3lSkimmer,
+    'Hpp4l': Hpp4lSkimmer,
+    'WZ'   : WZSkimmer,
+}
+
+def getBenchmarkHistory(directory='benchmarks'):
+    '''JSON file of all benchmark runs'''
+    return os.path.join(directory,'history.json')
+
+def getGitCommit():
+    '''Current commit of the package, if it is a git checkout'''
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=open(os.devnull,'w')).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return ''
+
+def runFlattenTree(config):
+    '''FlattenTree.flattenAll of every sample'''
+    for sample in config['samples']:
+        flattener = FlattenTree(config['analysis'],sample,ntupleDirectory=os.path.join(config['ntupleDirectory'],sample))
+        for histName in getHistParams(config['analysis'],sample):
+            flattener.addHistogram(histName)
+        for selection in config['selections']:
+            flattener.addSelection(selection)
+        flattener.flattenAll(batch=config['batch'])
+
+def runNtupleFlattener(config):
+    '''NtupleFlattener.flatten of every sample'''
+    for sample in config['samples']:
+        flattener = flatteners[config['analysis']](sample,ntupleDirectory=os.path.join(config['ntupleDirectory'],sample),progressbar=None,columnar=config['columnar'])
+        flattener.flatten()
+
+def runNtupleSkimmer(config):
+    '''NtupleSkimmer.skim of every sample'''
+    if config['analysis'] not in skimmers:
+        logging.warning('No skimmer for {0}'.format(config['analysis']))
+        return
+    for sample in config['samples']:
+        skimmer = skimmers[config['analysis']](sample,ntupleDirectory=os.path.join(config['ntupleDirectory'],sample),progressbar=None)
+        skimmer.skim()
+
+def runCounter(config):
+    '''Counter.getCounts of every selection'''
+    counter = Counter(config['analysis'])
+    for sample in config['samples']:
+        counter.addProcess(sample,[sample],signal=sample==config['samples'][0],ntupleDirectory=os.path.join(config['ntupleDirectory'],sample))
+    for selection in config['selections']:
+        counter.getCounts(selection)
+
+def runPlotter(config):
+    '''Plotter.plot of every histogram of the first selection'''
+    plotter = Plotter(config['analysis'],formats=['png'])
+    for sample in config['samples']:
+        name = 'data' if isData(sample) else sample
+        plotter.addHistogram(name,[sample],signal=sample==config['samples'][0],ntupleDirectory=os.path.join(config['ntupleDirectory'],sample))
+    selection = config['selections'][0]
+    for histName in sorted(getHistParams(config['analysis'],config['samples'][0])):
+        plotter.plot('{0}/{1}'.format(selection,histName),'benchmark/{0}'.format(histName),plotratio=False)
+    plotter.finish()
+
+stepFunctions = {
+    'flattenTree'    : runFlattenTree,
+    'ntupleFlattener': runNtupleFlattener,
+    'ntupleSkimmer'  : runNtupleSkimmer,
+    'counter'        : runCounter,
+    'plotter'        : runPlotter,
+}
+
+def runStep(step,config):
+    '''
+    Run a step in the benchmark work directory and measure it.
+
+    Run in a fresh process (see Benchmark.run) so the peak RSS and
+    the file counters belong to this step alone.
+    '''
+    os.chdir(config['workDirectory'])
+    os.environ['CMSSW_BASE'] = config['cmsswBase']
+    filesStart = ROOT.TFile.GetFileCounter()
+    bytesStart = ROOT.TFile.GetFileBytesRead()
+    start = time.time()
+    stepFunctions[step](config)
+    elapsed = time.time()-start
+    events = config['events']*len(config['samples'])
+    return {
+        'time'           : elapsed,
+        'events'         : events,
+        'eventsPerSecond': events/elapsed if elapsed>0 else 0.,
+        'peakRSS'        : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024, # bytes, ru_maxrss is in kB on linux
+        'fileOpens'      : ROOT.TFile.GetFileCounter()-filesStart,
+        'bytesRead'      : ROOT.TFile.GetFileBytesRead()-bytesStart,
+    }
+
+class Benchmark(object):
+    '''
+    End to end timing of flattening, skimming, counting and plotting on synthetic ntuples.
+
+    The ntuples and fake rates are generated under workDirectory (and reused
+    if they exist), every step runs there in its own process, and the results
+    are appended to a JSON history to compare runs.
+    '''
+
+    def __init__(self,analysis,**kwargs):
+        if analysis not in benchmarkSamples:
+            raise ValueError('No benchmark for {0}, must be one of {1}'.format(analysis,sorted(benchmarkSamples.keys())))
+        self.analysis = analysis
+        self.events = kwargs.pop('events',10000)
+        self.nfiles = kwargs.pop('nfiles',2)
+        self.seed = kwargs.pop('seed',0)
+        self.samples = kwargs.pop('samples',benchmarkSamples[analysis])
+        steps = kwargs.pop('steps',benchmarkSteps)
+        self.selections = kwargs.pop('selections',['default'])
+        self.batch = kwargs.pop('batch',False)
+        self.columnar = kwargs.pop('columnar',False)
+        self.workDirectory = os.path.abspath(kwargs.pop('workDirectory','benchmarks/work/{0}_{1}x{2}_{3}'.format(analysis,self.events,self.nfiles,self.seed)))
+        self.history = kwargs.pop('history',getBenchmarkHistory())
+        self.cmsswBase = os.path.join(self.workDirectory,'cmssw')
+        self.ntupleDirectory = os.path.join(self.workDirectory,'ntuples',analysis)
+        for step in steps:
+            if step not in stepFunctions: raise ValueError('Unknown benchmark step {0}, must be one of {1}'.format(step,benchmarkSteps))
+        # the counts are read from the skims, neither step can run without a skimmer
+        if analysis not in skimmers and ('ntupleSkimmer' in steps or 'counter' in steps):
+            logging.warning('No skimmer for {0}, skipping the ntupleSkimmer and counter steps'.format(analysis))
+            steps = [step for step in steps if step not in ['ntupleSkimmer','counter']]
+        self.steps = [step for step in benchmarkSteps if step in steps]
+
+    def getConfig(self):
+        '''Options of this benchmark, passed to the steps and saved with the results'''
+        return {
+            'analysis'       : self.analysis,
+            'events'         : self.events,
+            'nfiles'         : self.nfiles,
+            'seed'           : self.seed,
+            'samples'        : self.samples,
+            'steps'          : self.steps,
+            'selections'     : self.selections,
+            'batch'          : self.batch,
+            'columnar'       : self.columnar,
+            'workDirectory'  : self.workDirectory,
+            'cmsswBase'      : self.cmsswBase,
+            'ntupleDirectory': self.ntupleDirectory,
+        }
+
+    def generate(self):
+        '''Write the synthetic ntuples and fake rates'''
+        logging.info('Generating {0} synthetic {1} events per sample in {2}'.format(self.events,self.analysis,self.workDirectory))
+        for sample in self.samples:
+            writeSyntheticSample(self.ntupleDirectory,self.analysis,sample,self.events,nfiles=self.nfiles,seed=self.seed)
+        writeSyntheticFakeRates(os.path.join(self.cmsswBase,'src/DevTools/Analyzer/data'))
+
+    def run(self):
+        '''Generate the inputs, run each step in a new process, and append the results to the history'''
+        self.generate()
+        config = self.getConfig()
+        results = {}
+        for step in self.steps:
+            logging.info('Benchmarking {0} {1}'.format(self.analysis,step))
+            pool = Pool(1)
+            try:
+                results[step] = pool.apply(runStep,(step,config))
+            finally:
+                pool.close()
+                pool.join()
+            logging.info('{0}: {1:.1f} s, {2:.0f} events/s, {3:.0f} MB peak RSS, {4} files opened'.format(step,results[step]['time'],results[step]['eventsPerSecond'],results[step]['peakRSS']/1e6,results[step]['fileOpens']))
+        run = {
+            'time'   : time.time(),
+            'host'   : socket.gethostname(),
+            'commit' : getGitCommit(),
+            'config' : config,
+            'results': results,
+        }
+        appendHistory(self.history,run)
+        return run
+
+def loadHistory(fileName):
+    '''List of benchmark runs, oldest first'''
+    if not os.path.isfile(fileName): return []
+    with open(fileName) as f:
+        return json.load(f)
+
+def appendHistory(fileName,run):
+    '''Add a run to the history'''
+    history = loadHistory(fileName)
+    history += [run]
+    if os.path.dirname(fileName): python_mkdir(os.path.dirname(fileName))
+    tmpFile = '{0}.{1}'.format(fileName,os.getpid())
+    with open(tmpFile,'w') as f:
+        f.write(json.dumps(history, indent=4, sort_keys=True))
+    os.rename(tmpFile,fileName)
+
+def getComparableRuns(history,run):
+    '''Earlier runs with the same analysis, events, files and seed'''
+    keys = ['analysis','events','nfiles','seed','samples','batch','columnar']
+    return [r for r in history if r is not run and r['time']<run['time'] and all([r['config'].get(key)==run['config'].get(key) for key in keys])]
+
+def compareRuns(run,reference):
+    '''Ratio of each metric of a run to a reference run, by step'''
+    comparison = {}
+    for step in run['results']:
+        if step not in reference['results']: continue
+        comparison[step] = {}
+        for metric in ['time','eventsPerSecond','peakRSS','fileOpens']:
+            ref = reference['results'][step][metric]
+            comparison[step][metric] = float(run['results'][step][metric])/ref if ref else 0.
+    return comparison
+
+def printComparison(run,reference):
+    '''Print the ratio of a run to a reference run'''
+    comparison = compareRuns(run,reference)
+    print '{0:20} | {1:>10} | {2:>10} | {3:>10} | {4:>10} |'.format('ratio to {0}'.format(reference.get('commit','')[:8]),'time','events/s','peak RSS','file opens')
+    for step in benchmarkSteps:
+        if step not in comparison: continue
+        print '{0:20} | {1} |'.format(step,' | '.join(['{0:>10.3f}'.format(comparison[step][metric]) for metric in ['time','eventsPerSecond','peakRSS','fileOpens']]))
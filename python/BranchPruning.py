@@ -0,0 +1,174 @@
+import logging
+import sys
+import re
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+def getLoadedTree(tree):
+    '''The current tree of a chain, loading the first one if needed'''
+    if not tree.GetTree():
+        if tree.LoadTree(0)<0: return None
+    return tree.GetTree()
+
+def getBranchNames(tree):
+    '''Names of the top level branches of a tree'''
+    current = getLoadedTree(tree)
+    if not current: return []
+    return [branch.GetName() for branch in current.GetListOfBranches()]
+
+def getExpressionBranches(branches,expressions):
+    '''
+    Branches read by a list of TTreeFormula strings, out of a set of branch names.
+
+    Every token of the expressions that is one of the branches is returned,
+    the analysis trees are flat so a branch always appears by name. Tokens
+    may start with a digit, branch names like 3l_mass are not identifiers.
+    '''
+    used = set()
+    for expression in expressions:
+        used.update(set(re.findall('[A-Za-z0-9_]+',str(expression))) & set(branches))
+    return used
+
+def getFormulaBranches(tree,expressions):
+    '''Branches of a tree read by a list of TTreeFormula strings'''
+    return getExpressionBranches(set(getBranchNames(tree)),expressions)
+
+def getCacheSize(tree,branches,**kwargs):
+    '''Bytes to hold a cluster of entries of the branches, within minSize and maxSize'''
+    minSize = kwargs.pop('minSize',1<<20)
+    maxSize = kwargs.pop('maxSize',100<<20)
+    current = getLoadedTree(tree)
+    if not current or not current.GetEntries(): return minSize
+    entries = current.GetEntries()
+    zipBytes = 0
+    for name in branches:
+        branch = current.GetBranch(name)
+        if branch: zipBytes += branch.GetZipBytes()
+    autoFlush = current.GetAutoFlush()
+    if autoFlush>0:
+        clusterEntries = autoFlush
+    elif autoFlush<0 and current.GetTotBytes():
+        clusterEntries = float(-autoFlush)/current.GetTotBytes()*entries
+    else:
+        clusterEntries = entries
+    size = float(zipBytes)/entries*min(clusterEntries,entries)*1.2
+    return int(min(maxSize,max(minSize,size)))
+
+def setBranchCache(tree,branches,**kwargs):
+    '''Set up a TTreeCache of only the branches, sized to them unless cacheSize is given'''
+    cacheSize = kwargs.pop('cacheSize',0)
+    if not branches or not getLoadedTree(tree): return 0
+    if not cacheSize: cacheSize = getCacheSize(tree,branches)
+    tree.SetCacheSize(cacheSize)
+    for name in sorted(branches):
+        tree.AddBranchToCache(name,True)
+    tree.StopCacheLearningPhase()
+    logging.debug('Caching {0} branches in {1:.1f} MB'.format(len(branches),cacheSize/1e6))
+    return cacheSize
+
+def setFormulaCache(tree,expressions,**kwargs):
+    '''Set up a TTreeCache of the branches read by a list of TTreeFormula strings'''
+    return setBranchCache(tree,getFormulaBranches(tree,expressions),**kwargs)
+
+def resetCache(tree,cacheSize=0):
+    '''Replace the TTreeCache of a tree by a new one of cacheSize bytes (default size if 0) that learns its branches again'''
+    tree.SetCacheSize(0)
+    tree.SetCacheSize(cacheSize if cacheSize>0 else -1)
+
+class PrunedRow(object):
+    '''
+    Stands in for the row of "for row in tree" while branches are pruned.
+
+    Accessing a branch that is not enabled yet enables it (see BranchPruner.enable),
+    everything else is passed on to the tree.
+    '''
+
+    def __init__(self,pruner):
+        self._pruner = pruner
+        self._tree = pruner.tree
+        self._branches = pruner.branches
+
+    def __getattr__(self,name):
+        if name not in self._branches and not name.startswith('_'):
+            self._pruner.enable(name)
+        return getattr(self._tree,name)
+
+class BranchPruner(object):
+    '''
+    Read only the branches an event loop uses.
+
+    All branches are disabled except the seed branches (ie from the
+    formulas of the histograms and selections). Rows are traced, the first
+    access of another branch enables it and rereads the current entry.
+    After traceEntries entries the branches in use are put in a TTreeCache
+    of their size. Branches first accessed later are still enabled, and
+    added to the cache, so pruning never changes what the loop reads.
+    '''
+
+    def __init__(self,tree,**kwargs):
+        self.tree = tree
+        self.branches = set(kwargs.pop('branches',[]))
+        self.traceEntries = kwargs.pop('traceEntries',1000)
+        self.cacheSize = kwargs.pop('cacheSize',0)
+        self.available = set()
+        self.missing = set()
+        self.late = set()
+        self.entry = -1
+        self.cached = False
+        self.previousCacheSize = 0
+
+    def prune(self):
+        '''Disable all branches but the seed branches'''
+        self.available = set(getBranchNames(self.tree))
+        self.branches.intersection_update(self.available)
+        self.tree.SetBranchStatus('*',0)
+        for name in self.branches:
+            self.tree.SetBranchStatus(name,1)
+
+    def enable(self,name):
+        '''Enable a branch and reread the current entry, False if it is not a branch'''
+        if name in self.missing: return False
+        if name not in self.available:
+            self.missing.add(name)
+            return False
+        self.tree.SetBranchStatus(name,1)
+        self.branches.add(name)
+        if self.cached:
+            self.late.add(name)
+            self.tree.AddBranchToCache(name,True)
+            logging.debug('Branch {0} first read at entry {1}'.format(name,self.entry))
+        if self.entry>=0: self.tree.GetEntry(self.entry)
+        return True
+
+    def cache(self):
+        '''Cache the branches in use'''
+        self.previousCacheSize = self.tree.GetCacheSize()
+        setBranchCache(self.tree,self.branches,cacheSize=self.cacheSize)
+        self.cached = True
+        logging.info('Reading {0} of {1} branches'.format(len(self.branches),len(self.available)))
+
+    def iterate(self,nentries=-1,firstentry=0):
+        '''Iterate over the rows of the tree, reading only the branches in use'''
+        self.prune()
+        row = PrunedRow(self)
+        last = self.tree.GetEntries()
+        if nentries>=0: last = min(last,firstentry+nentries)
+        for entry in xrange(firstentry,last):
+            if self.tree.LoadTree(entry)<0: break
+            if entry-firstentry==self.traceEntries: self.cache()
+            self.tree.GetEntry(entry)
+            self.entry = entry
+            yield row
+        self.entry = -1
+        if self.late: logging.info('Branches first read after {0} entries: {1}'.format(self.traceEntries,', '.join(sorted(self.late))))
+
+    def restore(self):
+        '''Enable all branches again, and give back the cache of the tree'''
+        self.tree.SetBranchStatus('*',1)
+        if self.cached:
+            resetCache(self.tree,self.previousCacheSize)
+            self.cached = False
@@ -0,0 +1,97 @@
+import logging
+import sys
+
+import numpy as np
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+def getBinArray(buff,n,dtype):
+    '''numpy copy of a ROOT array of n values'''
+    if hasattr(buff,'SetSize'): buff.SetSize(n)
+    return np.frombuffer(buff,dtype=dtype,count=n).copy()
+
+def histToArrays(hist):
+    '''
+    Bin contents and sum of weights squared of a 2D or 3D histogram,
+    including under/overflow, indexed [z,y,x] (or [y,x]).
+    '''
+    n = hist.GetNcells()
+    if hist.InheritsFrom('TArrayD'):
+        contents = getBinArray(hist.GetArray(),n,np.float64)
+    elif hist.InheritsFrom('TArrayF'):
+        contents = getBinArray(hist.GetArray(),n,np.float32).astype(np.float64)
+    else:
+        contents = np.array([hist.GetBinContent(b) for b in xrange(n)])
+    if hist.GetSumw2N():
+        sumw2 = getBinArray(hist.GetSumw2().GetArray(),n,np.float64)
+    else:
+        sumw2 = np.abs(contents)
+    shape = [hist.GetNbinsX()+2]
+    if hist.GetDimension()>1: shape = [hist.GetNbinsY()+2]+shape
+    if hist.GetDimension()>2: shape = [hist.GetNbinsZ()+2]+shape
+    return contents.reshape(shape), sumw2.reshape(shape)
+
+def getLabelBins(axis,labels):
+    '''
+    Bins to sum for a list of bin labels, matching ProjectionX(name,bin,bin).
+    No labels means all bins, including under/overflow.
+    '''
+    if not labels: return range(axis.GetNbins()+2)
+    bins = []
+    for label in labels:
+        b = axis.FindBin(label)
+        # an unknown label gives a negative bin, which ROOT projects as the full range
+        bins += [b] if b>=0 else range(axis.GetNbins()+2)
+    return bins
+
+def projectX(contents,sumw2,yBins,zBins=None):
+    '''Sum the contents over the y (and z) bins, summing bins once per time they are listed'''
+    if zBins is not None:
+        contents = contents[zBins].sum(axis=0)
+        sumw2 = sumw2[zBins].sum(axis=0)
+    return contents[yBins].sum(axis=0), sumw2[yBins].sum(axis=0)
+
+def arraysToHist(histName,axis,contents,sumw2):
+    '''Build a TH1D with the binning of axis from contents and sumw2 including under/overflow'''
+    nbins = axis.GetNbins()
+    if axis.IsVariableBinSize():
+        hist = ROOT.TH1D(histName,histName,nbins,axis.GetXbins().GetArray())
+    else:
+        hist = ROOT.TH1D(histName,histName,nbins,axis.GetXmin(),axis.GetXmax())
+    hist.Sumw2()
+    hist.SetDirectory(0)
+    if axis.GetLabels():
+        for b in range(1,nbins+1):
+            hist.GetXaxis().SetBinLabel(b,axis.GetBinLabel(b))
+    for b in range(nbins+2):
+        hist.SetBinContent(b,contents[b])
+        hist.SetBinError(b,sumw2[b]**0.5)
+    hist.ResetStats()
+    if sumw2.sum()>0: hist.SetEntries(contents.sum()**2/sumw2.sum())
+    return hist
+
+class BulkProjection(object):
+    '''
+    All channel projections of a 2D (x vs channel) or 3D (x vs channel vs gen channel) histogram.
+
+    The bin contents are read once, each projection is then a sum over the
+    bins of its channel labels.
+    '''
+
+    def __init__(self,histNd):
+        self.histNd = histNd
+        self.contents, self.sumw2 = histToArrays(histNd)
+        logging.debug('BulkProjection: {0} {1}'.format(histNd.GetName(),self.contents.shape))
+
+    def project(self,histName,binLabels1=[],binLabels2=None):
+        '''Project onto x, summing y over binLabels1 and z over binLabels2 (all if empty)'''
+        yBins = getLabelBins(self.histNd.GetYaxis(),binLabels1)
+        zBins = None
+        if self.histNd.GetDimension()>2:
+            zBins = getLabelBins(self.histNd.GetZaxis(),binLabels2 or [])
+        contents, sumw2 = projectX(self.contents,self.sumw2,yBins,zBins)
+        return arraysToHist(histName,self.histNd.GetXaxis(),contents,sumw2)
@@ -0,0 +1,129 @@
+import logging
+import sys
+import operator
+
+import numpy as np
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+# compiled branch reader, declared to the interpreter on first use
+readColumnCode = '''
+#include "TTree.h"
+#include "TBranch.h"
+#include "TLeaf.h"
+
+namespace DevToolsPlotter {
+
+// Read a scalar branch for entries [first,first+n) into out.
+// Only the requested branch is read from disk.
+void readColumn(TTree* tree, const char* name, Long64_t first, Long64_t n, double* out) {
+  TLeaf* leaf = 0;
+  TBranch* branch = 0;
+  Int_t treeNumber = -1;
+  for (Long64_t i=0; i<n; ++i) {
+    Long64_t local = tree->LoadTree(first+i);
+    out[i] = 0.;
+    if (local<0) continue;
+    if (tree->GetTreeNumber()!=treeNumber) {
+      treeNumber = tree->GetTreeNumber();
+      leaf = tree->GetTree()->GetLeaf(name);
+      branch = leaf ? leaf->GetBranch() : 0;
+    }
+    if (!branch) continue;
+    branch->GetEntry(local);
+    out[i] = leaf->GetValue();
+  }
+}
+
+}
+'''
+
+readColumnDeclared = False
+
+def declareReadColumn():
+    '''Compile the branch reader, once per process.'''
+    global readColumnDeclared
+    if readColumnDeclared: return
+    ROOT.gInterpreter.Declare(readColumnCode)
+    readColumnDeclared = True
+
+class ColumnChunk(object):
+    '''
+    A range of entries of a tree, with each branch read in bulk as a numpy array.
+
+    Stands in for the row object of "for row in tree" so that the same
+    accessors (row.x, getattr(row,'x'), hasattr(row,'x')) return a column
+    for all entries of the chunk. Columns are only read on first access.
+    '''
+
+    def __init__(self,tree,firstentry,nentries):
+        self._tree = tree
+        self._firstentry = firstentry
+        self._nentries = nentries
+        self._columns = {}
+
+    def __len__(self):
+        return self._nentries
+
+    def __getattr__(self,name):
+        if name.startswith('_'): raise AttributeError(name)
+        if name not in self._columns:
+            self._columns[name] = self._read(name)
+        return self._columns[name]
+
+    def _read(self,name):
+        '''Read a single branch for all entries in the chunk'''
+        leaf = self._tree.GetLeaf(name)
+        if not leaf: raise AttributeError(name)
+        if self._nentries==0: return np.zeros(0)
+        if leaf.InheritsFrom('TLeafC') or leaf.GetTypeName()=='string': return self._readStrings(name)
+        if leaf.GetLen()!=1:
+            raise ValueError('ColumnChunk: {0} is an array, only scalar branches are supported'.format(name))
+        declareReadColumn()
+        column = np.zeros(self._nentries,dtype=np.float64)
+        ROOT.DevToolsPlotter.readColumn(self._tree,name,self._firstentry,self._nentries,column)
+        return column
+
+    def _readStrings(self,name):
+        '''String branches are not numbers, evaluate them entry by entry'''
+        formula = ROOT.TTreeFormula('chunk_{0}'.format(name),name,self._tree)
+        vals = []
+        treeNumber = -1
+        for entry in xrange(self._firstentry,self._firstentry+self._nentries):
+            if self._tree.LoadTree(entry)<0: break
+            if self._tree.GetTreeNumber()!=treeNumber:
+                treeNumber = self._tree.GetTreeNumber()
+                formula.UpdateFormulaLeaves()
+            formula.GetNdata()
+            vals += [formula.EvalStringInstance(0)]
+        return np.array(vals,dtype=object)
+
+def iterChunks(tree,chunkSize,nentries=-1,firstentry=0):
+    '''Split the tree into chunks of at most chunkSize entries'''
+    last = tree.GetEntries()
+    if nentries>=0: last = min(last,firstentry+nentries)
+    for first in xrange(firstentry,last,chunkSize):
+        yield ColumnChunk(tree,first,min(chunkSize,last-first))
+
+def passAll(results):
+    '''Logical and of a list of selections, works for rows and chunks'''
+    return reduce(operator.and_,results,True)
+
+def passAny(results):
+    '''Logical or of a list of selections, works for rows and chunks'''
+    return reduce(operator.or_,results,False)
+
+def asColumn(val,n):
+    '''Broadcast a scalar (ie, lambda row: 1) to a column of length n'''
+    return np.broadcast_to(np.asarray(val,dtype=np.float64),(n,))
+
+def fillColumns(hist,vals,weights):
+    '''Fill a histogram from arrays of values and weights'''
+    if len(vals)==0: return
+    vals = np.ascontiguousarray(vals,dtype=np.float64)
+    weights = np.ascontiguousarray(weights,dtype=np.float64)
+    hist.FillN(len(vals),vals,weights)
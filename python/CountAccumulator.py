@@ -0,0 +1,104 @@
+import logging
+
+import numpy as np
+
+class CountAccumulator(object):
+    '''
+    Weighted counts keyed by (cutName, chan, genChan).
+
+    Each key is interned to an integer index the first time it is seen.
+    Increments are buffered as (index, weight) and added to the val, count
+    and err2 arrays in bulk, the arrays growing as new keys are added.
+    getCounts produces the same layout as NtupleSkimmer.increment used to:
+    cutName, cutName/chan and cutName/chan/gen_genChan (unless genChan is 'all'),
+    each {'val': sum of weights, 'count': entries, 'err2': sum of weights squared}.
+    '''
+
+    def __init__(self,**kwargs):
+        self.bufferSize = kwargs.pop('bufferSize',100000)
+        size = kwargs.pop('size',1024)
+        self.index = {}
+        self.keys = []
+        self.groups = {}
+        self.vals = np.zeros(size)
+        self.counts = np.zeros(size,dtype=np.int64)
+        self.err2 = np.zeros(size)
+        self.pendingIndices = []
+        self.pendingVals = []
+        self.pendingArrays = []
+        self.pendingSize = 0
+
+    def getIndex(self,cutName,chan,genChan='all'):
+        '''Index of a key, adding it if needed'''
+        key = (cutName,chan,genChan)
+        if key not in self.index:
+            self.index[key] = len(self.keys)
+            self.keys += [key]
+        return self.index[key]
+
+    def getIndices(self,cutNames,chan,genChan='all'):
+        '''Array of indices of a tuple of cutNames for a channel, cached for bulk increments'''
+        group = (cutNames,chan,genChan)
+        if group not in self.groups:
+            self.groups[group] = np.array([self.getIndex(cutName,chan,genChan) for cutName in cutNames],dtype=np.intp)
+        return self.groups[group]
+
+    def increment(self,cutName,val,chan,genChan='all'):
+        '''Add a weight to a key'''
+        if val!=val:
+            logging.warning('{0} {1} {2} attempted to add NaN'.format(cutName,chan,genChan))
+        self.pendingIndices.append(self.getIndex(cutName,chan,genChan))
+        self.pendingVals.append(val)
+        if len(self.pendingIndices)>=self.bufferSize: self.flush()
+
+    def incrementMany(self,indices,vals):
+        '''Add weights (an array or a single weight) to an array of indices from getIndices'''
+        if not len(indices): return
+        vals = np.broadcast_to(np.asarray(vals,dtype=float),np.shape(indices))
+        nans = np.isnan(vals)
+        if nans.any():
+            cutName, chan, genChan = self.keys[indices[nans][0]]
+            logging.warning('{0} {1} {2} attempted to add {3} NaN'.format(cutName,chan,genChan,nans.sum()))
+        self.pendingArrays.append((indices,vals))
+        self.pendingSize += len(indices)
+        if self.pendingSize>=self.bufferSize: self.flush()
+
+    def flush(self):
+        '''Add the buffered increments to the arrays'''
+        indices = [np.array(self.pendingIndices,dtype=np.intp)]+[i for i,v in self.pendingArrays]
+        vals = [np.array(self.pendingVals,dtype=float)]+[v for i,v in self.pendingArrays]
+        indices = np.concatenate(indices)
+        vals = np.concatenate(vals)
+        self.pendingIndices = []
+        self.pendingVals = []
+        self.pendingArrays = []
+        self.pendingSize = 0
+        if len(self.keys)>len(self.vals):
+            size = max(len(self.keys),2*len(self.vals))
+            for name in ['vals','counts','err2']:
+                old = getattr(self,name)
+                new = np.zeros(size,dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self,name,new)
+        if not len(indices): return
+        size = len(self.vals)
+        self.vals += np.bincount(indices,weights=vals,minlength=size)
+        self.counts += np.bincount(indices,minlength=size)
+        self.err2 += np.bincount(indices,weights=vals**2,minlength=size)
+
+    def getCounts(self):
+        '''The counts of every cut, cut/chan and cut/chan/gen_genChan'''
+        self.flush()
+        counts = {}
+        for i,(cutName,chan,genChan) in enumerate(self.keys):
+            # keys interned by getIndices but never incremented
+            if not self.counts[i]: continue
+            names = [cutName,'/'.join([cutName,chan])]
+            if genChan!='all': names += ['/'.join([cutName,chan,'gen_'+genChan])]
+            for name in names:
+                if name not in counts:
+                    counts[name] = {'val':0.,'count':0,'err2':0.,}
+                counts[name]['val'] += float(self.vals[i])
+                counts[name]['count'] += int(self.counts[i])
+                counts[name]['err2'] += float(self.err2[i])
+        return counts
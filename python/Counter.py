@@ -33,6 +33,7 @@ class Counter(object):
         self.scales = {}
         self.j = 0
         self.poisson = kwargs.pop('poisson',False) # return poisson errors
+        self.tempCounts = {} # (analysis, sample, selection, scalefactor): (val, err) from prefetchCounts
 
     def _openFile(self,sampleName,**kwargs):
         '''Verify and open a sample'''
@@ -66,6 +67,7 @@ class Counter(object):
         self.signals = []
         self.scales = {}
         self.processSampleCuts = {}
+        self.tempCounts = {}
 
     def _readSampleCount(self,sampleName,directory,**kwargs):
         '''Read the count from file'''
@@ -82,11 +84,56 @@ class Counter(object):
     def _getTempCount(self,sampleName,selection,scalefactor,**kwargs):
         '''Get a temporary count'''
         analysis = kwargs.pop('analysis',self.analysis)
+        key = (analysis,sampleName,selection,scalefactor)
+        if key in self.tempCounts: return self.tempCounts[key]
         hist = self.sampleFiles[analysis][sampleName].getTempCount(selection,scalefactor)
         val = hist.GetBinContent(1) if hist else 0.
         err = hist.GetBinError(1) if hist else 0.
         return val,err
 
+    def _getTempCuts(self,processName,sampleName,selection,**kwargs):
+        '''Get the list of (selection, scalefactor) counted for a sample of a process'''
+        scalefactor = kwargs.pop('scalefactor','1')
+        mcscalefactor = kwargs.pop('mcscalefactor','1')
+        datascalefactor = kwargs.pop('datascalefactor','1')
+        mccut = kwargs.pop('mccut','')
+        sf = '*'.join([scalefactor,datascalefactor if isData(sampleName) else mcscalefactor])
+        fullcut = ' && '.join([selection,mccut]) if mccut and not isData(sampleName) else selection
+        if processName in self.processSampleCuts:
+            if sampleName in self.processSampleCuts[processName]:
+                fullcut += ' && {0}'.format(self.processSampleCuts[processName][sampleName])
+        # scale a sample via a cut
+        if processName in self.scales and sampleName in self.scales[processName]:
+            cuts = []
+            for cut in self.scales[processName][sampleName]:
+                thissf = '{0}*{1}'.format(sf,self.scales[processName][sampleName][cut])
+                thisFullCut = '{0} && {1}'.format(fullcut, cut)
+                cuts += [(thisFullCut,thissf)]
+            return cuts
+        return [(fullcut,sf)]
+
+    def prefetchCounts(self,selections,**kwargs):
+        '''
+        Count a list of selections for all processes with a single pass over each sample.
+        Later counts with one of these selections (and the same scalefactors) are read from memory.
+        '''
+        sampleCuts = OrderedDict()
+        for processName in self.processOrder:
+            analysis = self.analysisDict[processName]
+            for sampleName in self.processDict[processName]:
+                key = (analysis,sampleName)
+                if key not in sampleCuts: sampleCuts[key] = []
+                for selection in selections:
+                    for cut in self._getTempCuts(processName,sampleName,selection,**kwargs):
+                        if cut in sampleCuts[key] or key+cut in self.tempCounts: continue
+                        sampleCuts[key] += [cut]
+        for (analysis,sampleName), cuts in sampleCuts.iteritems():
+            if not cuts: continue
+            logging.debug('Counting {0} selections for {1}'.format(len(cuts),sampleName))
+            hists = self.sampleFiles[analysis][sampleName].getTempCounts(cuts)
+            for cut, hist in zip(cuts,hists):
+                self.tempCounts[(analysis,sampleName)+cut] = (hist.GetBinContent(1), hist.GetBinError(1))
+
     def _getPoisson(self,count):
         entries = count[0]
         if entries<0: entries = 0
@@ -99,11 +146,7 @@ class Counter(object):
     def _getCount(self,processName,directory,**kwargs):
         '''Get count for process'''
         analysis = self.analysisDict[processName]
-        scalefactor = kwargs.pop('scalefactor','1')
-        mcscalefactor = kwargs.pop('mcscalefactor','1')
-        datascalefactor = kwargs.pop('datascalefactor','1')
         selection = kwargs.pop('selection','')
-        mccut = kwargs.pop('mccut','')
         # check if it is a map, list, or directory
         if isinstance(directory,dict):       # its a map
             directory = directory[processName]
@@ -118,20 +161,7 @@ class Counter(object):
                     logging.debug('Sample: {0}'.format(sampleName))
                     if selection:
                         logging.debug('Custom selection')
-                        sf = '*'.join([scalefactor,datascalefactor if isData(sampleName) else mcscalefactor])
-                        fullcut = ' && '.join([selection,mccut]) if mccut and not isData(sampleName) else selection
-                        if processName in self.processSampleCuts:
-                            if sampleName in self.processSampleCuts[processName]:
-                                fullcut += ' && {0}'.format(self.processSampleCuts[processName][sampleName])
-                        # scale a sample via a cut
-                        if processName in self.scales and sampleName in self.scales[processName]:
-                            for cut in self.scales[processName][sampleName]:
-                                thissf = '{0}*{1}'.format(sf,self.scales[processName][sampleName][cut])
-                                thisFullCut = '{0} && {1}'.format(fullcut, cut)
-                                count = self._getTempCount(sampleName,thisFullCut,thissf,analysis=analysis)
-                                logging.debug('Count: {0} +/- {1}'.format(*count))
-                                if count: counts += [count]
-                        else:
+                        for fullcut, sf in self._getTempCuts(processName,sampleName,selection,**kwargs):
                             count = self._getTempCount(sampleName,fullcut,sf,analysis=analysis)
                             logging.debug('Count: {0} +/- {1}'.format(*count))
                             if count: counts += [count]
@@ -168,11 +198,19 @@ class Counter(object):
 
     def getCounts(self,directory,**kwargs):
         '''Get a map for the counts'''
+        if kwargs.get('selection',''):
+            prefetchArgs = dict(kwargs)
+            self.prefetchCounts([prefetchArgs.pop('selection')],**prefetchArgs)
         counts = {}
         for processName in self.processOrder:
             counts[processName] = self.getCount(processName,directory,**kwargs)
         return counts
 
+    def getCountTable(self,directory,selections,**kwargs):
+        '''Get a list of count maps, one per selection, counting each sample once'''
+        self.prefetchCounts(selections,**kwargs)
+        return [self.getCounts(directory,selection=selection,**kwargs) for selection in selections]
+
     def printCounts(self,label,directory,**kwargs):
         '''Print the counts'''
         doError = kwargs.pop('doError',False)
@@ -0,0 +1,98 @@
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+import numpy as np
+
+class CutScan(object):
+    '''
+    Yields for a grid of cut values, filled once per event.
+
+    Each event is stored as the fine bin it falls in along each scanned
+    variable. The yield for every threshold (or every combination of
+    thresholds) is computed afterwards with cumulative sums, producing the
+    same 'val', 'count', 'err2' entries as NtupleSkimmer.increment would
+    have for an increment per passing cut value.
+
+    cuts is a list of (name, cutValues, direction), with cutValues in
+    increasing order and direction '>' (pass if value>cut) or '<'
+    (pass if value<cut).
+    '''
+
+    def __init__(self,cuts):
+        self.names = [name for name,vals,direction in cuts]
+        self.cutValues = [list(vals) for name,vals,direction in cuts]
+        self.directions = [direction for name,vals,direction in cuts]
+        for name,vals,direction in zip(self.names,self.cutValues,self.directions):
+            if direction not in ['>','<']:
+                raise ValueError('CutScan: unknown direction {0} for {1}'.format(direction,name))
+            if vals!=sorted(vals):
+                raise ValueError('CutScan: cut values for {0} must be increasing'.format(name))
+        self.shape = tuple([len(vals)+1 for vals in self.cutValues])
+        self.entries = OrderedDict()
+
+    def getBin(self,vals):
+        '''The fine bin an event falls in, the number of cuts it is above (>) or not below (<)'''
+        return tuple([bisect_left(cuts,val) if direction=='>' else bisect_right(cuts,val) for val,cuts,direction in zip(vals,self.cutValues,self.directions)])
+
+    def fill(self,cutName,vals,weight,chan,genChan='all'):
+        '''
+        Add an event with the scanned variables vals.
+        cutName is a format string with one field per scanned variable for the cut values.
+        '''
+        key = (cutName,chan,genChan)
+        if key not in self.entries: self.entries[key] = ([],[])
+        self.entries[key][0].append(self.getBin(vals))
+        self.entries[key][1].append(weight)
+
+    def _histogram(self,keys):
+        '''Fine binned sum of weights, number of entries, and sum of squared weights'''
+        size = int(np.prod(self.shape))
+        hist = np.zeros((3,size))
+        for key in keys:
+            bins, weights = self.entries[key]
+            flat = np.ravel_multi_index(np.array(bins,dtype=np.intp).T,self.shape)
+            weights = np.array(weights,dtype=float)
+            hist[0] += np.bincount(flat,weights=weights,minlength=size)
+            hist[1] += np.bincount(flat,minlength=size)
+            hist[2] += np.bincount(flat,weights=weights**2,minlength=size)
+        return hist.reshape((3,)+self.shape)
+
+    def _cumulate(self,hist):
+        '''Convert fine bins to the yields passing each threshold'''
+        for axis,direction in enumerate(self.directions):
+            axis += 1
+            if direction=='>':
+                # pass if above the cut, sum the bins from the top down
+                hist = np.flip(np.cumsum(np.flip(hist,axis),axis=axis),axis)
+                hist = np.delete(hist,0,axis=axis)
+            else:
+                # pass if below the cut, sum the bins from the bottom up
+                hist = np.cumsum(hist,axis=axis)
+                hist = np.delete(hist,-1,axis=axis)
+        return hist
+
+    def _addCounts(self,counts,cutName,keys):
+        hist = self._cumulate(self._histogram(keys))
+        for index in zip(*np.nonzero(hist[1])):
+            name = cutName.format(*[cuts[i] for cuts,i in zip(self.cutValues,index)])
+            counts[name] = {'val':float(hist[0][index]),'count':int(round(hist[1][index])),'err2':float(hist[2][index]),}
+
+    def getCounts(self):
+        '''Yields for every cut value (or combination) with at least one event'''
+        counts = {}
+        groups = OrderedDict()
+        for cutName,chan,genChan in self.entries:
+            groups.setdefault(cutName,OrderedDict()).setdefault(chan,[]).append(genChan)
+        for cutName in groups:
+            logging.debug('CutScan: computing {0}'.format(cutName))
+            allKeys = []
+            for chan in groups[cutName]:
+                chanKeys = [(cutName,chan,genChan) for genChan in groups[cutName][chan]]
+                allKeys += chanKeys
+                self._addCounts(counts,'/'.join([cutName,chan]),chanKeys)
+                for key in chanKeys:
+                    if key[2]=='all': continue
+                    self._addCounts(counts,'/'.join([cutName,chan,'gen_'+key[2]]),[key])
+            self._addCounts(counts,cutName,allKeys)
+        return counts
@@ -0,0 +1,76 @@
+import logging
+
+import numpy as np
+
+from DevTools.Plotter.BulkProjection import histToArrays
+
+maxCuts = 20
+
+def getMaskExpression(cuts):
+    '''TTree expression for the bitmask of the cuts an entry passes, bit i set if cuts[i] passes'''
+    if not cuts: return '0'
+    return '+'.join(['(({0})!=0)*{1}'.format(cut,1<<i) for i,cut in enumerate(cuts)])
+
+def getMaskBinning(cuts):
+    '''One bin per bitmask'''
+    return [1<<len(cuts),-0.5,(1<<len(cuts))-0.5]
+
+class Cutflow(object):
+    '''
+    Yields for every combination of a list of cuts.
+
+    Each entry is histogrammed in the bin of the bitmask of the cuts it
+    passes (see getMaskExpression), so a single pass over a tree gives the
+    sum of weights and of squared weights for every pass/fail pattern.
+    Any combination of required cuts is then a sum over those bins.
+    '''
+
+    def __init__(self,cuts):
+        self.cuts = list(cuts)
+        if len(self.cuts)>maxCuts:
+            raise ValueError('Cutflow: at most {0} cuts, got {1}'.format(maxCuts,len(self.cuts)))
+        self.masks = np.arange(1<<len(self.cuts))
+        self.vals = np.zeros(len(self.masks))
+        self.sumw2 = np.zeros(len(self.masks))
+
+    def add(self,hist):
+        '''Add a histogram filled with getMaskExpression using getMaskBinning'''
+        if not hist: return
+        contents, sumw2 = histToArrays(hist)
+        self.vals += contents[1:-1]
+        self.sumw2 += sumw2[1:-1]
+
+    def _getMask(self,cuts):
+        mask = 0
+        for cut in cuts:
+            mask |= 1<<(cut if isinstance(cut,int) else self.cuts.index(cut))
+        return mask
+
+    def count(self,passing=[],failing=[]):
+        '''Yield and uncertainty of entries passing all cuts in passing and failing all in failing (names or indices)'''
+        passMask = self._getMask(passing)
+        failMask = self._getMask(failing)
+        selected = ((self.masks & passMask)==passMask) & ((self.masks & failMask)==0)
+        return self.vals[selected].sum(), self.sumw2[selected].sum()**0.5
+
+    def total(self):
+        '''Yield before any cut'''
+        return self.count()
+
+    def full(self):
+        '''Yield passing all cuts'''
+        return self.count(passing=range(len(self.cuts)))
+
+    def cutOnly(self,cut):
+        '''Yield passing a single cut'''
+        return self.count(passing=[cut])
+
+    def nMinusOne(self,cut):
+        '''Yield passing all but one cut'''
+        index = cut if isinstance(cut,int) else self.cuts.index(cut)
+        return self.count(passing=[i for i in range(len(self.cuts)) if i!=index])
+
+    def sequential(self):
+        '''Yields after applying the cuts one after the other, starting with no cuts'''
+        logging.debug('Cutflow: sequential yields for {0} cuts'.format(len(self.cuts)))
+        return [self.count(passing=range(i)) for i in range(len(self.cuts)+1)]
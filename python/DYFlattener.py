@@ -6,10 +6,14 @@ import sys
 import itertools
 import operator
 
+import numpy as np
+
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 from NtupleFlattener import NtupleFlattener
+from DevTools.Plotter.WeightShifts import weightShifts
+from DevTools.Plotter.ColumnChunk import passAll
 from DevTools.Utilities.utilities import prod, ZMASS
 
 
@@ -26,7 +30,7 @@ class DYFlattener(NtupleFlattener):
         self.leps = ['z1','z2']
         self.channels = ['ee','mm']
         self.selections = {
-            'default': lambda row: row.z_deltaR>0.02 and row.z_mass>60. and row.z1_pt>25. and row.z2_pt>20.,
+            'default': lambda row: (row.z_deltaR>0.02) & (row.z_mass>60.) & (row.z1_pt>25.) & (row.z2_pt>20.),
         }
 
         # setup histogram parameters
@@ -96,33 +100,21 @@ class DYFlattener(NtupleFlattener):
         super(DYFlattener, self).__init__('DY',sample,**kwargs)
 
 
-    def getWeight(self,row):
+    def getWeights(self,row):
+        '''Weight of the nominal and of each weight shift'''
         if row.isData:
-            weight = 1.
+            weights = dict([(shift,1.) for shift in self.weightShifts.shifts])
         else:
             cut = 'medium'
             # per event weights
-            base = ['genWeight','pileupWeight','triggerEfficiency']
-            if self.shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
-            if self.shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
-            if self.shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
-            if self.shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
-            for lep in zip(self.leps):
-                if self.shift == 'lepUp':
-                    base += ['{0}_{1}ScaleUp'.format(lep,cut)]
-                elif self.shift == 'lepDown':
-                    base += ['{0}_{1}ScaleDown'.format(lep,cut)]
-                else:
-                    base += ['{0}_{1}Scale'.format(lep,cut)]
-            vals = [getattr(row,scale) for scale in base]
-            for scale,val in zip(base,vals):
-                if val != val: logging.warning('{0}: {1} is NaN'.format(row.channel,scale))
-            weight = prod([val for val in vals if val==val])
+            leptonScales = [('{0}_{1}Scale'.format(lep,cut),'{0}_{1}Scale'.format(lep,cut),True) for lep in self.leps]
+            weights = self.weightShifts.getWeights(row,leptonScales)
             # scale to lumi/xsec
-            weight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
+            weight = float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
             if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
+            weights = dict([(shift,weights[shift]*weight) for shift in weights])
 
-        return weight
+        return weights
 
     def perRowAction(self,row):
         isData = row.isData
@@ -147,7 +139,7 @@ class DYFlattener(NtupleFlattener):
         recoChan = ''.join([x for x in row.channel if x in 'emt'])
 
         # define weights
-        w = self.getWeight(row)
+        w = self.getWeights(row)
 
         # define plot regions
         for selection in self.selections:
@@ -155,6 +147,36 @@ class DYFlattener(NtupleFlattener):
             if result:
                 self.fill(row,selection,w,recoChan)
 
+    def getChunkWeights(self,chunk):
+        '''Columnar version of getWeights'''
+        n = len(chunk)
+        isData = chunk.isData.astype(bool)
+        weights = dict([(shift,np.ones(n)) for shift in self.weightShifts.shifts])
+        if not isData.all():
+            cut = 'medium'
+            # per event weights
+            leptonScales = [('{0}_{1}Scale'.format(lep,cut),'{0}_{1}Scale'.format(lep,cut),True) for lep in self.leps]
+            mcweights = self.weightShifts.getWeights(chunk,leptonScales)
+            # scale to lumi/xsec
+            mcweight = np.ones(n)*(float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.)
+            if hasattr(chunk,'qqZZkfactor'): mcweight *= chunk.qqZZkfactor/1.1 # ZZ variable k factor
+            weights = dict([(shift,np.where(isData,1.,mcweights[shift]*mcweight)) for shift in mcweights])
+
+        return weights
+
+    def perChunkAction(self,chunk):
+        # setup channels
+        passMedium = passAll([getattr(chunk,'{0}_passMedium'.format(lep)).astype(bool) for lep in self.leps])
+        if not passMedium.any(): return
+        recoChan = np.array([''.join([x for x in c if x in 'emt']) for c in chunk.channel])
+
+        # define weights
+        w = self.getChunkWeights(chunk)
+
+        # define plot regions
+        for selection in self.selections:
+            self.fillChunk(chunk,selection,passMedium & self.selections[selection](chunk),w,recoChan)
+
 
 
 
@@ -163,6 +185,7 @@ def parse_command_line(argv):
 
     parser.add_argument('sample', type=str, default='DoubleMuon', nargs='?', help='Sample to flatten')
     parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
+    parser.add_argument('--shifts', nargs='*', type=str, default=[], choices=weightShifts, help='Weight shifts to fill in the same pass')
 
     return parser.parse_args(argv)
 
@@ -175,6 +198,7 @@ def main(argv=None):
     flattener = DYFlattener(
         args.sample,
         shift=args.shift,
+        shifts=args.shifts,
     )
 
     flattener.flatten()
@@ -4,6 +4,7 @@ from prettytable import PrettyTable
 import ROOT
 
 from DevTools.Plotter.NtupleWrapper import NtupleWrapper
+from DevTools.Plotter.Cutflow import Cutflow
 from DevTools.Utilities.utilities import sumWithError, prodWithError, divWithError, python_mkdir
 
 
@@ -66,19 +67,33 @@ class Efficiency(object):
             total = sumWithError(total,thisCount)
         return total
 
+    def getCutflow(self,processName,cuts,selection,scalefactor,**kwargs):
+        '''Get a Cutflow of cuts after selection, with a single pass over each sample'''
+        cutflow = Cutflow(cuts)
+        for sampleName in self.processDict[processName]:
+            sel = selection
+            if processName in self.processSampleCuts:
+                if sampleName in self.processSampleCuts[processName]:
+                    sel = '{0} && {1}'.format(selection,self.processSampleCuts[processName][sampleName])
+            analysis = self.analysisDict[processName]
+            cutflow.add(self.sampleFiles[analysis][sampleName].getTempCutflow(cuts,sel,scalefactor))
+        return cutflow
+
     def printEfficiency(self,selectionList,baseSelection='1',**kwargs):
         '''
         Pretty print the efficiency
         Cut, process1 eff, process1 n-1 eff, ...
         '''
         headers = ['Cut']
+        cutflows = {}
         baseYields = {}
         fullYields = {}
         lastRow = ['Full selection']
         for processName in self.processOrder:
             headers += ['{0} Eff.'.format(processName), '{0} N-1 Eff'.format(processName)]
-            baseYields[processName] = self.getCount(processName,baseSelection,'1')
-            fullYields[processName] = self.getCount(processName,' && '.join(selectionList+[baseSelection]),'1')
+            cutflows[processName] = self.getCutflow(processName,selectionList,baseSelection,'1')
+            baseYields[processName] = cutflows[processName].total()
+            fullYields[processName] = cutflows[processName].full()
             fullEff = divWithError(fullYields[processName],baseYields[processName])
             fullEffString = '{0:5.3f} +/- {1:5.3f}'.format(*fullEff)
             lastRow += [fullEffString,'---']
@@ -87,10 +102,9 @@ class Efficiency(object):
         table.align['Cut'] = 'l'
         for selection in selectionList:
             thisRow = [selection]
-            nMinusOneSelections = [x for x in selectionList if x!=selection]
             for processName in self.processOrder:
-                selectionOnly = self.getCount(processName,'{0} && {1}'.format(selection,baseSelection),'1')
-                allButSelection = self.getCount(processName,' && '.join(nMinusOneSelections+[baseSelection]),'1')
+                selectionOnly = cutflows[processName].cutOnly(selection)
+                allButSelection = cutflows[processName].nMinusOne(selection)
                 eff = divWithError(selectionOnly,baseYields[processName])
                 nMinusOneEff = divWithError(fullYields[processName],allButSelection)
                 effString = '{0:5.3f} +/- {1:5.3f}'.format(*eff)
@@ -0,0 +1,206 @@
+import logging
+import os
+import sys
+
+import numpy as np
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+from DevTools.Plotter.utilities import hashString
+from DevTools.Plotter.SlimNtuple import splitSelection, stripParentheses
+
+# compiled selection loop, declared to the interpreter on first use
+entryListCode = '''
+#include "TTree.h"
+#include "TTreeFormula.h"
+#include "TEntryList.h"
+
+namespace DevToolsPlotter {
+
+// Set out[i] to 1 if entry entries[i] of the tree passes the formula, else 0.
+// Only the branches of the formula are read.
+void passEntries(TTree* tree, TTreeFormula* formula, const double* entries, Long64_t n, double* out) {
+  Int_t treeNumber = -1;
+  for (Long64_t i=0; i<n; ++i) {
+    out[i] = 0.;
+    if (tree->LoadTree((Long64_t)entries[i])<0) continue;
+    if (tree->GetTreeNumber()!=treeNumber) {
+      treeNumber = tree->GetTreeNumber();
+      formula->UpdateFormulaLeaves();
+    }
+    if (formula->GetNdata()>0 && formula->EvalInstance(0)!=0) out[i] = 1.;
+  }
+}
+
+// Enter entries, global entry numbers of a tree or chain, in an entry list.
+void fillEntryList(TEntryList* list, TTree* tree, const double* entries, Long64_t n) {
+  for (Long64_t i=0; i<n; ++i) list->Enter((Long64_t)entries[i],tree);
+}
+
+}
+'''
+
+entryListDeclared = False
+
+def declareEntryList():
+    '''Compile the selection loop, once per process.'''
+    global entryListDeclared
+    if entryListDeclared: return
+    ROOT.gInterpreter.Declare(entryListCode)
+    entryListDeclared = True
+
+def normalizeSelection(selection):
+    '''Selection with its && terms sorted, so equivalent strings share a key'''
+    terms = splitSelection(selection)
+    return ' && '.join(sorted(terms)) if terms else '1'
+
+def splitAlternatives(term):
+    '''List of the terms of a selection joined by || at the top level'''
+    term = stripParentheses(term)
+    alternatives = []
+    depth = 0
+    start = 0
+    for i,c in enumerate(term):
+        if c=='(':
+            depth += 1
+        elif c==')':
+            depth -= 1
+        elif depth==0 and c=='?':
+            return [term]
+        elif depth==0 and term[i:i+2]=='||':
+            alternatives += [term[start:i]]
+            start = i+2
+    return alternatives+[term[start:]]
+
+class EntryListCache(object):
+    '''
+    Entries of a tree passing each selection, saved to disk and reused across sessions.
+
+    Lists are keyed on the fingerprint of the input files and the selection
+    with its && terms sorted, and kept as sorted global entry numbers in one
+    .npy file per selection. A new selection is only evaluated on the entries
+    passing its cached terms: the intersection over the && terms and, for a
+    term made of || alternatives, the union over the alternatives.
+
+    Building a list is an extra pass, so getEntryList only builds the list of
+    a selection on its minUses-th request, one-off selections are drawn
+    without one. The maxFiles least recently used lists are kept.
+    '''
+
+    def __init__(self,directory,tree,fingerprint,**kwargs):
+        self.directory = directory
+        self.tree = tree
+        self.fingerprint = fingerprint
+        self.chunkSize = kwargs.pop('chunkSize',1000000)
+        self.minUses = kwargs.pop('minUses',2)
+        self.maxFiles = kwargs.pop('maxFiles',1000)
+        self.lists = {}
+        self.entryLists = {}
+        self.uses = {}
+        self.j = 0
+
+    def getFileName(self,key):
+        '''File of the entries of a normalized selection'''
+        return os.path.join(self.directory,'{0}.npy'.format(hashString(self.fingerprint,key)))
+
+    def load(self,selection):
+        '''Cached entries of a selection, None if they are not cached'''
+        key = normalizeSelection(selection)
+        if key not in self.lists:
+            fileName = self.getFileName(key)
+            if not os.path.isfile(fileName): return None
+            self.lists[key] = np.load(fileName,mmap_mode='r')
+            # mark as used for the eviction
+            try:
+                os.utime(fileName,None)
+            except OSError:
+                pass
+        return self.lists[key]
+
+    def save(self,selection,entries):
+        '''Cache the entries of a selection'''
+        key = normalizeSelection(selection)
+        fileName = self.getFileName(key)
+        python_mkdir(self.directory)
+        # write to a temporary file first so other processes never see a partial list
+        tmpFile = '{0}.{1}.tmp'.format(fileName,os.getpid())
+        with open(tmpFile,'wb') as f:
+            np.save(f,entries)
+        os.rename(tmpFile,fileName)
+        self.lists[key] = entries
+        self.evict()
+
+    def evict(self):
+        '''Remove the least recently used lists beyond maxFiles'''
+        if not self.maxFiles: return
+        fileNames = [os.path.join(self.directory,f) for f in os.listdir(self.directory) if f.endswith('.npy')]
+        if len(fileNames)<=self.maxFiles: return
+        fileNames = sorted(fileNames,key=lambda f: os.path.getmtime(f) if os.path.exists(f) else 0)
+        for fileName in fileNames[:len(fileNames)-self.maxFiles]:
+            # another process may have removed it already
+            try:
+                os.remove(fileName)
+            except OSError:
+                pass
+        logging.debug('EntryListCache: removed {0} lists from {1}'.format(len(fileNames)-self.maxFiles,self.directory))
+
+    def getCandidates(self,selection):
+        '''Entries that may pass a selection from the cached lists of its terms, None if none are cached'''
+        candidates = None
+        for term in splitSelection(selection):
+            entries = self.load(term)
+            if entries is None:
+                alternatives = [self.load(alt) for alt in splitAlternatives(term)]
+                if len(alternatives)<2 or any([alt is None for alt in alternatives]): continue
+                entries = reduce(np.union1d,alternatives)
+            candidates = entries if candidates is None else np.intersect1d(candidates,entries,assume_unique=True)
+        return candidates
+
+    def build(self,selection,candidates=None):
+        '''Evaluate a selection on the candidate entries, or all entries of the tree'''
+        declareEntryList()
+        if self.tree.LoadTree(0)<0: return np.zeros(0,dtype=np.int64)
+        self.j += 1
+        formula = ROOT.TTreeFormula('entryList_{0}'.format(self.j),selection,self.tree)
+        if formula.GetNdim()==0: raise ValueError('EntryListCache: failed to compile {0}'.format(selection))
+        total = self.tree.GetEntries() if candidates is None else len(candidates)
+        passed = []
+        for first in xrange(0,total,self.chunkSize):
+            if candidates is None:
+                entries = np.arange(first,min(first+self.chunkSize,total),dtype=np.float64)
+            else:
+                entries = np.array(candidates[first:first+self.chunkSize],dtype=np.float64)
+            out = np.zeros(len(entries),dtype=np.float64)
+            ROOT.DevToolsPlotter.passEntries(self.tree,formula,entries,len(entries),out)
+            passed += [entries[out!=0].astype(np.int64)]
+        return np.concatenate(passed) if passed else np.zeros(0,dtype=np.int64)
+
+    def getEntries(self,selection):
+        '''Sorted global entries passing a selection, from the cache or evaluated and cached'''
+        entries = self.load(selection)
+        if entries is not None: return entries
+        candidates = self.getCandidates(selection)
+        entries = self.build(selection,candidates)
+        logging.debug('EntryListCache: {0} of {1} entries pass {2}'.format(len(entries),self.tree.GetEntries() if candidates is None else len(candidates),selection))
+        self.save(selection,entries)
+        return entries
+
+    def getEntryList(self,selection):
+        '''TEntryList of the tree for a selection, None if the selection keeps every entry or is not used enough yet'''
+        key = normalizeSelection(selection)
+        if key=='1': return None
+        if key not in self.entryLists:
+            self.uses[key] = self.uses.get(key,0)+1
+            if self.uses[key]<self.minUses and self.load(key) is None: return None
+            declareEntryList()
+            entries = np.array(self.getEntries(selection),dtype=np.float64)
+            self.j += 1
+            elist = ROOT.TEntryList('entryList_{0}'.format(self.j),key)
+            ROOT.DevToolsPlotter.fillEntryList(elist,self.tree,entries,len(entries))
+            self.entryLists[key] = elist
+        return self.entryLists[key]
@@ -0,0 +1,114 @@
+import logging
+import os
+import sys
+import hashlib
+from bisect import bisect_right
+
+import numpy as np
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+
+# fake rate histograms of the doubly charged higgs analyses, by flavor
+hppFakeRateFiles = {
+    'electrons': ('fakerates_dijet_hpp_13TeV_Run2016BCDEFGH.root', 'e/{num}_{denom}/fakeratePtEta'),
+    'muons'    : ('fakerates_dijet_hpp_13TeV_Run2016BCDEFGH.root', 'm/{num}_{denom}/fakeratePtEta'),
+    'taus'     : ('fakerates_w_tau_13TeV_Run2016BCDEFGH.root',     '{num}_{denom}/fakeratePtEta'),
+}
+
+class FakeRateTable(object):
+    '''
+    Fake rate vs (pt, |eta|) as edge and value arrays.
+
+    Bins follow TH2.FindBin, including under/overflow, and pt above maxPt
+    is moved to just below it, as was done before each FindBin.
+    '''
+
+    def __init__(self,xedges,yedges,vals,errs,**kwargs):
+        self.maxPt = kwargs.pop('maxPt',100.)
+        self.xedges = np.asarray(xedges,dtype=float)
+        self.yedges = np.asarray(yedges,dtype=float)
+        self.vals = np.asarray(vals,dtype=float)
+        self.errs = np.asarray(errs,dtype=float)
+        # plain lists for single lookups, faster than numpy on scalars
+        self.xedgeList = list(self.xedges)
+        self.yedgeList = list(self.yedges)
+        self.valList = self.vals.tolist()
+        self.errList = self.errs.tolist()
+
+    @classmethod
+    def fromHist(cls,hist,**kwargs):
+        '''Read the bin edges, contents and errors of a TH2'''
+        xaxis = hist.GetXaxis()
+        yaxis = hist.GetYaxis()
+        xedges = [xaxis.GetBinLowEdge(b) for b in range(1,xaxis.GetNbins()+2)]
+        yedges = [yaxis.GetBinLowEdge(b) for b in range(1,yaxis.GetNbins()+2)]
+        vals = [[hist.GetBinContent(x,y) for y in range(yaxis.GetNbins()+2)] for x in range(xaxis.GetNbins()+2)]
+        errs = [[hist.GetBinError(x,y) for y in range(yaxis.GetNbins()+2)] for x in range(xaxis.GetNbins()+2)]
+        return cls(xedges,yedges,vals,errs,**kwargs)
+
+    def getFakeRate(self,pt,eta):
+        '''Fake rate and error for a single lepton'''
+        if pt > self.maxPt: pt = self.maxPt-1.
+        x = bisect_right(self.xedgeList,pt)
+        y = bisect_right(self.yedgeList,abs(eta))
+        return self.valList[x][y], self.errList[x][y]
+
+    def getFakeRates(self,pt,eta):
+        '''Fake rates and errors for arrays of leptons'''
+        pt = np.asarray(pt,dtype=float)
+        pt = np.where(pt>self.maxPt,self.maxPt-1.,pt)
+        x = np.searchsorted(self.xedges,pt,side='right')
+        y = np.searchsorted(self.yedges,np.abs(eta),side='right')
+        return self.vals[x,y], self.errs[x,y]
+
+# tables loaded in this process, shared by all analyses
+fakeRateTables = {}
+
+def getFakeRateCacheFile(fileName,path,cacheDirectory='fakerates'):
+    '''Local numpy copy of a fake rate histogram, keyed on the source file, its modification time, and the path'''
+    key = '{0}:{1}:{2}'.format(os.path.abspath(fileName),os.path.getmtime(fileName),path)
+    return os.path.join(cacheDirectory,'{0}.npz'.format(hashlib.md5(key).hexdigest()))
+
+def getFakeRateTable(fileName,path,**kwargs):
+    '''
+    Get the FakeRateTable of the histogram path in fileName.
+
+    Tables are kept for the life of the process and also saved as numpy
+    files in cacheDirectory, so other processes do not need to open the ROOT file.
+    '''
+    cacheDirectory = kwargs.pop('cacheDirectory','fakerates')
+    key = (fileName,path)
+    if key in fakeRateTables: return fakeRateTables[key]
+    cacheFile = getFakeRateCacheFile(fileName,path,cacheDirectory=cacheDirectory)
+    if os.path.isfile(cacheFile):
+        arrays = np.load(cacheFile)
+        table = FakeRateTable(arrays['xedges'],arrays['yedges'],arrays['vals'],arrays['errs'])
+    else:
+        tfile = ROOT.TFile.Open(fileName)
+        hist = tfile.Get(path)
+        if not hist:
+            tfile.Close()
+            raise Exception('No fake rate {0} in {1}'.format(path,fileName))
+        table = FakeRateTable.fromHist(hist)
+        tfile.Close()
+        python_mkdir(cacheDirectory)
+        # write to a temporary file first so other processes never see a partial cache
+        tmpFile = '{0}.{1}.npz'.format(cacheFile[:-4],os.getpid())
+        np.savez(tmpFile,xedges=table.xedges,yedges=table.yedges,vals=table.vals,errs=table.errs)
+        os.rename(tmpFile,cacheFile)
+        logging.debug('Cached fake rate {0}:{1} in {2}'.format(fileName,path,cacheFile))
+    fakeRateTables[key] = table
+    return table
+
+def getHppFakeRateTable(lep,num,denom):
+    '''FakeRateTable for electrons, muons or taus between two IDs, ie HppMedium and HppLoose'''
+    fileName, path = hppFakeRateFiles[lep]
+    fileName = '{0}/src/DevTools/Analyzer/data/{1}'.format(os.environ['CMSSW_BASE'],fileName)
+    path = path.format(num=num.replace('Hpp','').lower(),denom=denom.replace('Hpp','').lower())
+    return getFakeRateTable(fileName,path)
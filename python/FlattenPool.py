@@ -0,0 +1,84 @@
+import logging
+import sys
+from multiprocessing import Pool
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Plotter.MultiDraw import MultiDraw
+
+def splitEntries(files,entries,chunkSize):
+    '''
+    Split a list of files with entries into ranges of at most chunkSize entries.
+    Returns a list of (files, firstentry, nentries), with firstentry relative to
+    a chain of only those files.
+    '''
+    chunks = []
+    offsets = [0]
+    for n in entries: offsets += [offsets[-1]+n]
+    total = offsets[-1]
+    for start in xrange(0,total,chunkSize):
+        end = min(start+chunkSize,total)
+        chunkFiles = []
+        for f,first,last in zip(files,offsets[:-1],offsets[1:]):
+            if first>=end or last<=start: continue
+            if not chunkFiles: firstentry = start-first
+            chunkFiles += [f]
+        chunks += [(chunkFiles,firstentry,end-start)]
+    return chunks
+
+def fillChunk(args):
+    '''Fill the booked histograms for a range of entries, run in the worker processes'''
+    treeName, files, firstentry, nentries, booked = args
+    tchain = ROOT.TChain(treeName)
+    for f in files: tchain.Add(f)
+    drawer = MultiDraw(tchain)
+    for hist, weight, xVariable, yVariable, zVariable in booked:
+        hist.SetDirectory(0)
+        drawer.book(hist,weight,xVariable,yVariable,zVariable)
+    drawer.fill(nentries,firstentry)
+    return [hist for hist, weight, xVariable, yVariable, zVariable in booked]
+
+class FlattenPool(object):
+    '''
+    Fill flat histograms for many samples on a pool of processes.
+
+    Each sample's chain is split into ranges of chunkSize entries, so the
+    work is balanced by number of events rather than by sample or file.
+    The partial histograms are summed in memory as they come back and
+    handed to the callback of the sample once all its ranges are done.
+    '''
+
+    def __init__(self,njobs,**kwargs):
+        self.njobs = njobs
+        self.chunkSize = kwargs.pop('chunkSize',500000)
+        self.pool = None
+        self.pending = []
+
+    def submit(self,treeName,files,entries,booked,callback):
+        '''
+        Queue the filling of booked, a list of (hist, weight, xVariable, yVariable, zVariable).
+        callback is called with the merged histograms at join().
+        '''
+        if self.pool is None: self.pool = Pool(self.njobs)
+        chunks = splitEntries(files,entries,self.chunkSize) if booked else []
+        results = [self.pool.apply_async(fillChunk,((treeName,chunkFiles,firstentry,nentries,booked),)) for chunkFiles,firstentry,nentries in chunks]
+        logging.debug('FlattenPool: {0} histograms in {1} chunks'.format(len(booked),len(chunks)))
+        self.pending += [(booked,results,callback)]
+
+    def join(self):
+        '''Wait for all submitted samples, merging and passing on the results in order of submission'''
+        while self.pending:
+            booked, results, callback = self.pending.pop(0)
+            hists = [hist for hist, weight, xVariable, yVariable, zVariable in booked]
+            for result in results:
+                for hist, partial in zip(hists,result.get()):
+                    hist.Add(partial)
+            callback(hists)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
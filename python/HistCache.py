@@ -0,0 +1,103 @@
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+class HistCache(object):
+    '''
+    Least recently used cache of objects read from ROOT files.
+
+    Objects are keyed on (file, path, file modification time) so a rewritten
+    file is never served from the cache. Files are kept open between reads.
+    Cached objects are owned by the cache, callers should Clone what they modify.
+    '''
+
+    def __init__(self,**kwargs):
+        self.maxSize = kwargs.pop('maxSize',512*1024*1024) # bytes
+        self.objects = OrderedDict()
+        self.size = 0
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _getFile(self,fileName):
+        '''Keep a read handle on the file, reopening it if it changed'''
+        if not os.path.isfile(fileName): return 0, None
+        mtime = os.path.getmtime(fileName)
+        if fileName in self.files and self.files[fileName][1]!=mtime:
+            self.closeFile(fileName)
+        if fileName not in self.files:
+            self.files[fileName] = (ROOT.TFile(fileName,'read'), mtime)
+        return self.files[fileName]
+
+    def _getSize(self,obj):
+        '''Approximate memory used by an object'''
+        if obj and obj.InheritsFrom('TH1'):
+            # contents and sum of weights squared, in double precision
+            return obj.GetNcells()*(16 if obj.GetSumw2N() else 8)+1024
+        return 1024
+
+    def get(self,fileName,path):
+        '''Get an object from a file, 0 if it does not exist'''
+        tfile, mtime = self._getFile(fileName)
+        if not tfile: return 0
+        key = (fileName,path,mtime)
+        if key in self.objects:
+            self.hits += 1
+            obj, size = self.objects.pop(key)
+            self.objects[key] = (obj, size)
+            return obj
+        self.misses += 1
+        obj = tfile.Get(path)
+        if obj:
+            if hasattr(obj,'SetDirectory'): obj.SetDirectory(0)
+            ROOT.SetOwnership(obj,True)
+        else:
+            obj = 0 # remember missing objects too
+        size = self._getSize(obj)
+        self.objects[key] = (obj, size)
+        self.size += size
+        self._evict()
+        return obj
+
+    def _evict(self):
+        while self.size>self.maxSize and len(self.objects)>1:
+            key, (obj, size) = self.objects.popitem(last=False)
+            self.size -= size
+
+    def closeFile(self,fileName):
+        '''Close a file and drop its objects, ie before writing to it'''
+        if fileName in self.files:
+            self.files.pop(fileName)[0].Close()
+        for key in [key for key in self.objects if key[0]==fileName]:
+            self.size -= self.objects.pop(key)[1]
+
+    def clear(self):
+        '''Close all files and empty the cache'''
+        for fileName in self.files.keys():
+            self.closeFile(fileName)
+        self.objects = OrderedDict()
+        self.size = 0
+
+    def stats(self):
+        '''Cache counters for tuning maxSize'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'objects': len(self.objects),
+            'size': self.size,
+            'maxSize': self.maxSize,
+            'files': len(self.files),
+        }
+
+# shared by all NtupleWrappers in the process
+histCache = HistCache()
+
+def getHistCache():
+    return histCache
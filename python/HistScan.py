@@ -0,0 +1,94 @@
+import logging
+import sys
+
+import numpy as np
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Plotter.BulkProjection import histToArrays
+
+def divide(num,denom):
+    '''num/denom, 0 where denom is 0'''
+    num, denom = np.broadcast_arrays(np.asarray(num,dtype=float),np.asarray(denom,dtype=float))
+    result = np.zeros(num.shape)
+    np.divide(num,denom,out=result,where=denom!=0)
+    return result
+
+class HistScan(object):
+    '''
+    Yields of a 1D histogram above (or below) every bin edge.
+
+    The contents are read once, each threshold is then an entry of a
+    cumulative sum. Threshold b (0 indexed) uses the visible bins b+1 to
+    nbins, or 1 to b+1 if invert, as Integral(b+1,nbins) or Integral(1,b+1).
+    '''
+
+    def __init__(self,hist):
+        contents, sumw2 = histToArrays(hist)
+        self.underflow = contents[0]
+        self.contents = contents[1:-1]
+        self.sumw2 = sumw2[1:-1]
+        self.nbins = hist.GetNbinsX()
+        axis = hist.GetXaxis()
+        if axis.IsVariableBinSize():
+            self.lowEdges = np.array([axis.GetBinLowEdge(b+1) for b in range(self.nbins)])
+        else:
+            self.lowEdges = axis.GetXmin()+np.arange(self.nbins)*(axis.GetXmax()-axis.GetXmin())/self.nbins
+
+    def total(self):
+        '''Integral of the visible bins'''
+        return self.contents.sum()
+
+    def passing(self,invert=False):
+        '''Yield and sum of weights squared passing each threshold'''
+        if invert:
+            return np.cumsum(self.contents), np.cumsum(self.sumw2)
+        return np.cumsum(self.contents[::-1])[::-1], np.cumsum(self.sumw2[::-1])[::-1]
+
+    def efficiency(self,invert=False):
+        '''Fraction of the visible yield passing each threshold'''
+        return divide(self.passing(invert)[0],self.total())
+
+    def quantileEdges(self,points):
+        '''
+        For each fraction in points, the low edge of the last bin for which the
+        yield up to that bin (including underflow) is below the fraction of the total.
+        None if there is no such bin.
+        '''
+        ratios = divide(self.underflow+np.cumsum(self.contents),self.total())
+        edges = {}
+        for e in points:
+            below = np.nonzero(ratios<e)[0]
+            edges[e] = self.lowEdges[below[-1]] if len(below) else None
+        return edges
+
+def sOverB(sig,bg,invert=False):
+    '''Signal over background and its uncertainty for each threshold'''
+    sigVal, sigErr2 = sig.passing(invert)
+    bgVal, bgErr2 = bg.passing(invert)
+    val = divide(sigVal,bgVal)
+    err = val*np.sqrt(divide(sigErr2,sigVal**2)+divide(bgErr2,bgVal**2))
+    return val, err
+
+def significance(sig,bg,invert=False):
+    '''s/(s+b) for each threshold'''
+    sigVal = sig.passing(invert)[0]
+    bgVal = bg.passing(invert)[0]
+    return divide(sigVal,sigVal+bgVal)
+
+def roc(sig,bg,invert=False):
+    '''Signal efficiency and background rejection for each threshold'''
+    return sig.efficiency(invert), 1.-bg.efficiency(invert)
+
+def arrayToHist(histName,xmin,xmax,vals,errs=None):
+    '''TH1D with uniform bins from an array of values (and errors) for bins 1 to len(vals)'''
+    hist = ROOT.TH1D(histName,histName,len(vals),xmin,xmax)
+    for b,val in enumerate(vals):
+        hist.SetBinContent(b+1,val)
+        hist.SetBinError(b+1,errs[b] if errs is not None else 0.)
+    logging.debug('HistScan: {0} with {1} bins'.format(histName,len(vals)))
+    return hist
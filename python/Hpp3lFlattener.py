@@ -6,12 +6,17 @@ import sys
 import itertools
 import operator
 
+import numpy as np
+
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 from NtupleFlattener import NtupleFlattener
+from DevTools.Plotter.WeightShifts import weightShifts
+from DevTools.Plotter.ColumnChunk import passAll
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.FakeRateTable import getHppFakeRateTable
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
@@ -46,15 +51,14 @@ class Hpp3lFlattener(NtupleFlattener):
             '3lmassCut': lambda row: getattr(row,'3l_mass')>100,
         }
         self.selectionMap = {}
-        self.selectionMap['default'] = lambda row: all([self.baseCutMap[cut](row) for cut in self.baseCutMap])
-        if self.lowmass: self.selectionMap['lowmass'] = lambda row: all([self.lowmassCutMap[cut](row) for cut in self.lowmassCutMap])
+        self.selectionMap['default'] = lambda row: passAll([self.baseCutMap[cut](row) for cut in self.baseCutMap])
+        if self.lowmass: self.selectionMap['lowmass'] = lambda row: passAll([self.lowmassCutMap[cut](row) for cut in self.lowmassCutMap])
 
         # sample signal plot
-        self.cutRegions = {}
-        self.cutRegions[self.mass] = getSelectionMap('Hpp3l',self.mass)
-        self.selectionMap['nMinusOne/massWindow/{0}/hpp0'.format(self.mass)] = lambda row: all([self.cutRegions[self.mass][0][v](row) for v in ['st','zveto','met','dr']])
-        self.selectionMap['nMinusOne/massWindow/{0}/hpp1'.format(self.mass)] = lambda row: all([self.cutRegions[self.mass][1][v](row) for v in ['st','zveto','met','dr']])
-        self.selectionMap['nMinusOne/massWindow/{0}/hpp2'.format(self.mass)] = lambda row: all([self.cutRegions[self.mass][2][v](row) for v in ['st','zveto','met','dr']])
+        self.selectionTable = SelectionTable('Hpp3l',[self.mass])
+        self.selectionMap['nMinusOne/massWindow/{0}/hpp0'.format(self.mass)] = lambda row: self.selectionTable.passes(row,self.mass,0,['st','zveto','met','dr'])
+        self.selectionMap['nMinusOne/massWindow/{0}/hpp1'.format(self.mass)] = lambda row: self.selectionTable.passes(row,self.mass,1,['st','zveto','met','dr'])
+        self.selectionMap['nMinusOne/massWindow/{0}/hpp2'.format(self.mass)] = lambda row: self.selectionTable.passes(row,self.mass,2,['st','zveto','met','dr'])
         
 
         self.selections = []
@@ -103,25 +107,6 @@ class Hpp3lFlattener(NtupleFlattener):
         super(Hpp3lFlattener, self).__init__('Hpp3l',sample,**kwargs)
 
 
-        # alternative fakerates
-        self.fakekey = '{num}_{denom}'
-        self.fakehists = {'electrons': {}, 'muons': {}, 'taus': {},}
-
-        fake_path = '{0}/src/DevTools/Analyzer/data/fakerates_dijet_hpp_13TeV_Run2016BCDEFGH.root'.format(os.environ['CMSSW_BASE'])
-        self.fake_hpp_rootfile = ROOT.TFile(fake_path)
-        self.fakehists['electrons'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile.Get('e/medium_loose/fakeratePtEta')
-        self.fakehists['electrons'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile.Get('e/tight_loose/fakeratePtEta')
-        self.fakehists['electrons'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile.Get('e/tight_medium/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile.Get('m/medium_loose/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile.Get('m/tight_loose/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile.Get('m/tight_medium/fakeratePtEta')
-
-        fake_path = '{0}/src/DevTools/Analyzer/data/fakerates_w_tau_13TeV_Run2016BCDEFGH.root'.format(os.environ['CMSSW_BASE'])
-        self.fake_hpp_rootfile_tau = ROOT.TFile(fake_path)
-        self.fakehists['taus'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile_tau.Get('medium_loose/fakeratePtEta')
-        self.fakehists['taus'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile_tau.Get('tight_loose/fakeratePtEta')
-        self.fakehists['taus'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile_tau.Get('tight_medium/fakeratePtEta')
-
         self.scaleMap = {
             'F' : '{0}_looseScale',
             'P' : '{0}_mediumScale',
@@ -133,34 +118,20 @@ class Hpp3lFlattener(NtupleFlattener):
 
 
     def getFakeRate(self,lep,pt,eta,num,denom):
-        key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
-        if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return getHppFakeRateTable(lep,num,denom).getFakeRate(pt,eta)
 
-    def getWeight(self,row,doFake=False):
+    def getWeights(self,row,doFake=False):
+        '''Weight of the nominal and of each weight shift'''
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
         if row.isData:
+            weights = dict([(shift,1.) for shift in self.weightShifts.shifts])
             weight = 1.
         else:
             # per event weights
-            base = ['genWeight','pileupWeight','triggerEfficiency']
-            if self.shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
-            if self.shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
-            if self.shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
-            if self.shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
-            for l,lep in enumerate(self.leps):
-                shiftString = ''
-                if self.shift == 'lepUp': shiftString = 'Up'
-                if self.shift == 'lepDown': shiftString = 'Down'
-                base += [self.scaleMap['P' if passID[l] else 'F'].format(lep)+shiftString]
-            vals = [getattr(row,scale) for scale in base]
-            for scale,val in zip(base,vals):
-                if val != val: logging.warning('{0}: {1} is NaN'.format(row.channel,scale))
-            weight = prod([val for val in vals if val==val])
+            leptonScales = [(self.scaleMap['P'].format(lep),self.scaleMap['F'].format(lep),passID[l]) for l,lep in enumerate(self.leps)]
+            weights = self.weightShifts.getWeights(row,leptonScales)
             # scale to lumi/xsec
-            weight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
+            weight = float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
             if hasattr(row,'qqZZkfactor'): weight *= row.qqZZkfactor/1.1 # ZZ variable k factor
         # fake scales
         if doFake:
@@ -185,7 +156,7 @@ class Hpp3lFlattener(NtupleFlattener):
 
                     weight *= fakeEff/(1-fakeEff)
 
-        return weight
+        return dict([(shift,weights[shift]*weight) for shift in weights])
 
 
     def perRowAction(self,row):
@@ -195,28 +166,12 @@ class Hpp3lFlattener(NtupleFlattener):
         if not all(passPt): return # all leptons pt>20
 
         # per sample cuts
-        keep = True
-        if self.sample=='DYJetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'  : keep = row.numGenJets==0 or row.numGenJets>4
-        if self.sample=='DY1JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==1
-        if self.sample=='DY2JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==2
-        if self.sample=='DY3JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==3
-        if self.sample=='DY4JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==4
-        if self.sample=='DYJetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'      : keep = row.numGenJets==0 or row.numGenJets>4
-        if self.sample=='DY1JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==1
-        if self.sample=='DY2JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==2
-        if self.sample=='DY3JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==3
-        if self.sample=='DY4JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==4
-        if self.sample=='WJetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'           : keep = row.numGenJets==0 or row.numGenJets>4
-        if self.sample=='W1JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==1
-        if self.sample=='W2JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==2
-        if self.sample=='W3JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==3
-        if self.sample=='W4JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==4
-        if not keep: return
+        if not self.passSampleCuts(row): return
 
 
         # define weights
-        w = self.getWeight(row)
-        wf = self.getWeight(row,doFake=True)
+        w = self.getWeights(row)
+        wf = self.getWeights(row,doFake=True)
 
         # setup channels
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
@@ -250,6 +205,82 @@ class Hpp3lFlattener(NtupleFlattener):
                 if isData or genCut: self.fill(row,fakeChan+'/'+sel,wf,recoChan,genChan)
                 if self.datadrivenRegular:self.fill(row,fakeChan+'_regular/'+sel,w,recoChan,genChan)
 
+    def getChunkWeights(self,chunk,passID,chans,doFake=False):
+        '''Columnar version of getWeights'''
+        n = len(chunk)
+        isData = chunk.isData.astype(bool)
+        weights = dict([(shift,np.ones(n)) for shift in self.weightShifts.shifts])
+        weight = np.ones(n)
+        if not isData.all():
+            # per event weights
+            leptonScales = [(self.scaleMap['P'].format(lep),self.scaleMap['F'].format(lep),passID[l]) for l,lep in enumerate(self.leps)]
+            mcweights = self.weightShifts.getWeights(chunk,leptonScales)
+            # scale to lumi/xsec
+            mcweight = np.ones(n)*(float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.)
+            if hasattr(chunk,'qqZZkfactor'): mcweight *= chunk.qqZZkfactor/1.1 # ZZ variable k factor
+            weights = dict([(shift,np.where(isData,1.,mcweights[shift]*mcweight)) for shift in mcweights])
+        # fake scales
+        if doFake:
+            chanMap = {'e': 'electrons', 'm': 'muons', 't': 'taus',}
+            nf = sum([~p for p in passID])
+            weight = np.where((nf%2==0) & (nf>0),-weight,weight)
+            weight = np.where(~isData & (nf>0),-weight,weight) # subtract off MC in control
+            for l,lep in enumerate(self.leps):
+                fail = ~passID[l]
+                if not fail.any(): continue
+                pts = getattr(chunk,'{0}_pt'.format(lep))
+                etas = getattr(chunk,'{0}_eta'.format(lep))
+                flavors = np.array([c[l] for c in chans])
+                fakeEff = np.zeros(n)
+                for flavor in chanMap:
+                    sel = fail & (flavors==flavor)
+                    if sel.any(): fakeEff[sel] = self.getFakeRateColumn(chanMap[flavor], pts[sel], etas[sel], 'HppMedium','HppLoose')
+                weight = np.where(fail,weight*fakeEff/(1-fakeEff),weight)
+
+        return dict([(shift,weights[shift]*weight) for shift in weights])
+
+    def perChunkAction(self,chunk):
+        isData = chunk.isData.astype(bool)
+
+        keep = passAll([getattr(chunk,'{0}_pt'.format(l))>20 for l in self.leps]) # all leptons pt>20
+
+        # per sample cuts
+        keep = keep & self.passSampleCuts(chunk)
+        if not keep.any(): return
+
+        # setup channels
+        passID = [getattr(chunk,self.lepID.format(l)).astype(bool) for l in self.leps]
+        nf = sum([~p for p in passID])
+        fakeChans = np.array(['{0}P{1}F'.format(3-f,f) for f in range(4)])[nf]
+        chans = [''.join([x for x in c if x in 'emt']) for c in chunk.channel]
+        recoChan = np.array([''.join(sorted(c[:2]) + sorted(c[2:3])) for c in chans])
+        genChan = None
+        if self.doGen and not self.isData and 'HPlusPlus' in self.sample:
+            if 'HPlusPlusHMinusMinus' in self.sample:
+                genChan = np.array([''.join(sorted(g[:2]) + sorted(g[2:4])) for g in chunk.genChannel])
+            else:
+                genChan = np.array([''.join(sorted(g[:2]) + sorted(g[2:3])) for g in chunk.genChannel])
+
+        # define weights
+        w = self.getChunkWeights(chunk,passID,chans)
+        wf = self.getChunkWeights(chunk,passID,chans,doFake=True)
+
+        # define count regions
+        genCut = isData
+        if not isData.all():
+            genCut = isData | passAll([getattr(chunk,'{0}_genMatch'.format(lep)).astype(bool) & (getattr(chunk,'{0}_genDeltaR'.format(lep))<0.1) for lep in self.leps])
+
+        # define plot regions
+        allPass = passAll(passID)
+        for sel in self.selectionMap:
+            result = keep & self.selectionMap[sel](chunk)
+            self.fillChunk(chunk,sel,result & allPass,w,recoChan,genChan)
+            if not self.datadriven: continue
+            for fakeChan in np.unique(fakeChans[result]):
+                fakeResult = result & (fakeChans==fakeChan)
+                self.fillChunk(chunk,fakeChan+'/'+sel,fakeResult & genCut,wf,recoChan,genChan)
+                if self.datadrivenRegular: self.fillChunk(chunk,fakeChan+'_regular/'+sel,fakeResult,w,recoChan,genChan)
+
 
 
 def parse_command_line(argv):
@@ -258,6 +289,7 @@ def parse_command_line(argv):
     #parser.add_argument('sample', type=str, default='DoubleMuon', nargs='?', help='Sample to flatten')
     parser.add_argument('sample', type=str, default='HPlusPlusHMinusHTo3L_M-500_13TeV-calchep-pythia8', nargs='?', help='Sample to flatten')
     parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
+    parser.add_argument('--shifts', nargs='*', type=str, default=[], choices=weightShifts, help='Weight shifts to fill in the same pass')
 
     return parser.parse_args(argv)
 
@@ -270,6 +302,7 @@ def main(argv=None):
     flattener = Hpp3lFlattener(
         args.sample,
         shift=args.shift,
+        shifts=args.shifts,
     )
 
     flattener.flatten()
@@ -9,6 +9,7 @@ import operator
 from NtupleSkimmer import NtupleSkimmer
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.FakeRateTable import getHppFakeRateTable
 
 import ROOT
 
@@ -33,25 +34,7 @@ class Hpp3lSkimmer(NtupleSkimmer):
         self.masses = [200,300,400,500,600,700,800,900,1000,1100,1200,1300,1400,1500]
         if self.isSignal:
             self.masses = [mass for mass in self.masses if 'M-{0}'.format(mass) in self.sample]
-
-        # alternative fakerates
-        self.fakekey = '{num}_{denom}'
-        self.fakehists = {'electrons': {}, 'muons': {}, 'taus': {},}
-
-        fake_path = '{0}/src/DevTools/Analyzer/data/fakerates_dijet_hpp_13TeV_Run2016BCDEFGH.root'.format(os.environ['CMSSW_BASE'])
-        self.fake_hpp_rootfile = ROOT.TFile(fake_path)
-        self.fakehists['electrons'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile.Get('e/medium_loose/fakeratePtEta')
-        self.fakehists['electrons'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile.Get('e/tight_loose/fakeratePtEta')
-        self.fakehists['electrons'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile.Get('e/tight_medium/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile.Get('m/medium_loose/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile.Get('m/tight_loose/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile.Get('m/tight_medium/fakeratePtEta')
-
-        fake_path = '{0}/src/DevTools/Analyzer/data/fakerates_w_tau_13TeV_Run2016BCDEFGH.root'.format(os.environ['CMSSW_BASE'])
-        self.fake_hpp_rootfile_tau = ROOT.TFile(fake_path)
-        self.fakehists['taus'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile_tau.Get('medium_loose/fakeratePtEta')
-        self.fakehists['taus'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile_tau.Get('tight_loose/fakeratePtEta')
-        self.fakehists['taus'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile_tau.Get('tight_medium/fakeratePtEta')
+        self.selectionTable = SelectionTable('Hpp3l',self.masses)
 
         self.scaleMap = {
             'F' : '{0}_looseScale',
@@ -63,11 +46,7 @@ class Hpp3lSkimmer(NtupleSkimmer):
         self.lepID = '{0}_passMedium'
 
     def getFakeRate(self,lep,pt,eta,num,denom):
-        key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
-        if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return getHppFakeRateTable(lep,num,denom).getFakeRate(pt,eta)
 
     def getWeight(self,row,doFake=False):
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
@@ -179,9 +158,7 @@ class Hpp3lSkimmer(NtupleSkimmer):
             'hpp': row.hpp_mass,
             'met': row.met_pt,
         }
-        cutRegions = {}
-        for mass in self.masses:
-            cutRegions[mass] = getSelectionMap('Hpp3l',mass)
+        cuts = self.selectionTable.evaluate(row)
 
         # optimization ranges
         stRange = [x*20 for x in range(100)]
@@ -196,40 +173,32 @@ class Hpp3lSkimmer(NtupleSkimmer):
             self.increment(fakeChan+'_regular',w,recoChan,genChan)
 
             for nTaus in range(3):
-                for mass in self.masses:
+                # all masses at once
+                sides = cuts['st'][:,nTaus] & cuts['zveto'][:,nTaus]
+                if nTaus>0: sides = sides & cuts['met'][:,nTaus]
+                sides = sides & cuts['dr'][:,nTaus]
+                windows = cuts['mass'][:,nTaus]
+                regions = [
+                    ('sideband',      ~sides & ~windows),
+                    ('massWindow',    ~sides & windows),
+                    ('allSideband',   sides & ~windows),
+                    ('allMassWindow', sides & windows),
+                ]
+                for m,mass in enumerate(self.masses):
                     name = '{0}/hpp{1}'.format(mass,nTaus)
-                    sides = []
-                    windows = []
-                    sides += [cutRegions[mass][nTaus]['st'](row)]
-                    sides += [cutRegions[mass][nTaus]['zveto'](row)]
-                    if nTaus>0: sides += [cutRegions[mass][nTaus]['met'](row)]
-                    sides += [cutRegions[mass][nTaus]['dr'](row)]
-                    windows += [cutRegions[mass][nTaus]['mass'](row)]
-                    massWindowOnly = all(windows)
-                    sideband = not all(sides) and not all(windows)
-                    massWindow = not all(sides) and all(windows)
-                    allSideband = all(sides) and not all(windows)
-                    allMassWindow = all(sides) and all(windows)
+                    massWindowOnly = windows[m]
                     if not self.optimize:
-                        if sideband:
-                            if all(passID): self.increment('new/sideband/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/sideband/'+name,wf,recoChan,genChan)
-                        if massWindow:
-                            if all(passID): self.increment('new/massWindow/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/massWindow/'+name,wf,recoChan,genChan)
-                        if allSideband:
-                            if all(passID): self.increment('new/allSideband/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/allSideband/'+name,wf,recoChan,genChan)
-                        if allMassWindow:
-                            if all(passID): self.increment('new/allMassWindow/'+name,w,recoChan,genChan)
-                            if isData or genCut: self.increment(fakeChan+'/new/allMassWindow/'+name,wf,recoChan,genChan)
+                        for region, result in regions:
+                            if not result[m]: continue
+                            if all(passID): self.increment('new/{0}/'.format(region)+name,w,recoChan,genChan)
+                            if isData or genCut: self.increment(fakeChan+'/new/{0}/'.format(region)+name,wf,recoChan,genChan)
                     # run the grid of values
                     if self.optimize:
                         if not massWindowOnly: continue
-                        nMinusOneSt = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][nTaus]['dr'](row), cutRegions[mass][nTaus]['met'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        nMinusOneZveto = all([cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['dr'](row), cutRegions[mass][nTaus]['met'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        nMinusOneDR = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['met'](row), cutRegions[mass][nTaus]['mass'](row)])
-                        nMinusOneMet = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][nTaus]['dr'](row), cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['mass'](row)])
+                        nMinusOneSt = all([cuts['zveto'][m,nTaus], cuts['dr'][m,nTaus], cuts['met'][m,nTaus], cuts['mass'][m,nTaus]])
+                        nMinusOneZveto = all([cuts['st'][m,nTaus], cuts['dr'][m,nTaus], cuts['met'][m,nTaus], cuts['mass'][m,nTaus]])
+                        nMinusOneDR = all([cuts['zveto'][m,nTaus], cuts['st'][m,nTaus], cuts['met'][m,nTaus], cuts['mass'][m,nTaus]])
+                        nMinusOneMet = all([cuts['zveto'][m,nTaus], cuts['dr'][m,nTaus], cuts['st'][m,nTaus], cuts['mass'][m,nTaus]])
                         # 1D no cuts
                         if self.var=='st':
                             for stCutVal in stRange:
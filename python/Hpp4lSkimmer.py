@@ -6,9 +6,13 @@ import sys
 import itertools
 import operator
 
+import numpy as np
+
 from NtupleSkimmer import NtupleSkimmer
+from DevTools.Plotter.CutScan import CutScan
 from DevTools.Utilities.utilities import prod, ZMASS
 from DevTools.Plotter.higgsUtilities import *
+from DevTools.Plotter.FakeRateTable import getHppFakeRateTable
 
 import ROOT
 
@@ -24,8 +28,9 @@ class Hpp4lSkimmer(NtupleSkimmer):
         super(Hpp4lSkimmer, self).__init__('Hpp4l',sample,**kwargs)
 
         # test if we want to run the optimization routine
-        self.optimize = False
-        self.var = 'st'
+        # var is one of st, zveto, dr or grid (all three at once)
+        self.optimize = kwargs.pop('optimize',False)
+        self.var = kwargs.pop('optimizeVar','st')
 
         # setup output files
         self.leps = ['hpp1','hpp2','hmm1','hmm2']
@@ -35,25 +40,24 @@ class Hpp4lSkimmer(NtupleSkimmer):
         self.masses = [200,300,400,500,600,700,800,900,1000,1100,1200,1300,1400,1500]
         if self.isSignal:
             self.masses = [mass for mass in self.masses if 'M-{0}'.format(mass) in self.sample]
+        self.selectionTable = SelectionTable('Hpp4l',self.masses)
+        self.regionNames = {}
 
-        # alternative fakerates
-        self.fakekey = '{num}_{denom}'
-        self.fakehists = {'electrons': {}, 'muons': {}, 'taus': {},}
-
-        fake_path = '{0}/src/DevTools/Analyzer/data/fakerates_dijet_hpp_13TeV_Run2016BCDEFGH.root'.format(os.environ['CMSSW_BASE'])
-        self.fake_hpp_rootfile = ROOT.TFile(fake_path)
-        self.fakehists['electrons'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile.Get('e/medium_loose/fakeratePtEta')
-        self.fakehists['electrons'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile.Get('e/tight_loose/fakeratePtEta')
-        self.fakehists['electrons'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile.Get('e/tight_medium/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile.Get('m/medium_loose/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile.Get('m/tight_loose/fakeratePtEta')
-        self.fakehists['muons'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile.Get('m/tight_medium/fakeratePtEta')
-
-        fake_path = '{0}/src/DevTools/Analyzer/data/fakerates_w_tau_13TeV_Run2016BCDEFGH.root'.format(os.environ['CMSSW_BASE'])
-        self.fake_hpp_rootfile_tau = ROOT.TFile(fake_path)
-        self.fakehists['taus'][self.fakekey.format(num='HppMedium',denom='HppLoose')] = self.fake_hpp_rootfile_tau.Get('medium_loose/fakeratePtEta')
-        self.fakehists['taus'][self.fakekey.format(num='HppTight',denom='HppLoose')] = self.fake_hpp_rootfile_tau.Get('tight_loose/fakeratePtEta')
-        self.fakehists['taus'][self.fakekey.format(num='HppTight',denom='HppMedium')] = self.fake_hpp_rootfile_tau.Get('tight_medium/fakeratePtEta')
+        # optimization ranges
+        self.stRange = [x*20 for x in range(100)]
+        self.zvetoRange = [x*5 for x in range(20)]
+        self.drRange = [1.5+x*0.1 for x in range(50)]
+        scanCuts = {
+            'st'   : ('st',    self.stRange,    '>'),
+            'zveto': ('zdiff', self.zvetoRange, '>'),
+            'dr'   : ('dr',    self.drRange,    '<'),
+        }
+        if self.var=='grid':
+            self.cutScan = CutScan([scanCuts[var] for var in ['st','zveto','dr']])
+            self.cutScanName = 'optimize/st{0}/zveto{1}/dr{2}/'
+        else:
+            self.cutScan = CutScan([scanCuts[self.var]])
+            self.cutScanName = 'optimize/'+self.var+'/{0}/'
 
         self.scaleMap = {
             'F' : '{0}_looseScale',
@@ -65,11 +69,7 @@ class Hpp4lSkimmer(NtupleSkimmer):
         self.lepID = '{0}_passMedium'
 
     def getFakeRate(self,lep,pt,eta,num,denom):
-        key = self.fakekey.format(num=num,denom=denom)
-        hist = self.fakehists[lep][key]
-        if pt > 100.: pt = 99.
-        b = hist.FindBin(pt,abs(eta))
-        return hist.GetBinContent(b), hist.GetBinError(b)
+        return getHppFakeRateTable(lep,num,denom).getFakeRate(pt,eta)
 
     def getWeight(self,row,doFake=False):
         passID = [getattr(row,self.lepID.format(l)) for l in self.leps]
@@ -179,14 +179,7 @@ class Hpp4lSkimmer(NtupleSkimmer):
             'hpp': row.hpp_mass,
             'hmm': row.hmm_mass,
         }
-        cutRegions = {}
-        for mass in self.masses:
-            cutRegions[mass] = getSelectionMap('Hpp4l',mass)
-
-        # optimization ranges
-        stRange = [x*20 for x in range(100)]
-        zvetoRange = [x*5 for x in range(20)]
-        drRange = [1.5+x*0.1 for x in range(50)]
+        cuts = self.selectionTable.evaluate(row)
 
         # increment counts
         if default:
@@ -197,75 +190,68 @@ class Hpp4lSkimmer(NtupleSkimmer):
             for pTaus in range(3):
                 for mTaus in range(3):
                     nTaus = max(pTaus,mTaus)
-                    for mass in self.masses:
+                    # all masses at once
+                    sides = cuts['st'][:,nTaus]
+                    if nTaus>0: sides = sides & cuts['zveto'][:,nTaus]
+                    if pTaus>1: sides = sides & cuts['drpp'][:,pTaus]
+                    if mTaus>1: sides = sides & cuts['drmm'][:,mTaus]
+                    windows = cuts['hpp'][:,pTaus] & cuts['hpp'][:,mTaus]
+                    regions = [
+                        ('sideband',      ~sides & ~windows),
+                        ('massWindow',    ~sides & windows),
+                        ('allSideband',   sides & ~windows),
+                        ('allMassWindow', sides & windows),
+                    ]
+                    if not self.optimize:
+                        # all masses passing a region in one increment
+                        for region, result in regions:
+                            if not result.any(): continue
+                            if all(passID): self.accumulator.incrementMany(self.accumulator.getIndices(self.getRegionNames('',region,pTaus,mTaus),recoChan,genChan)[result],w)
+                            if isData or genCut: self.accumulator.incrementMany(self.accumulator.getIndices(self.getRegionNames(fakeChan+'/',region,pTaus,mTaus),recoChan,genChan)[result],wf)
+                        continue
+                    # run the grid of values, optimize only 0,0 1,1 or 2,2 taus
+                    if pTaus!=mTaus: continue
+                    # fill the fine binned scan, the yields for each cut value are computed in dump
+                    vals = {
+                        'st': v['st'],
+                        'zdiff': v['zdiff'],
+                        'dr': np.maximum(v['drpp'],v['drmm']),
+                    }
+                    scanVals = [vals[var] for var in self.cutScan.names]
+                    for m,mass in enumerate(self.masses):
+                        massWindowOnly = windows[m]
+                        if not massWindowOnly: continue
                         name = '{0}/hpp{1}hmm{2}'.format(mass,pTaus,mTaus)
-                        sides = []
-                        windows = []
-                        sides += [cutRegions[mass][nTaus]['st'](row)]
-                        if nTaus>0: sides += [cutRegions[mass][nTaus]['zveto'](row)]
-                        if pTaus>1: sides += [cutRegions[mass][pTaus]['drpp'](row)]
-                        if mTaus>1: sides += [cutRegions[mass][mTaus]['drmm'](row)]
-                        windows += [cutRegions[mass][pTaus]['hpp'](row)]
-                        windows += [cutRegions[mass][mTaus]['hpp'](row)]
-                        massWindowOnly = all(windows)
-                        sideband = not all(sides) and not all(windows)
-                        massWindow = not all(sides) and all(windows)
-                        allSideband = all(sides) and not all(windows)
-                        allMassWindow = all(sides) and all(windows)
-                        if not self.optimize:
-                            if sideband:
-                                if all(passID): self.increment('new/sideband/'+name,w,recoChan,genChan)
-                                if isData or genCut: self.increment(fakeChan+'/new/sideband/'+name,wf,recoChan,genChan)
-                            if massWindow:
-                                if all(passID): self.increment('new/massWindow/'+name,w,recoChan,genChan)
-                                if isData or genCut: self.increment(fakeChan+'/new/massWindow/'+name,wf,recoChan,genChan)
-                            if allSideband:
-                                if all(passID): self.increment('new/allSideband/'+name,w,recoChan,genChan)
-                                if isData or genCut: self.increment(fakeChan+'/new/allSideband/'+name,wf,recoChan,genChan)
-                            if allMassWindow:
-                                if all(passID): self.increment('new/allMassWindow/'+name,w,recoChan,genChan)
-                                if isData or genCut: self.increment(fakeChan+'/new/allMassWindow/'+name,wf,recoChan,genChan)
-                        # run the grid of values
-                        if self.optimize:
-                            # optimize only 0,0 1,1 or 2,2 taus
-                            if pTaus!=mTaus: continue
-                            if not massWindowOnly: continue
-                            # 1D no cuts
-                            nMinusOneSt = all([cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][pTaus]['drpp'](row), cutRegions[mass][mTaus]['drmm'](row), cutRegions[mass][pTaus]['hpp'](row), cutRegions[mass][mTaus]['hmm'](row)])
-                            nMinusOneZveto = all([cutRegions[mass][nTaus]['st'](row), cutRegions[mass][pTaus]['drpp'](row), cutRegions[mass][mTaus]['drmm'](row), cutRegions[mass][pTaus]['hpp'](row), cutRegions[mass][mTaus]['hmm'](row)])
-                            nMinusOneDR = all([cutRegions[mass][nTaus]['st'](row), cutRegions[mass][nTaus]['zveto'](row), cutRegions[mass][pTaus]['hpp'](row), cutRegions[mass][mTaus]['hmm'](row)])
-                            if self.var=='st':
-                                for stCutVal in stRange:
-                                    if v['st']>stCutVal and nMinusOneSt:
-                                        if all(passID): self.increment('optimize/st/{0}/{1}'.format(stCutVal,name),w,recoChan,genChan)
-                                        if isData or genCut: self.increment(fakeChan+'/optimize/st/{0}/{1}'.format(stCutVal,name),wf,recoChan,genChan)
-                            if self.var=='zveto':
-                                for zvetoCutVal in zvetoRange:
-                                    if v['zdiff']>zvetoCutVal and nMinusOneZveto:
-                                        if all(passID): self.increment('optimize/zveto/{0}/{1}'.format(zvetoCutVal,name),w,recoChan,genChan)
-                                        if isData or genCut: self.increment(fakeChan+'/optimize/zveto/{0}/{1}'.format(zvetoCutVal,name),wf,recoChan,genChan)
-                            if self.var=='dr':
-                                for drCutVal in drRange:
-                                    if v['drpp']<drCutVal and v['drmm']<drCutVal and nMinusOneDR:
-                                        if all(passID): self.increment('optimize/dr/{0}/{1}'.format(drCutVal,name),w,recoChan,genChan)
-                                        if isData or genCut: self.increment(fakeChan+'/optimize/dr/{0}/{1}'.format(drCutVal,name),wf,recoChan,genChan)
-                            # nD
-                            #for stCutVal in stRange:
-                            #    if v['st']<stCutVal: continue
-                            #    for zvetoCutVal in zvetoRange:
-                            #        if v['zdiff']<zvetoCutVal: continue
-                            #        for drCutVal in drRange:
-                            #            if v['drpp']>drCutVal or v['drmm']>drCutVal: continue
-                            #            if all(passID): self.increment('optimize/st{0}/zveto{1}/dr{2}/{3}'.format(stCutVal,zvetoCutVal,drCutVal,name),w,recoChan,genChan)
-                            #            if isData or genCut: self.increment(fakeChan+'optimize/st{0}/zveto{1}/dr{2}/{3}'.format(stCutVal,zvetoCutVal,drCutVal,name),wf,recoChan,genChan)
-
-                    
+                        # 1D no cuts
+                        nMinusOneSt = all([cuts['zveto'][m,nTaus], cuts['drpp'][m,pTaus], cuts['drmm'][m,mTaus], cuts['hpp'][m,pTaus], cuts['hmm'][m,mTaus]])
+                        nMinusOneZveto = all([cuts['st'][m,nTaus], cuts['drpp'][m,pTaus], cuts['drmm'][m,mTaus], cuts['hpp'][m,pTaus], cuts['hmm'][m,mTaus]])
+                        nMinusOneDR = all([cuts['st'][m,nTaus], cuts['zveto'][m,nTaus], cuts['hpp'][m,pTaus], cuts['hmm'][m,mTaus]])
+                        passScan = {
+                            'st': nMinusOneSt,
+                            'zveto': nMinusOneZveto,
+                            'dr': nMinusOneDR,
+                            'grid': True,
+                        }
+                        if not passScan[self.var]: continue
+                        if all(passID): self.cutScan.fill(self.cutScanName+name,scanVals,w,recoChan,genChan)
+                        if isData or genCut: self.cutScan.fill(fakeChan+'/'+self.cutScanName+name,scanVals,wf,recoChan,genChan)
 
         if lowmass:
             if all(passID): self.increment('lowmass',w,recoChan,genChan)
             if isData or genCut: self.increment(fakeChan+'/lowmass',wf,recoChan,genChan)
             self.increment(fakeChan+'_regular/lowmass',w,recoChan,genChan)
 
+    def getRegionNames(self,prefix,region,pTaus,mTaus):
+        '''Count names of a region for all masses, formatted once'''
+        key = (prefix,region,pTaus,mTaus)
+        if key not in self.regionNames:
+            self.regionNames[key] = tuple([prefix+'new/{0}/{1}/hpp{2}hmm{3}'.format(region,mass,pTaus,mTaus) for mass in self.masses])
+        return self.regionNames[key]
+
+    def dump(self):
+        if self.optimize: self.counts.update(self.cutScan.getCounts())
+        super(Hpp4lSkimmer, self).dump()
+
 
 
 def parse_command_line(argv):
@@ -0,0 +1,156 @@
+import logging
+import sys
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Plotter.BranchPruning import getLoadedTree, setFormulaCache, resetCache
+
+# compiled event loop, declared to the interpreter on first use
+multiDrawCode = '''
+#include <algorithm>
+#include <string>
+#include <vector>
+#include "TTree.h"
+#include "TTreeFormula.h"
+#include "TH1.h"
+#include "TH2.h"
+#include "TH3.h"
+
+namespace DevToolsPlotter {
+
+// Fill all booked histograms in a single pass over the tree.
+// Each expression is compiled once and evaluated at most once per entry,
+// weights are evaluated first so the variables are only read for entries
+// that pass the selection of at least one histogram.
+void multiDraw(TTree* tree,
+               const std::vector<std::string>& expressions,
+               const std::vector<TH1*>& hists,
+               const std::vector<int>& weights,
+               const std::vector<int>& xs,
+               const std::vector<int>& ys,
+               const std::vector<int>& zs,
+               Long64_t nentries, Long64_t firstentry) {
+  if (!tree || hists.empty()) return;
+  if (tree->LoadTree(firstentry)<0) return;
+  std::vector<TTreeFormula*> formulas;
+  for (size_t i=0; i<expressions.size(); ++i) {
+    TTreeFormula* formula = new TTreeFormula(Form("multiDraw_%d",(int)i),expressions[i].c_str(),tree);
+    if (formula->GetNdim()==0) ::Error("multiDraw","Failed to compile %s",expressions[i].c_str());
+    formula->SetQuickLoad(kTRUE);
+    formulas.push_back(formula);
+  }
+  std::vector<double> values(formulas.size(),0.);
+  std::vector<char> evaluated(formulas.size(),0);
+  auto eval = [&](int i) -> double {
+    if (!evaluated[i]) {
+      values[i] = (formulas[i]->GetNdim() && formulas[i]->GetNdata()>0) ? formulas[i]->EvalInstance(0) : 0.;
+      evaluated[i] = 1;
+    }
+    return values[i];
+  };
+  Long64_t last = tree->GetEntries();
+  if (nentries>=0 && firstentry+nentries<last) last = firstentry+nentries;
+  Int_t treeNumber = tree->GetTreeNumber();
+  for (Long64_t entry=firstentry; entry<last; ++entry) {
+    if (tree->LoadTree(entry)<0) break;
+    if (tree->GetTreeNumber()!=treeNumber) {
+      treeNumber = tree->GetTreeNumber();
+      for (size_t i=0; i<formulas.size(); ++i) formulas[i]->UpdateFormulaLeaves();
+    }
+    std::fill(evaluated.begin(),evaluated.end(),0);
+    for (size_t h=0; h<hists.size(); ++h) {
+      double w = eval(weights[h]);
+      if (w==0) continue;
+      if (zs[h]>=0) {
+        ((TH3*)hists[h])->Fill(eval(xs[h]),eval(ys[h]),eval(zs[h]),w);
+      }
+      else if (ys[h]>=0) {
+        ((TH2*)hists[h])->Fill(eval(xs[h]),eval(ys[h]),w);
+      }
+      else {
+        hists[h]->Fill(eval(xs[h]),w);
+      }
+    }
+  }
+  for (size_t i=0; i<formulas.size(); ++i) delete formulas[i];
+}
+
+}
+'''
+
+multiDrawDeclared = False
+
+def declareMultiDraw():
+    '''Compile the event loop, once per process.'''
+    global multiDrawDeclared
+    if multiDrawDeclared: return
+    ROOT.gInterpreter.Declare(multiDrawCode)
+    multiDrawDeclared = True
+
+class MultiDraw(object):
+    '''
+    Book histograms on a tree and fill them all in a single pass.
+
+    Equivalent to calling tree.Draw('z:y:x>>hist',weight) for each booked
+    histogram, but each entry is only read once. The formulas only read
+    their own branches, and unless cache is False those branches are put
+    in a TTreeCache of their size for the loop, the tree gets a new
+    cache learning its branches afterwards.
+    '''
+
+    def __init__(self,tree,**kwargs):
+        self.tree = tree
+        self.cache = kwargs.pop('cache',True)
+        self.expressions = []
+        self.expressionIndex = {}
+        self.hists = []
+        self.weights = []
+        self.xs = []
+        self.ys = []
+        self.zs = []
+
+    def _getIndex(self,expression):
+        '''Deduplicate expressions so each is only evaluated once per entry.'''
+        if not expression: return -1
+        expression = str(expression)
+        if expression not in self.expressionIndex:
+            self.expressionIndex[expression] = len(self.expressions)
+            self.expressions += [expression]
+        return self.expressionIndex[expression]
+
+    def book(self,hist,weight,xVariable,yVariable='',zVariable=''):
+        '''Book a histogram to be filled with xVariable (and y/z) weighted by weight'''
+        self.hists += [hist]
+        self.weights += [self._getIndex(weight)]
+        self.xs += [self._getIndex(xVariable)]
+        self.ys += [self._getIndex(yVariable)]
+        self.zs += [self._getIndex(zVariable)]
+        return hist
+
+    def fill(self,nentries=-1,firstentry=0):
+        '''Loop over the tree and fill all booked histograms'''
+        if not self.hists: return []
+        if not self.tree: return self.hists
+        declareMultiDraw()
+        expressions = ROOT.std.vector('string')()
+        for expression in self.expressions: expressions.push_back(expression)
+        hists = ROOT.std.vector('TH1*')()
+        for hist in self.hists: hists.push_back(hist)
+        indices = []
+        for vals in [self.weights,self.xs,self.ys,self.zs]:
+            vec = ROOT.std.vector('int')()
+            for val in vals: vec.push_back(val)
+            indices += [vec]
+        cached = 0
+        if self.cache and getLoadedTree(self.tree):
+            cacheSize = self.tree.GetCacheSize()
+            cached = setFormulaCache(self.tree,self.expressions)
+        logging.debug('MultiDraw: {0} histograms from {1} expressions'.format(len(self.hists),len(self.expressions)))
+        ROOT.DevToolsPlotter.multiDraw(self.tree,expressions,hists,indices[0],indices[1],indices[2],indices[3],nentries,firstentry)
+        # later draws on the tree learn their own branches again
+        if cached: resetCache(self.tree,cacheSize)
+        return self.hists
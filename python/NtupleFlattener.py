@@ -6,6 +6,8 @@ import json
 import pickle
 import time
 
+import numpy as np
+
 sys.argv.append('-b')
 import ROOT
 sys.argv.pop()
@@ -15,6 +17,13 @@ ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 
 from DevTools.Plotter.xsec import getXsec
 from DevTools.Plotter.utilities import getLumi, isData, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getNewFlatHistograms
+from DevTools.Plotter.ColumnChunk import iterChunks, asColumn, fillColumns
+from DevTools.Plotter.NtupleMetadata import getFileMetadata
+from DevTools.Plotter.NtupleStaging import getNtupleStaging
+from DevTools.Plotter.FakeRateTable import getHppFakeRateTable
+from DevTools.Plotter.WeightShifts import WeightShifts, weightShifts
+from DevTools.Plotter.Profiler import Profiler, getProfileReport
+from DevTools.Plotter.BranchPruning import BranchPruner
 
 try:
     from progressbar import ProgressBar, ETA, Percentage, Bar, SimpleProgress
@@ -24,6 +33,25 @@ except:
 
 CMSSW_BASE = os.environ['CMSSW_BASE']
 
+# stitching of the inclusive and jet binned samples
+numGenJetsCuts = {
+    'DYJetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'  : lambda row: (row.numGenJets==0) | (row.numGenJets>4),
+    'DY1JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : lambda row: row.numGenJets==1,
+    'DY2JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : lambda row: row.numGenJets==2,
+    'DY3JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : lambda row: row.numGenJets==3,
+    'DY4JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : lambda row: row.numGenJets==4,
+    'DYJetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'      : lambda row: (row.numGenJets==0) | (row.numGenJets>4),
+    'DY1JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : lambda row: row.numGenJets==1,
+    'DY2JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : lambda row: row.numGenJets==2,
+    'DY3JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : lambda row: row.numGenJets==3,
+    'DY4JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : lambda row: row.numGenJets==4,
+    'WJetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'           : lambda row: (row.numGenJets==0) | (row.numGenJets>4),
+    'W1JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : lambda row: row.numGenJets==1,
+    'W2JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : lambda row: row.numGenJets==2,
+    'W3JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : lambda row: row.numGenJets==3,
+    'W4JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : lambda row: row.numGenJets==4,
+}
+
 class NtupleFlattener(object):
     '''Loop over tree and store weights'''
 
@@ -37,9 +65,48 @@ class NtupleFlattener(object):
         # backup passing custom parameters
         self.ntupleDirectory = kwargs.pop('ntupleDirectory','{0}/{1}'.format(getNtupleDirectory(self.analysis,shift=self.shift),self.sample))
         self.inputFileList = kwargs.pop('inputFileList','')
-        self.outputFile = kwargs.pop('outputFile',getNewFlatHistograms(self.analysis,self.sample,shift=self.shift))
+        outputFile = kwargs.pop('outputFile','')
+        self.outputFile = outputFile if outputFile else getNewFlatHistograms(self.analysis,self.sample,shift=self.shift)
         if os.path.dirname(self.outputFile): python_mkdir(os.path.dirname(self.outputFile))
+        # weight shifts filled in the same pass, each into its own output file
+        self.shifts = [s for s in kwargs.pop('shifts',[]) if s!=self.shift]
+        for shift in self.shifts:
+            if shift not in weightShifts: raise ValueError('Unknown weight shift {0}, must be one of {1}'.format(shift,weightShifts))
+        if self.shifts and self.shift and self.shift not in weightShifts:
+            logging.warning('Weight shifts can not be combined with {0}, processing only {0}'.format(self.shift))
+            self.shifts = []
+        if self.shifts and not hasattr(self,'getWeights'):
+            logging.warning('{0} does not support weight shifts, processing only the nominal'.format(self.__class__.__name__))
+            self.shifts = []
+        self.weightShifts = WeightShifts([self.shift]+self.shifts,sample=self.sample)
+        self.shiftOutputFiles = {}
+        for shift in self.shifts:
+            if outputFile:
+                self.shiftOutputFiles[shift] = '{0}_{1}.root'.format(outputFile[:-5] if outputFile.endswith('.root') else outputFile,shift)
+            else:
+                self.shiftOutputFiles[shift] = getNewFlatHistograms(self.analysis,self.sample,shift=shift)
+            if os.path.dirname(self.shiftOutputFiles[shift]): python_mkdir(os.path.dirname(self.shiftOutputFiles[shift]))
         self.treeName = kwargs.pop('treeName',getTreeName(self.analysis))
+        # read the ntuples from local copies, see NtupleStaging
+        self.staging = kwargs.pop('staging','')
+        self.stagingSize = kwargs.pop('stagingSize',0)
+        # time the event loop and write a JSON report at the end of flatten
+        self.profile = kwargs.pop('profile',False)
+        if outputFile:
+            self.profileReport = kwargs.pop('profileReport',self.outputFile.replace('.root','.profile.root'))
+        else:
+            self.profileReport = kwargs.pop('profileReport',getProfileReport('flatten',self.analysis,self.sample,shift=self.shift))
+        self.profiler = None
+        # only read the branches perRowAction uses, found by tracing the first traceEntries rows
+        self.pruneBranches = kwargs.pop('pruneBranches',True)
+        self.traceEntries = kwargs.pop('traceEntries',1000)
+        self.pruner = None
+        # process the tree in chunks of numpy columns with perChunkAction
+        self.columnar = kwargs.pop('columnar',False)
+        self.chunkSize = kwargs.pop('chunkSize',100000)
+        if self.columnar and not hasattr(self,'perChunkAction'):
+            logging.warning('{0} does not support columnar mode, processing row by row'.format(self.__class__.__name__))
+            self.columnar = False
         if hasProgress:
             self.pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' ',Percentage(),' ',Bar(),' ',ETA()]))
         else:
@@ -49,6 +116,8 @@ class NtupleFlattener(object):
         self.tchain = 0
         self.initialized = False
         self.hists = {}
+        self.shiftHists = {self.shift: self.hists}
+        for shift in self.shifts: self.shiftHists[shift] = {}
 
     def __initializeNtuple(self):
         tchain = ROOT.TChain(self.treeName)
@@ -60,18 +129,23 @@ class NtupleFlattener(object):
         else: # reading from an input directory (all files in directory will be processed)
             allFiles = glob.glob('{0}/*.root'.format(self.ntupleDirectory))
         if len(allFiles)==0: logging.error('No files found for sample {0}'.format(self.sample))
-        summedWeights = 0.
-        for f in allFiles:
-            tfile = ROOT.TFile.Open(f)
-            summedWeights += tfile.Get("summedWeights").GetBinContent(1)
-            tfile.Close()
-            tchain.Add(f)
+        metadata = getFileMetadata(allFiles,self.treeName)
+        summedWeights = sum([m['summedWeights'] for m in metadata])
+        staging = getNtupleStaging(self.staging,maxSize=self.stagingSize)
+        chainFiles = staging.stageFiles(allFiles) if staging else allFiles
+        for f,m in zip(chainFiles,metadata):
+            # passing the known entries saves the chain from opening every file
+            if m['entries']>0:
+                tchain.Add(f,m['entries'])
+            else:
+                tchain.Add(f)
         if not summedWeights and not isData(self.sample): logging.warning('No events for sample {0}'.format(self.sample))
         self.intLumi = float(getLumi())
         self.xsec = getXsec(self.sample)
         self.sampleLumi = float(summedWeights)/self.xsec if self.xsec else 0.
         self.sampleTree = tchain
         self.files = allFiles
+        self.chainFiles = chainFiles
         self.initialized = True
         logging.debug('Initialized {0}: summedWeights = {1}; xsec = {2}; sampleLumi = {3}; intLumi = {4}'.format(self.sample,summedWeights,self.xsec,self.sampleLumi,self.intLumi))
 
@@ -91,6 +165,10 @@ class NtupleFlattener(object):
                         xbins = self.histParams[hist]['xBinning']
                         self.hists[histName] = ROOT.TH1D(histName,histName,xbins[0],xbins[1],xbins[2])
                         self.hists[histName].Sumw2()
+                        for shift in self.shifts:
+                            name = '{0}/{1}'.format(shift,histName)
+                            self.shiftHists[shift][histName] = ROOT.TH1D(name,name,xbins[0],xbins[1],xbins[2])
+                            self.shiftHists[shift][histName].Sumw2()
 
     def getTree(self):
         if not self.initialized: self.__initializeNtuple()
@@ -108,6 +186,15 @@ class NtupleFlattener(object):
         sys.stdout.flush()
         sys.stderr.flush()
 
+    def getRows(self):
+        '''Rows of the tree, pruned to the branches in use if pruneBranches'''
+        rows = self.sampleTree
+        if self.pruneBranches:
+            self.pruner = BranchPruner(self.sampleTree,traceEntries=self.traceEntries)
+            rows = self.pruner.iterate()
+        if self.profiler: rows = self.profiler.iterate(rows)
+        return rows
+
     def flatten(self):
         '''
         Primary access loop for flattening.
@@ -115,21 +202,41 @@ class NtupleFlattener(object):
         self.__initializeNtuple()
         self.totalEntries = self.sampleTree.GetEntries()
         self.__initializeHistograms()
+        if self.profile:
+            self.profiler = Profiler('{0} {1} {2}'.format(self.analysis,self.sample,self.shift).strip())
+            self.profiler.instrument(self)
+            self.profiler.begin()
         total = 0
         start = time.time()
         new = start
         old = start
-        if hasProgress and self.pbar:
+        if self.columnar:
+            logging.info('Flattening {0} {1} in chunks of {2}'.format(self.analysis,self.sample,self.chunkSize))
+            chunks = iterChunks(self.sampleTree,self.chunkSize)
+            if self.profiler: chunks = self.profiler.iterate(chunks,sized=True)
+            for chunk in chunks:
+                self.perChunkAction(chunk)
+                total += len(chunk)
+                cur = time.time()
+                elapsed = cur-start
+                remaining = float(elapsed)/total * float(self.totalEntries) - float(elapsed)
+                mins, secs = divmod(int(remaining),60)
+                hours, mins = divmod(mins,60)
+                logging.info('{0}: Processing {1} event {2}/{3} - {4}:{5:02d}:{6:02d} remaining'.format(self.analysis,self.sample,total,self.totalEntries,hours,mins,secs))
+                self.flush()
+        elif hasProgress and self.pbar:
+            rows = self.getRows()
             self.pbar.maxval = self.totalEntries
             self.pbar.start()
-            for row in self.sampleTree:
+            for row in rows:
                 total += 1
                 self.pbar.update(total)
                 self.perRowAction(row)
             self.pbar.finish()
         else:
             logging.info('Flattening {0} {1}'.format(self.analysis,self.sample))
-            for row in self.sampleTree:
+            rows = self.getRows()
+            for row in rows:
                 total += 1
                 if total==2: start = time.time() # just ignore first event for timing
                 if total % 1000 == 1:
@@ -141,21 +248,37 @@ class NtupleFlattener(object):
                     logging.info('{0}: Processing {1} event {2}/{3} - {4}:{5:02d}:{6:02d} remaining'.format(self.analysis,self.sample,total,self.totalEntries,hours,mins,secs))
                     self.flush()
                 self.perRowAction(row)
-        self.write()
+        if self.pruner: self.pruner.restore()
+        if self.profiler:
+            start = time.time()
+            self.write()
+            self.profiler.addTime('write',time.time()-start)
+            self.profiler.end()
+            self.profiler.writeReport(self.profileReport)
+        else:
+            self.write()
 
     def write(self):
         '''
         Write histograms to files
         '''
+        self.writeHistograms(self.hists,self.outputFile)
+        for shift in self.shifts:
+            self.writeHistograms(self.shiftHists[shift],self.shiftOutputFiles[shift])
+
+    def writeHistograms(self,hists,outputFile):
+        '''
+        Write a dict of histograms to a file
+        '''
         total = 0
-        totalHists = len(self.hists)
+        totalHists = len(hists)
         if hasProgress and self.pbar:
             self.pbar.maxval = totalHists
             self.pbar.start()
         else:
-            logging.info('Writing histograms')
-        self.outfile = ROOT.TFile(self.outputFile,'update')
-        for h in sorted(self.hists):
+            logging.info('Writing histograms to {0}'.format(outputFile))
+        self.outfile = ROOT.TFile(outputFile,'update')
+        for h in sorted(hists):
             total += 1
             if hasProgress and self.pbar:
                 self.pbar.update(total)
@@ -164,11 +287,11 @@ class NtupleFlattener(object):
             components = h.split('/')
             directory = '/'.join(components[:-1])
             histName = components[-1]
-            hist = self.hists[h]
+            hist = hists[h]
             hist.SetName(histName)
             hist.SetTitle(histName)
             if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-            self.outfile.cd('{0}:/{1}'.format(self.outputFile,directory))
+            self.outfile.cd('{0}:/{1}'.format(outputFile,directory))
             hist.Write('',ROOT.TObject.kOverwrite)
         if hasProgress and self.pbar:
             self.pbar.finish()
@@ -181,20 +304,75 @@ class NtupleFlattener(object):
         '''
         return
 
+    def passSampleCuts(self,row):
+        '''Per sample cuts, works for rows and chunks'''
+        if self.sample in numGenJetsCuts: return numGenJetsCuts[self.sample](row)
+        return True
+
+    def getFakeRateColumn(self,lep,pt,eta,num,denom):
+        '''Columnar version of getFakeRate, returns only the fake rate'''
+        return getHppFakeRateTable(lep,num,denom).getFakeRates(pt,eta)[0]
+
+    def getShiftWeights(self,weight):
+        '''Dict of shift to weight, a single weight is the nominal'''
+        return weight if isinstance(weight,dict) else {self.shift: weight}
+
     def fill(self,row,selection,weight,chan,genChan='all'):
-        '''Fill a histogram'''
-        if weight!=weight:
-            logging.warning('{0} {1} {2} attempted to add NaN weight'.format(histName,chan,genChan))
+        '''Fill a histogram, weight is a single weight or a dict of shift to weight'''
+        weights = self.getShiftWeights(weight)
+        for shift in weights:
+            if weights[shift]!=weights[shift]:
+                logging.warning('{0} {1} {2} {3} attempted to add NaN weight'.format(selection,chan,genChan,shift))
+        profiler = self.profiler if self.profiler and self.profiler.sampling else None
         for hist in self.histParams:
+            if profiler: start = time.time()
             if 'selection' in self.histParams:
                 if not self.hstParams[hist]['selection'](row): continue
             val = self.histParams[hist]['x'](row)
-            w = weight*self.histParams[hist]['mcscale'](row) if 'mcscale' in self.histParams[hist] and self.isData else weight
-            histName = '{0}/{1}'.format(selection,hist)
-            self.hists[histName].Fill(val,w)
-            histName = '{0}/{1}/{2}'.format(selection,chan,hist)
-            self.hists[histName].Fill(val,w)
-            if genChan!='all':
-                histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
-                self.hists[histName].Fill(val,w)
+            mcscale = self.histParams[hist]['mcscale'](row) if 'mcscale' in self.histParams[hist] and self.isData else 1.
+            for shift in weights:
+                hists = self.shiftHists[shift]
+                w = weights[shift]*mcscale
+                histName = '{0}/{1}'.format(selection,hist)
+                hists[histName].Fill(val,w)
+                histName = '{0}/{1}/{2}'.format(selection,chan,hist)
+                hists[histName].Fill(val,w)
+                if genChan!='all':
+                    histName = '{0}/{1}/gen_{2}/{3}'.format(selection,chan,genChan,hist)
+                    hists[histName].Fill(val,w)
+            if profiler: profiler.addSampledTime('hist/{0}'.format(hist),time.time()-start)
 
+    def fillChunk(self,chunk,selection,mask,weight,chan,genChan=None):
+        '''Fill histograms for the entries of a chunk passing mask, weight is a column or a dict of shift to column'''
+        n = len(chunk)
+        mask = np.broadcast_to(mask,(n,)).astype(bool)
+        if not mask.any(): return
+        weights = self.getShiftWeights(weight)
+        weights = dict([(shift,asColumn(weights[shift],n)[mask]) for shift in weights])
+        chan = chan[mask]
+        if genChan is not None: genChan = genChan[mask]
+        for shift in weights:
+            if np.isnan(weights[shift]).any():
+                logging.warning('{0} {1} {2} attempted to add {3} NaN weights'.format(self.sample,selection,shift,np.isnan(weights[shift]).sum()))
+        chanMasks = [(c,chan==c) for c in np.unique(chan)]
+        genMasks = []
+        if genChan is not None:
+            for c,cmask in chanMasks:
+                genMasks += [(c,g,cmask & (genChan==g)) for g in np.unique(genChan[cmask]) if g!='all']
+        profiler = self.profiler if self.profiler and self.profiler.sampling else None
+        for hist in self.histParams:
+            if profiler: start = time.time()
+            val = asColumn(self.histParams[hist]['x'](chunk),n)[mask]
+            mcscale = asColumn(self.histParams[hist]['mcscale'](chunk),n)[mask] if 'mcscale' in self.histParams[hist] and self.isData else 1.
+            for shift in weights:
+                hists = self.shiftHists[shift]
+                w = weights[shift]*mcscale
+                histName = '{0}/{1}'.format(selection,hist)
+                fillColumns(hists[histName],val,w)
+                for c,cmask in chanMasks:
+                    histName = '{0}/{1}/{2}'.format(selection,c,hist)
+                    fillColumns(hists[histName],val[cmask],w[cmask])
+                for c,g,gmask in genMasks:
+                    histName = '{0}/{1}/gen_{2}/{3}'.format(selection,c,g,hist)
+                    fillColumns(hists[histName],val[gmask],w[gmask])
+            if profiler: profiler.addSampledTime('hist/{0}'.format(hist),time.time()-start)
@@ -0,0 +1,127 @@
+import logging
+import os
+import sys
+import json
+import hashlib
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+from DevTools.Plotter.utilities import hashFile, hashString
+
+def getMetadataCacheFile(directory,cacheDirectory='metadata'):
+    '''Local cache file for the ntuples in a directory'''
+    return os.path.join(cacheDirectory,'{0}.json'.format(hashlib.md5(os.path.abspath(directory)).hexdigest()))
+
+def readFileMetadata(fileName,treeName):
+    '''Open a file and read the summed weights, number of entries and UUID'''
+    tfile = ROOT.TFile.Open(fileName)
+    hist = tfile.Get('summedWeights')
+    if not hist: logging.warning('No summedWeights in {0}'.format(fileName))
+    tree = tfile.Get(treeName)
+    metadata = {
+        'summedWeights': hist.GetBinContent(1) if hist else 0.,
+        'entries': {treeName: tree.GetEntries() if tree else 0},
+        'uuid': tfile.GetUUID().AsString(),
+    }
+    tfile.Close()
+    return metadata
+
+def getFileMetadata(files,treeName,**kwargs):
+    '''
+    Get the summedWeights, number of entries in treeName and UUID for a list of files.
+
+    Results are cached per directory along with the file size and modification
+    time, so a file is only opened again if it changed.
+    Returns a list of {'summedWeights': float, 'entries': int, 'uuid': str}, one per file.
+    '''
+    cacheDirectory = kwargs.pop('cacheDirectory','metadata')
+    caches = {}
+    updated = set()
+    results = []
+    for f in files:
+        if not os.path.isfile(f): # remote file, can't stat
+            metadata = readFileMetadata(f,treeName)
+            results += [{'summedWeights': metadata['summedWeights'], 'entries': metadata['entries'][treeName], 'uuid': metadata['uuid']}]
+            continue
+        directory = os.path.dirname(os.path.abspath(f))
+        if directory not in caches:
+            cacheFile = getMetadataCacheFile(directory,cacheDirectory=cacheDirectory)
+            caches[directory] = {}
+            if os.path.isfile(cacheFile):
+                try:
+                    with open(cacheFile,'r') as cf:
+                        caches[directory] = json.load(cf)
+                except ValueError:
+                    logging.warning('Ignoring corrupt metadata cache {0}'.format(cacheFile))
+        cache = caches[directory]
+        stat = os.stat(f)
+        name = os.path.basename(f)
+        cached = cache.get(name,{})
+        if cached.get('size')!=stat.st_size or cached.get('mtime')!=stat.st_mtime or 'uuid' not in cached:
+            cached = readFileMetadata(f,treeName)
+            cached['size'] = stat.st_size
+            cached['mtime'] = stat.st_mtime
+            cache[name] = cached
+            updated.add(directory)
+        elif treeName not in cached['entries']:
+            cached['entries'].update(readFileMetadata(f,treeName)['entries'])
+            updated.add(directory)
+        results += [{'summedWeights': cached['summedWeights'], 'entries': cached['entries'][treeName], 'uuid': cached['uuid']}]
+    for directory in updated:
+        cacheFile = getMetadataCacheFile(directory,cacheDirectory=cacheDirectory)
+        python_mkdir(os.path.dirname(cacheFile))
+        # write to a temporary file first so other processes never see a partial cache
+        tmpFile = '{0}.{1}'.format(cacheFile,os.getpid())
+        with open(tmpFile,'w') as cf:
+            json.dump(caches[directory],cf)
+        os.rename(tmpFile,cacheFile)
+        logging.debug('Updated metadata cache {0} for {1}'.format(cacheFile,directory))
+    return results
+
+def hashSampled(fileName,**kwargs):
+    '''Hash the first, middle and last blocks of a file'''
+    BUFFSIZE = kwargs.pop('BUFFSIZE',65536)
+    hasher = hashlib.md5()
+    size = os.path.getsize(fileName)
+    with open(fileName,'rb') as f:
+        for offset in sorted(set([0,max(0,size/2-BUFFSIZE/2),max(0,size-BUFFSIZE)])):
+            f.seek(offset)
+            hasher.update(f.read(BUFFSIZE))
+    return hasher.hexdigest()
+
+def fingerprintFiles(files,**kwargs):
+    '''
+    Fingerprint a list of input files for the flat histogram hash check.
+
+    mode:
+        metadata: path, size, modification time and ROOT UUID of each file (default)
+        sampled:  metadata plus a hash of the first, middle and last blocks of each file
+        full:     md5 of the full content of every file
+    metadata is the output of getFileMetadata for files, to avoid reopening them for the UUID.
+    '''
+    mode = kwargs.pop('mode','metadata')
+    metadata = kwargs.pop('metadata',[])
+    if mode=='full': return hashFile(*files)
+    if mode not in ['metadata','sampled']:
+        raise ValueError('Unrecognized fingerprint mode {0}'.format(mode))
+    if not metadata:
+        metadata = []
+        for f in files:
+            tfile = ROOT.TFile.Open(f)
+            metadata += [{'uuid': tfile.GetUUID().AsString()}]
+            tfile.Close()
+    strings = [mode]
+    for f,m in zip(files,metadata):
+        strings += [os.path.abspath(f),m['uuid']]
+        if os.path.isfile(f):
+            stat = os.stat(f)
+            strings += [str(stat.st_size),repr(stat.st_mtime)]
+            if mode=='sampled': strings += [hashSampled(f)]
+        elif mode=='sampled':
+            logging.debug('Not sampling {0}, not a local file'.format(f))
+    return hashString(*strings)
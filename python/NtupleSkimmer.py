@@ -14,8 +14,14 @@ ROOT.gROOT.SetBatch(ROOT.kTRUE)
 ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 
 from DevTools.Plotter.xsec import getXsec
-from DevTools.Plotter.utilities import getLumi, isData, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getSkimJson, getSkimPickle
+from DevTools.Plotter.utilities import getLumi, isData, hashFile, hashString, python_mkdir, getTreeName, getNtupleDirectory, getSkimJson, getSkimPickle, getSkimStore
 from DevTools.Plotter.histParams import getHistParams, getHistSelections, getProjectionParams
+from DevTools.Plotter.NtupleMetadata import getFileMetadata
+from DevTools.Plotter.NtupleStaging import getNtupleStaging
+from DevTools.Plotter.CountAccumulator import CountAccumulator
+from DevTools.Plotter.SkimStore import writeSkimStore
+from DevTools.Plotter.Profiler import Profiler, getProfileReport
+from DevTools.Plotter.BranchPruning import BranchPruner
 
 try:
     from progressbar import ProgressBar, ETA, Percentage, Bar, SimpleProgress
@@ -40,7 +46,24 @@ class NtupleSkimmer(object):
         self.outputFile = kwargs.pop('outputFile','')
         self.json = kwargs.pop('json',getSkimJson(self.analysis,self.sample))
         self.pickle = kwargs.pop('pickle',getSkimPickle(self.analysis,self.sample))
+        self.store = kwargs.pop('store',getSkimStore(self.analysis,self.sample))
+        self.writeJson = kwargs.pop('writeJson',False)
+        self.writePickle = kwargs.pop('writePickle',True)
         self.treeName = kwargs.pop('treeName',getTreeName(self.analysis))
+        # read the ntuples from local copies, see NtupleStaging
+        self.staging = kwargs.pop('staging','')
+        self.stagingSize = kwargs.pop('stagingSize',0)
+        # time the event loop and write a JSON report at the end of skim
+        self.profile = kwargs.pop('profile',False)
+        if self.outputFile:
+            self.profileReport = kwargs.pop('profileReport',self.outputFile.replace('.root','.profile.root'))
+        else:
+            self.profileReport = kwargs.pop('profileReport',getProfileReport('skim',self.analysis,self.sample,shift=self.shift))
+        self.profiler = None
+        # only read the branches perRowAction uses, found by tracing the first traceEntries rows
+        self.pruneBranches = kwargs.pop('pruneBranches',True)
+        self.traceEntries = kwargs.pop('traceEntries',1000)
+        self.pruner = None
         if hasProgress:
             self.pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' events ',Percentage(),' ',Bar(),' ',ETA()]))
         else:
@@ -50,6 +73,7 @@ class NtupleSkimmer(object):
         self.tchain = 0
         self.initialized = False
         self.counts = {}
+        self.accumulator = CountAccumulator()
 
     def __initializeNtuple(self):
         tchain = ROOT.TChain(self.treeName)
@@ -61,12 +85,16 @@ class NtupleSkimmer(object):
         else: # reading from an input directory (all files in directory will be processed)
             allFiles = glob.glob('{0}/*.root'.format(self.ntupleDirectory))
         if len(allFiles)==0: logging.error('No files found for sample {0}'.format(self.sample))
-        summedWeights = 0.
-        for f in allFiles:
-            tfile = ROOT.TFile.Open(f)
-            summedWeights += tfile.Get("summedWeights").GetBinContent(1)
-            tfile.Close()
-            tchain.Add(f)
+        metadata = getFileMetadata(allFiles,self.treeName)
+        summedWeights = sum([m['summedWeights'] for m in metadata])
+        staging = getNtupleStaging(self.staging,maxSize=self.stagingSize)
+        chainFiles = staging.stageFiles(allFiles) if staging else allFiles
+        for f,m in zip(chainFiles,metadata):
+            # passing the known entries saves the chain from opening every file
+            if m['entries']>0:
+                tchain.Add(f,m['entries'])
+            else:
+                tchain.Add(f)
         if not summedWeights and not isData(self.sample): logging.warning('No events for sample {0}'.format(self.sample))
         self.intLumi = float(getLumi())
         self.xsec = getXsec(self.sample)
@@ -74,6 +102,7 @@ class NtupleSkimmer(object):
         self.sampleLumi = float(summedWeights)/self.xsec if self.xsec else 0.
         self.sampleTree = tchain
         self.files = allFiles
+        self.chainFiles = chainFiles
         self.initialized = True
         logging.debug('Initialized {0}: summedWeights = {1}; xsec = {2}; sampleLumi = {3}; intLumi = {4}'.format(self.sample,summedWeights,self.xsec,self.sampleLumi,self.intLumi))
 
@@ -93,22 +122,43 @@ class NtupleSkimmer(object):
         sys.stdout.flush()
         sys.stderr.flush()
 
+    def getRows(self):
+        '''Rows of the tree, pruned to the branches in use if pruneBranches'''
+        rows = self.sampleTree
+        if self.pruneBranches:
+            self.pruner = BranchPruner(self.sampleTree,traceEntries=self.traceEntries)
+            rows = self.pruner.iterate()
+        if self.profiler: rows = self.profiler.iterate(rows)
+        return rows
+
     def dump(self):
         if self.outputFile:
             # hack to copy them to hdfs
             os.system('touch {0}'.format(self.outputFile))
             jfile = self.outputFile.replace('.root','.json.root')
             pfile = self.outputFile.replace('.root','.pkl.root')
+            sfile = self.outputFile.replace('.root','.skim.root')
         else:
             # local running
             jfile = self.json
             pfile = self.pickle
-            python_mkdir(os.path.dirname(jfile))
-            python_mkdir(os.path.dirname(pfile))
-        with open(jfile,'w') as f:
-            f.write(json.dumps(self.counts, indent=4, sort_keys=True))
-        with open(pfile,'wb') as f:
-            pickle.dump(self.counts,f)
+            sfile = self.store
+            if self.writeJson: python_mkdir(os.path.dirname(jfile))
+            if self.writePickle: python_mkdir(os.path.dirname(pfile))
+        # counts set directly are merged with the accumulated ones
+        counts = dict([(name,dict(count)) for name,count in self.counts.iteritems()])
+        for name, count in self.accumulator.getCounts().iteritems():
+            if name not in counts:
+                counts[name] = count
+            else:
+                for key in ['val','count','err2']: counts[name][key] += count[key]
+        writeSkimStore(sfile,counts)
+        if self.writeJson:
+            with open(jfile,'w') as f:
+                f.write(json.dumps(counts, indent=4, sort_keys=True))
+        if self.writePickle:
+            with open(pfile,'wb') as f:
+                pickle.dump(counts,f)
 
 
     def skim(self):
@@ -117,6 +167,11 @@ class NtupleSkimmer(object):
         '''
         self.__initializeNtuple()
         self.totalEntries = self.sampleTree.GetEntries()
+        if self.profile:
+            self.profiler = Profiler('{0} {1} {2}'.format(self.analysis,self.sample,self.shift).strip())
+            self.profiler.instrument(self)
+            self.profiler.begin()
+        rows = self.getRows()
         total = 0
         start = time.time()
         new = start
@@ -124,14 +179,14 @@ class NtupleSkimmer(object):
         if hasProgress and self.pbar:
             self.pbar.maxval = self.totalEntries
             self.pbar.start()
-            for row in self.sampleTree:
+            for row in rows:
                 total += 1
                 self.pbar.update(total)
                 self.perRowAction(row)
             self.pbar.finish()
         else:
             logging.info('Skimming {0} {1}'.format(self.analysis,self.sample))
-            for row in self.sampleTree:
+            for row in rows:
                 total += 1
                 if total==2: start = time.time() # just ignore first event for timing
                 if total % 1000 == 1:
@@ -143,7 +198,15 @@ class NtupleSkimmer(object):
                     logging.info('{0}: Processing event {1}/{2} - {3}:{4:02d}:{5:02d} remaining'.format(self.analysis,total,self.totalEntries,hours,mins,secs))
                     self.flush()
                 self.perRowAction(row)
-        self.dump()
+        if self.pruner: self.pruner.restore()
+        if self.profiler:
+            start = time.time()
+            self.dump()
+            self.profiler.addTime('write',time.time()-start)
+            self.profiler.end()
+            self.profiler.writeReport(self.profileReport)
+        else:
+            self.dump()
 
     def perRowAction(self,row):
         '''
@@ -153,24 +216,4 @@ class NtupleSkimmer(object):
 
     def increment(self,cutName,val,chan,genChan='all'):
         '''Increment all counts'''
-        if val!=val:
-            logging.warning('{0} {1} {2} attempted to add NaN'.format(cutName,chan,genChan))
-        if cutName not in self.counts:
-            self.counts[cutName] = {'val':0.,'count':0,'err2':0.,}
-        self.counts[cutName]['val'] += val
-        self.counts[cutName]['count'] += 1
-        self.counts[cutName]['err2'] += val**2
-        chanName = '/'.join([cutName,chan])
-        if chanName not in self.counts:
-            self.counts[chanName] = {'val':0.,'count':0,'err2':0.,}
-        self.counts[chanName]['val'] += val
-        self.counts[chanName]['count'] += 1
-        self.counts[chanName]['err2'] += val**2
-        if genChan!='all':
-            genName = '/'.join([cutName,chan,'gen_'+genChan])
-            if genName not in self.counts:
-                self.counts[genName] = {'val':0.,'count':0,'err2':0.,}
-            self.counts[genName]['val'] += val
-            self.counts[genName]['count'] += 1
-            self.counts[genName]['err2'] += val**2
-
+        self.accumulator.increment(cutName,val,chan,genChan)
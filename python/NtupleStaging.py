@@ -0,0 +1,157 @@
+import logging
+import os
+import glob
+import shutil
+import threading
+import time
+
+from DevTools.Utilities.utilities import python_mkdir
+
+class NtupleStaging(object):
+    '''
+    Copies of the input ntuples on local scratch space.
+
+    A file is staged under directory at its full source path, hardlinked
+    if the scratch space is on the same filesystem and copied otherwise.
+    A staged copy is only used while its size and modification time match
+    the source. Staged files are evicted least recently used first to keep
+    the total under maxSize, files staged by this process are only evicted
+    by other processes. Files that do not fit are read from the source.
+    '''
+
+    def __init__(self,directory,**kwargs):
+        self.directory = os.path.abspath(directory)
+        self.maxSize = kwargs.pop('maxSize',100*1024*1024*1024) # bytes
+        self.lock = threading.Lock()
+        self.fileLocks = {}
+        self.protected = set()
+        self.prefetchThread = None
+        self.staged = 0
+        self.reused = 0
+        python_mkdir(self.directory)
+
+    def getStagedName(self,fileName):
+        '''Path of the staged copy of a file'''
+        return os.path.join(self.directory,os.path.abspath(fileName).lstrip('/'))
+
+    def _getFileLock(self,fileName):
+        with self.lock:
+            if fileName not in self.fileLocks: self.fileLocks[fileName] = threading.Lock()
+            return self.fileLocks[fileName]
+
+    def _isValid(self,stagedName,stat):
+        '''The staged copy matches the source'''
+        if not os.path.isfile(stagedName): return False
+        staged = os.stat(stagedName)
+        return staged.st_size==stat.st_size and abs(staged.st_mtime-stat.st_mtime)<1
+
+    def _getStagedFiles(self):
+        '''List of (last use, size, path) of all staged files'''
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root,name)
+                try:
+                    stat = os.stat(path)
+                except OSError: # evicted by another process
+                    continue
+                files += [(stat.st_atime,stat.st_size,path)]
+        return files
+
+    def _makeRoom(self,size):
+        '''Evict the least recently used files until size more bytes fit, False if they can not'''
+        if size>self.maxSize: return False
+        with self.lock:
+            files = sorted(self._getStagedFiles())
+            used = sum([f[1] for f in files])
+            for atime, fsize, path in files:
+                if used+size<=self.maxSize: break
+                if path in self.protected or path.endswith('.tmp'): continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                used -= fsize
+                logging.debug('Evicted {0}'.format(path))
+            if used+size>self.maxSize: return False
+        free = os.statvfs(self.directory)
+        return free.f_bavail*free.f_frsize>size
+
+    def _copy(self,fileName,stagedName,stat):
+        '''Hardlink or copy a file to its staged name'''
+        python_mkdir(os.path.dirname(stagedName))
+        # stage to a temporary file first so other processes never see a partial copy
+        tmpFile = '{0}.{1}.tmp'.format(stagedName,os.getpid())
+        try:
+            if os.stat(os.path.dirname(stagedName)).st_dev==stat.st_dev:
+                try:
+                    os.link(fileName,tmpFile)
+                except OSError:
+                    shutil.copy2(fileName,tmpFile)
+            else:
+                shutil.copy2(fileName,tmpFile)
+            os.rename(tmpFile,stagedName)
+        except (IOError,OSError) as e:
+            logging.warning('Failed to stage {0}: {1}'.format(fileName,e))
+            if os.path.exists(tmpFile): os.remove(tmpFile)
+            return False
+        return True
+
+    def stage(self,fileName):
+        '''Path to read a file from, the staged copy if it is (or can be) staged, else the source'''
+        if not os.path.isfile(fileName): return fileName # remote file
+        stagedName = self.getStagedName(fileName)
+        with self._getFileLock(fileName):
+            stat = os.stat(fileName)
+            if self._isValid(stagedName,stat):
+                self.reused += 1
+            else:
+                if not self._makeRoom(stat.st_size): return fileName
+                start = time.time()
+                if not self._copy(fileName,stagedName,stat): return fileName
+                self.staged += 1
+                logging.debug('Staged {0} ({1:.1f} MB in {2:.1f} s)'.format(fileName,stat.st_size/1e6,time.time()-start))
+            self.protected.add(stagedName)
+            # the access time orders the eviction
+            os.utime(stagedName,(time.time(),stat.st_mtime))
+        return stagedName
+
+    def stageFiles(self,files):
+        '''Stage a list of files, returns the paths to read them from'''
+        staged = [self.stage(f) for f in files]
+        n = len([s for s,f in zip(staged,files) if s!=f])
+        if files: logging.info('Reading {0} of {1} files from {2}'.format(n,len(files),self.directory))
+        return staged
+
+    def prefetch(self,files):
+        '''Stage files in the background, ie the next sample while the current one is processed'''
+        self.wait()
+        self.prefetchThread = threading.Thread(target=self.stageFiles,args=(files,))
+        self.prefetchThread.daemon = True
+        self.prefetchThread.start()
+
+    def prefetchDirectory(self,directory):
+        '''Stage the ntuples of a sample directory in the background'''
+        self.prefetch(sorted(glob.glob('{0}/*.root'.format(directory))))
+
+    def wait(self):
+        '''Wait for the background staging'''
+        if self.prefetchThread: self.prefetchThread.join()
+        self.prefetchThread = None
+
+# shared by all readers in the process, by directory
+stagings = {}
+
+def getNtupleStaging(directory='',**kwargs):
+    '''
+    The staging of a directory, None if staging is off.
+
+    The directory defaults to $NTUPLE_STAGING, staging is off if neither is set.
+    '''
+    maxSize = kwargs.pop('maxSize',0)
+    if not directory: directory = os.environ.get('NTUPLE_STAGING','')
+    if not directory: return None
+    directory = os.path.abspath(directory)
+    if directory not in stagings: stagings[directory] = NtupleStaging(directory)
+    if maxSize: stagings[directory].maxSize = maxSize
+    return stagings[directory]
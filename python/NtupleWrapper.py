@@ -4,6 +4,7 @@ import sys
 import glob
 import json
 import pickle
+from collections import OrderedDict
 
 sys.argv.append('-b')
 import ROOT
@@ -15,6 +16,15 @@ ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 from DevTools.Plotter.xsec import getXsec
 from DevTools.Plotter.utilities import *
 from DevTools.Plotter.histParams import getHistParams, getHistSelections, getProjectionParams
+from DevTools.Plotter.MultiDraw import MultiDraw
+from DevTools.Plotter.Cutflow import getMaskExpression, getMaskBinning
+from DevTools.Plotter.NtupleMetadata import getFileMetadata, fingerprintFiles
+from DevTools.Plotter.NtupleStaging import getNtupleStaging
+from DevTools.Plotter.SlimNtuple import SlimNtuple, writeSlimNtuple
+from DevTools.Plotter.EntryListCache import EntryListCache
+from DevTools.Plotter.HistCache import getHistCache
+from DevTools.Plotter.BulkProjection import BulkProjection
+from DevTools.Plotter.SkimStore import SkimStore
 
 CMSSW_BASE = os.environ['CMSSW_BASE']
 
@@ -28,6 +38,9 @@ class NtupleWrapper(object):
         self.sample = sample
         self.shift = kwargs.pop('shift','')
         self.useProof = kwargs.pop('useProof',False)
+        self.fingerprint = kwargs.pop('fingerprint','metadata')
+        self.flushEvery = kwargs.pop('flushEvery',1000)
+        self.histCache = kwargs.pop('histCache',getHistCache())
         logging.debug('Initializing {0} {1} {2}'.format(self.analysis,self.sample,self.shift))
         # backup passing custom parameters
         #self.ntuple = kwargs.pop('ntuple','{0}/src/ntuples/{1}/{2}.root'.format(CMSSW_BASE,self.analysis,self.sample))
@@ -35,6 +48,9 @@ class NtupleWrapper(object):
         if self.useProof: self.ntupleDirectory.replace('-merge','')
         self.inputFileList = kwargs.pop('inputFileList','')
         self.treeName = kwargs.pop('treeName',getTreeName(self.analysis))
+        # read the ntuples from local copies, see NtupleStaging
+        self.staging = kwargs.pop('staging','')
+        self.stagingSize = kwargs.pop('stagingSize',0)
         #self.flat = kwargs.pop('flat','flat/{0}/{1}.root'.format(self.analysis,self.sample))
         flat = getNewFlatHistograms if self.new else getFlatHistograms
         proj = getNewProjectionHistograms if self.new else getProjectionHistograms
@@ -42,6 +58,15 @@ class NtupleWrapper(object):
         self.proj = kwargs.pop('proj',proj(self.analysis,self.sample,shift=self.shift))
         self.json = kwargs.pop('json',getSkimJson(self.analysis,self.sample,shift=self.shift))
         self.pickle = kwargs.pop('pickle',getSkimPickle(self.analysis,self.sample,shift=self.shift))
+        self.store = kwargs.pop('store',getSkimStore(self.analysis,self.sample,shift=self.shift))
+        # read the slim ntuple instead of the full one when it covers the selection, see SlimNtuple
+        self.slim = kwargs.pop('slim',getSlimNtuple(self.analysis,self.sample,shift=self.shift))
+        self.useSlim = kwargs.pop('useSlim',True)
+        self.slimNtuple = None
+        # entries passing the selections of repeated temporary reads, saved next to the flat histograms, see EntryListCache
+        self.entryLists = kwargs.pop('entryLists',os.path.join(os.path.dirname(self.flat),'entrylists',self.sample))
+        self.useEntryLists = kwargs.pop('useEntryLists',False)
+        self.entryListCache = None
         self.skimInitialized = False
         # get stuff needed to flatten
         self.histParams = getHistParams(self.analysis,self.sample,shift=self.shift,**kwargs)
@@ -58,15 +83,24 @@ class NtupleWrapper(object):
         # verify output file directory exists
         os.system('mkdir -p {0}'.format(os.path.dirname(self.flat)))
         os.system('mkdir -p {0}'.format(os.path.dirname(self.proj)))
-        self.entryListMap = {}
+        # write session, committed at flush()
+        self.flatBuffer = OrderedDict()
+        self.projBuffer = OrderedDict()
+        self.hashBuffer = OrderedDict()
+
+    def __enter__(self):
+        return self
 
     def __exit__(self, type, value, traceback):
         self.__finish()
 
     def __del__(self):
-        self.__finish()
+        # ROOT may already be torn down, buffers are only written by flush() and __exit__
+        if getattr(self,'flatBuffer',None) or getattr(self,'projBuffer',None):
+            logging.warning('{0} {1}: {2} histograms were never flushed'.format(self.analysis,self.sample,len(self.flatBuffer)+len(self.projBuffer)))
 
     def __finish(self):
+        self.flush()
         if self.outfile:
             self.outfile.Close()
 
@@ -82,12 +116,17 @@ class NtupleWrapper(object):
         #elif os.path.isfile(self.ntuple): # reading a single root file
         #    allFiles = [self.ntuple]
         if len(allFiles)==0: logging.error('No files found for sample {0}'.format(self.sample))
-        summedWeights = 0.
-        for f in allFiles:
-            tfile = ROOT.TFile.Open(f)
-            summedWeights += tfile.Get("summedWeights").GetBinContent(1)
-            tfile.Close()
-            tchain.Add(f)
+        metadata = getFileMetadata(allFiles,self.treeName)
+        summedWeights = sum([m['summedWeights'] for m in metadata])
+        staging = getNtupleStaging(self.staging,maxSize=self.stagingSize)
+        chainFiles = staging.stageFiles(allFiles) if staging else allFiles
+        for f,m in zip(chainFiles,metadata):
+            # passing the known entries saves the chain from opening every file
+            if m['entries']>0:
+                tchain.Add(f,m['entries'])
+            else:
+                tchain.Add(f)
+        fileEntries = [m['entries'] for m in metadata]
         if not summedWeights and not isData(self.sample): logging.warning('No events for sample {0}'.format(self.sample))
         self.intLumi = float(getLumi())
         self.xsec = getXsec(self.sample)
@@ -95,16 +134,52 @@ class NtupleWrapper(object):
         self.sampleLumi = float(summedWeights)/self.xsec if self.xsec else 0.
         self.sampleTree = tchain
         self.j += 1
-        #listname = 'selList{0}'.format(self.j)
-        #self.sampleTree.Draw('>>{0}'.format(listname),'1','entrylist')
-        #skim = ROOT.gDirectory.Get(listname)
-        #self.entryListMap['1'] = skim
         self.files = allFiles
+        self.chainFiles = chainFiles
+        self.fileEntries = fileEntries
+        self.summedWeights = summedWeights
         self.initialized = True
-        if not self.temp: self.fileHash = hashFile(*self.files)
+        self.fileMetadata = metadata
+        if not self.temp: self.fileHash = fingerprintFiles(self.files,metadata=self.fileMetadata,mode=self.fingerprint)
         if self.useProof: self.sampleTree.SetProof()
         logging.debug('Initialized {0}: summedWeights = {1}; xsec = {2}; sampleLumi = {3}; intLumi = {4}'.format(self.sample,summedWeights,self.xsec,self.sampleLumi,self.intLumi))
 
+    def __getSlimNtuple(self):
+        '''The slim ntuple of the sample, False if there is none or it is out of date'''
+        if self.slimNtuple is None:
+            self.slimNtuple = False
+            if self.useSlim and not self.useProof and os.path.isfile(self.slim):
+                slim = SlimNtuple(self.slim,self.treeName)
+                if slim.source==fingerprintFiles(self.files,metadata=self.fileMetadata,mode='metadata'):
+                    self.slimNtuple = slim
+                    logging.debug('{0} {1}: slim ntuple {2} with selection {3}'.format(self.analysis,self.sample,self.slim,slim.selection))
+                else:
+                    logging.warning('Ignoring out of date slim ntuple {0}'.format(self.slim))
+        return self.slimNtuple
+
+    def __getTree(self,selections,expressions):
+        '''The slim tree if it covers the selections and expressions, else the full tree'''
+        slim = self.__getSlimNtuple()
+        if slim and slim.covers(selections,expressions): return slim.tree
+        return self.sampleTree
+
+    def __getEntryList(self,tree,selection):
+        '''Entry list of a selection of a temporary read on the full tree, None if entry lists are not used'''
+        # flattening draws each selection a few times at most, not worth a pass to build the list
+        if not self.useEntryLists or not self.temp or self.useProof or tree is not self.sampleTree: return None
+        if self.entryListCache is None:
+            fingerprint = fingerprintFiles(self.files,metadata=self.fileMetadata,mode='metadata')
+            self.entryListCache = EntryListCache(self.entryLists,self.sampleTree,fingerprint)
+        return self.entryListCache.getEntryList(selection)
+
+    def writeSlim(self,selection,branches):
+        '''Write the entries passing selection, with only the branches, to the slim ntuple of the sample'''
+        if not self.initialized: self.__initializeNtuple()
+        source = fingerprintFiles(self.files,metadata=self.fileMetadata,mode='metadata')
+        entries = writeSlimNtuple(self.slim,self.sampleTree,selection,branches,source=source,summedWeights=self.summedWeights)
+        self.slimNtuple = None
+        return entries
+
     def getTree(self):
         if not self.initialized: self.__initializeNtuple()
         return self.sampleTree
@@ -117,36 +192,60 @@ class NtupleWrapper(object):
         if not self.initialized: self.__initializeNtuple()
         return self.intLumi
 
+    def __buffer(self,buff,hist,directory):
+        '''Hold a copy of the histogram until the next flush.'''
+        obj = hist.Clone(hist.GetName())
+        if hasattr(obj,'SetDirectory'): obj.SetDirectory(0)
+        buff['/'.join([x for x in [directory,hist.GetName()] if x])] = (directory,obj)
+        if len(self.flatBuffer)+len(self.projBuffer)>=self.flushEvery: self.flush()
+
     def __write(self,hist,directory=''):
         if self.temp: return
-        self.outfile = ROOT.TFile(self.flat,'update')
-        if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-        self.outfile.cd('{0}:/{1}'.format(self.flat,directory))
-        hist.Write('',ROOT.TObject.kOverwrite)
-        self.outfile.Close()
+        self.__buffer(self.flatBuffer,hist,directory)
 
     def __writeProjection(self,hist,directory=''):
         if self.temp: return
-        self.outfile = ROOT.TFile(self.proj,'update')
-        if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
-        self.outfile.cd('{0}:/{1}'.format(self.proj,directory))
-        hist.Write('',ROOT.TObject.kOverwrite)
+        self.__buffer(self.projBuffer,hist,directory)
+
+    def __commit(self,fileName,buffers):
+        '''Write the buffered objects in a single update of the file.'''
+        self.outfile = ROOT.TFile(fileName,'update')
+        for buff in buffers:
+            for key, (directory, obj) in buff.iteritems():
+                if not self.outfile.GetDirectory(directory): self.outfile.mkdir(directory)
+                self.outfile.cd('{0}:/{1}'.format(fileName,directory))
+                obj.Write('',ROOT.TObject.kOverwrite)
+            # make sure everything so far is on disk before the next buffer
+            self.outfile.Flush()
         self.outfile.Close()
 
+    def flush(self):
+        '''
+        Commit the buffered histograms and hashes to the flat and projection files.
+        The hashes are written last so that if the process dies partway through,
+        the affected histograms are simply redone on the next pass.
+        '''
+        if not (self.flatBuffer or self.projBuffer): return
+        # cached reads of the files are stale after this
+        self.histCache.closeFile(self.flat)
+        self.histCache.closeFile(self.proj)
+        logging.debug('Flushing {0} histograms, {1} projections for {2}'.format(len(self.flatBuffer),len(self.projBuffer),self.sample))
+        # hashes of histograms that are not filled yet stay pending
+        hashes = OrderedDict([(key,val) for key,val in self.hashBuffer.iteritems() if key[len('hash/'):] in self.flatBuffer])
+        if self.projBuffer: self.__commit(self.proj,[self.projBuffer])
+        if self.flatBuffer: self.__commit(self.flat,[self.flatBuffer,hashes])
+        for key in hashes: self.hashBuffer.pop(key)
+        self.flatBuffer = OrderedDict()
+        self.projBuffer = OrderedDict()
+
     def __read(self,variable):
         '''Read the histogram from file'''
         # attempt to read
-        if os.path.isfile(self.proj):
-            infile = ROOT.TFile(self.proj,'read')
-            hist = infile.Get(variable)
-            if hist:
-                self.j += 1
-                hist = hist.Clone('h_{0}_{1}_{2}'.format(self.sample,variable.replace('/','_'),self.j))
-                hist.SetDirectory(0)
-                return hist
-        if os.path.isfile(self.flat):
-            infile = ROOT.TFile(self.flat,'read')
-            hist = infile.Get(variable)
+        for buff, fileName in [(self.projBuffer,self.proj),(self.flatBuffer,self.flat)]:
+            if variable in buff:
+                hist = buff[variable][1]
+            else:
+                hist = self.histCache.get(fileName,variable)
             if hist:
                 self.j += 1
                 hist = hist.Clone('h_{0}_{1}_{2}'.format(self.sample,variable.replace('/','_'),self.j))
@@ -162,25 +261,22 @@ class NtupleWrapper(object):
         return 0
 
     def __checkHash(self,name,directory,strings=[]):
-        'Check the hash for a sample'''
+        '''Check the hash for a sample'''
         if self.temp: return False
         if not self.initialized: self.__initializeNtuple()
-        self.outfile = ROOT.TFile(self.flat,'update')
         hashDirectory = 'hash/{0}'.format(directory)
-        hashObj = self.outfile.Get('{0}/{1}'.format(hashDirectory,name))
-        if not hashObj:
-            hashObj = ROOT.TNamed(name,'')
-        oldHash = hashObj.GetTitle()
+        key = '{0}/{1}'.format(hashDirectory,name)
+        if key in self.hashBuffer:
+            hashObj = self.hashBuffer[key][1]
+        else:
+            hashObj = self.histCache.get(self.flat,key)
+        oldHash = hashObj.GetTitle() if hashObj else ''
         newHash = self.fileHash + hashString(*strings)
         if oldHash==newHash:
-            self.outfile.Close()
             return True
         else:
-            hashObj.SetTitle(newHash)
-            if not self.outfile.GetDirectory(hashDirectory): self.outfile.mkdir(hashDirectory)
-            self.outfile.cd('{0}:/{1}'.format(self.flat,hashDirectory))
-            hashObj.Write('',ROOT.TObject.kOverwrite)
-            self.outfile.Close()
+            # only committed at flush, after the histogram itself
+            self.hashBuffer[key] = (hashDirectory,ROOT.TNamed(name,newHash))
             return False
 
     def __checkProjectionHash(self,name,directory,channel='',genchannel=''):
@@ -208,11 +304,8 @@ class NtupleWrapper(object):
             self.outfile.Close()
             return False
 
-    def __flatten(self,directory,histName,selection,params,**kwargs):
-        '''Produce flat histograms for a given selection.'''
-        # clear old
-        ROOT.gDirectory.Delete('h_*')
-        ROOT.gDirectory.Delete(histName)
+    def __getFlattenSelection(self,selection,params,**kwargs):
+        '''Build the full selection and scalefactor strings for a flat histogram.'''
         # selections
         mccut = kwargs.pop('mccut','')
         datacut = kwargs.pop('datacut','')
@@ -221,7 +314,6 @@ class NtupleWrapper(object):
         if 'datacut' in params and isData(self.sample): selection += ' && {0}'.format(params['datacut'])
         if 'mccut' in params and not isData(self.sample): selection += ' && {0}'.format(params['mccut'])
         if 'selection' in params: selection += ' && {0}'.format(params['selection'])
-        #print selection
         # scalefactor
         scalefactor = kwargs.pop('scalefactor','1')
         mcscalefactor = kwargs.pop('mcscalefactor','')
@@ -231,16 +323,26 @@ class NtupleWrapper(object):
         if 'scale' in params: scalefactor += '*{0}'.format(params['scale'])
         if 'mcscale' in params and not isData(self.sample): scalefactor += '*{0}'.format(params['mcscale'])
         if 'datascale' in params and isData(self.sample): scalefactor += '*{0}'.format(params['datascale'])
-        # check if we need to draw the hist, or if the one in the ntuple is the latest
+        return selection, scalefactor
+
+    def __getHashStrings(self,params,selection,scalefactor):
+        '''Strings that identify the content of a flat histogram.'''
         if 'zVariable' in params: # 3D
-             hashExists = self.__checkHash(histName,directory,strings=[params['zVariable'],params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']+params['zBinning']]),scalefactor,selection])
+            return [params['zVariable'],params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']+params['zBinning']]),scalefactor,selection]
         elif 'yVariable' in params: # 2D
-             hashExists = self.__checkHash(histName,directory,strings=[params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']]),scalefactor,selection])
+            return [params['yVariable'],params['xVariable'],', '.join([str(x) for x in params['xBinning']+params['yBinning']]),scalefactor,selection]
         else: # 1D
-             hashExists = self.__checkHash(histName,directory,strings=[params['xVariable'],', '.join([str(x) for x in params['xBinning']]),scalefactor,selection])
-        if hashExists:
-            self.__finish()
-            return False
+            return [params['xVariable'],', '.join([str(x) for x in params['xBinning']]),scalefactor,selection]
+
+    def __flatten(self,directory,histName,selection,params,**kwargs):
+        '''Produce flat histograms for a given selection.'''
+        # clear old
+        ROOT.gDirectory.Delete('h_*')
+        ROOT.gDirectory.Delete(histName)
+        selection, scalefactor = self.__getFlattenSelection(selection,params,**kwargs)
+        # check if we need to draw the hist, or if the one in the ntuple is the latest
+        hashExists = self.__checkHash(histName,directory,strings=self.__getHashStrings(params,selection,scalefactor))
+        if hashExists: return False
         # get the histogram
         name = histName
         self.j += 1
@@ -257,36 +359,41 @@ class NtupleWrapper(object):
         self.__write(hist,directory=directory)
         return True
 
+    def __scaleToLumi(self,scalefactor):
+        '''Add the luminosity normalization to the scalefactor for MC.'''
+        if isData(self.sample): return scalefactor
+        return '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+
+    def __bookHist(self,histName,params):
+        '''Create an empty histogram with the binning of params.'''
+        if 'zVariable' in params: # 3D
+            hist = ROOT.TH3D(histName,histName,*(params['xBinning']+params['yBinning']+params['zBinning']))
+        elif 'yVariable' in params: # 2D
+            hist = ROOT.TH2D(histName,histName,*(params['xBinning']+params['yBinning']))
+        else: # 1D
+            hist = ROOT.TH1D(histName,histName,*params['xBinning'])
+        hist.Sumw2()
+        hist.SetDirectory(0)
+        return hist
+
     def __getHist1D(self,histName,selection,scalefactor,xVariable,xBinning):
         if not self.initialized: self.__initializeNtuple()
-        if not isData(self.sample): scalefactor = '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+        scalefactor = self.__scaleToLumi(scalefactor)
         binning = xBinning
-        tree = self.sampleTree
+        tree = self.__getTree([selection],[scalefactor,xVariable])
         if not tree: 
             hist = ROOT.TH1D(histName,histName,*binning)
             return hist
-        # TODO, make sure this is worth it
-        #if self.entryListMap['1'].GetN()<1:
-        #    hist = ROOT.TH1D(histName,histName,*binning)
-        #    return hist
-        #tree.SetEntryList(self.entryListMap['1'])
-        #if selection not in self.entryListMap:
-        #    self.j += 1
-        #    listname = 'selList{0}'.format(self.j)
-        #    tree.Draw('>>{0}'.format(listname),selection,'entrylist')
-        #    skim = ROOT.gDirectory.Get(listname)
-        #    self.entryListMap[selection] = skim
-        #skim = self.entryListMap[selection]
-        #if not skim or skim.GetN()==0:
-        #    return ROOT.TH1D(histName,histName,*binning)
-        #tree.SetEntryList(skim)
+        # only visit the entries passing the selection
+        elist = self.__getEntryList(tree,selection)
+        if elist is not None: tree.SetEntryList(elist)
         drawString = '{0}>>{1}({2})'.format(xVariable,histName,', '.join([str(x) for x in binning]))
         selectionString = '{0}*({1})'.format(scalefactor,selection)
         #selectionString = '{0}*(1)'.format(scalefactor)
         logging.debug('drawString: {0}'.format(drawString))
         logging.debug('selectionString: {0}'.format(selectionString))
         tree.Draw(drawString,selectionString,'goff')
-        #tree.SetEntryList(self.entryListMap['1'])
+        if elist is not None: tree.SetEntryList(0)
         if ROOT.gDirectory.Get(histName):
             hist = ROOT.gDirectory.Get(histName)
         elif self.useProof:
@@ -298,34 +405,22 @@ class NtupleWrapper(object):
 
     def __getHist2D(self,histName,selection,scalefactor,xVariable,yVariable,xBinning,yBinning):
         if not self.initialized: self.__initializeNtuple()
-        if not isData(self.sample): scalefactor = '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+        scalefactor = self.__scaleToLumi(scalefactor)
         binning = xBinning+yBinning
-        tree = self.sampleTree
+        tree = self.__getTree([selection],[scalefactor,xVariable,yVariable])
         if not tree:
             hist = ROOT.TH2D(histName,histName,*binning)
             return hist
-        # TODO, make sure this is worth it
-        #if self.entryListMap['1'].GetN()<1:
-        #    hist = ROOT.TH2D(histName,histName,*binning)
-        #    return hist
-        #tree.SetEntryList(self.entryListMap['1'])
-        #if selection not in self.entryListMap:
-        #    self.j += 1
-        #    listname = 'selList{0}'.format(self.j)
-        #    tree.Draw('>>{0}'.format(listname),selection,'entrylist')
-        #    skim = ROOT.gDirectory.Get(listname)
-        #    self.entryListMap[selection] = skim
-        #skim = self.entryListMap[selection]
-        #if not skim or skim.GetN()==0:
-        #    return ROOT.TH2D(histName,histName,*binning)
-        #tree.SetEntryList(skim)
+        # only visit the entries passing the selection
+        elist = self.__getEntryList(tree,selection)
+        if elist is not None: tree.SetEntryList(elist)
         drawString = '{0}:{1}>>{2}({3})'.format(yVariable,xVariable,histName,', '.join([str(x) for x in binning]))
         selectionString = '{0}*({1})'.format(scalefactor,selection)
         #selectionString = '{0}*(1)'.format(scalefactor)
         logging.debug('drawString: {0}'.format(drawString))
         logging.debug('selectionString: {0}'.format(selectionString))
         tree.Draw(drawString,selectionString,'goff')
-        #tree.SetEntryList(self.entryListMap['1'])
+        if elist is not None: tree.SetEntryList(0)
         if ROOT.gDirectory.Get(histName):
             hist = ROOT.gDirectory.Get(histName)
         elif self.useProof:
@@ -337,34 +432,22 @@ class NtupleWrapper(object):
 
     def __getHist3D(self,histName,selection,scalefactor,xVariable,yVariable,zVariable,xBinning,yBinning,zBinning):
         if not self.initialized: self.__initializeNtuple()
-        if not isData(self.sample): scalefactor = '{0}*{1}'.format(scalefactor,float(self.intLumi)/self.sampleLumi) if self.sampleLumi else '0'
+        scalefactor = self.__scaleToLumi(scalefactor)
         binning = xBinning+yBinning+zBinning
-        tree = self.sampleTree
+        tree = self.__getTree([selection],[scalefactor,xVariable,yVariable,zVariable])
         if not tree:
             hist = ROOT.TH3D(histName,histName,*binning)
             return hist
-        # TODO, make sure this is worth it
-        #if self.entryListMap['1'].GetN()<1:
-        #    hist = ROOT.TH3D(histName,histName,*binning)
-        #    return hist
-        #tree.SetEntryList(self.entryListMap['1'])
-        #if selection not in self.entryListMap:
-        #    self.j += 1
-        #    listname = 'selList{0}'.format(self.j)
-        #    tree.Draw('>>{0}'.format(listname),selection,'entrylist')
-        #    skim = ROOT.gDirectory.Get(listname)
-        #    self.entryListMap[selection] = skim
-        #skim = self.entryListMap[selection]
-        #if not skim or skim.GetN()==0:
-        #    return ROOT.TH3D(histName,histName,*binning)
-        #tree.SetEntryList(skim)
+        # only visit the entries passing the selection
+        elist = self.__getEntryList(tree,selection)
+        if elist is not None: tree.SetEntryList(elist)
         drawString = '{0}:{1}:{2}>>{3}({4})'.format(zVariable,yVariable,xVariable,histName,', '.join([str(x) for x in binning]))
         selectionString = '{0}*({1})'.format(scalefactor,selection)
         #selectionString = '{0}*(1)'.format(scalefactor)
         logging.debug('drawString: {0}'.format(drawString))
         logging.debug('selectionString: {0}'.format(selectionString))
         tree.Draw(drawString,selectionString,'goff')
-        #tree.SetEntryList(self.entryListMap['1'])
+        if elist is not None: tree.SetEntryList(0)
         if ROOT.gDirectory.Get(histName):
             hist = ROOT.gDirectory.Get(histName)
         elif self.useProof:
@@ -565,11 +648,25 @@ class NtupleWrapper(object):
             hist = 0
         return hist
 
+    def __useSkimStore(self):
+        '''The skim store exists and has the counts of the pickle'''
+        if not self.store or not os.path.isfile(self.store): return False
+        if not os.path.isfile(self.pickle): return True
+        # a pickle copied over an older store (ie from outputs without a store) wins
+        if os.path.getmtime(self.pickle)>os.path.getmtime(self.store): return False
+        # both local, or both from the same output directory (ie of a shift)
+        local = (self.pickle==getSkimPickle(self.analysis,self.sample) and self.store==getSkimStore(self.analysis,self.sample))
+        return local or os.path.dirname(os.path.abspath(self.pickle))==os.path.dirname(os.path.abspath(self.store))
+
     def __readSkim(self,directory):
         '''Read a value from the skim file.'''
         if not self.skimInitialized:
-            with open(self.pickle,'rb') as f:
-                self.skim = pickle.load(f)
+            if self.__useSkimStore():
+                # memory mapped, only the looked up keys are read
+                self.skim = SkimStore(self.store)
+            else:
+                with open(self.pickle,'rb') as f:
+                    self.skim = pickle.load(f)
             self.skimInitialized = True
         components = directory.split('/')
         if components[-1] == 'all': components = components[:-1]
@@ -616,6 +713,37 @@ class NtupleWrapper(object):
         hist.SetTitle('count')
         return hist
 
+    def getTempCounts(self,cuts):
+        '''Get a single bin count histogram for each (selection, scalefactor) in cuts, in a single pass over the tree'''
+        if not self.initialized: self.__initializeNtuple()
+        tree = self.__getTree([cut[0] for cut in cuts],[cut[1] for cut in cuts])
+        drawer = MultiDraw(tree)
+        hists = []
+        for selection, scalefactor in cuts:
+            self.j += 1
+            tempname = 'count_{0}_{1}_{2}'.format(self.analysis,self.sample,self.j)
+            hist = self.__bookHist(tempname,{'xBinning':[1,0,2]})
+            hist.SetTitle('count')
+            drawer.book(hist,'{0}*({1})'.format(self.__scaleToLumi(scalefactor),selection),'1')
+            hists += [hist]
+        # nothing to loop over, the counts stay empty
+        if not tree or not tree.GetEntries(): return hists
+        logging.debug('{0} {1}: counting {2} selections in a single pass'.format(self.analysis,self.sample,len(cuts)))
+        drawer.fill()
+        return hists
+
+    def getTempCutflow(self,cuts,selection,scalefactor):
+        '''Get a histogram of the bitmask of cuts passed by each selected entry, see Cutflow'''
+        if not self.initialized: self.__initializeNtuple()
+        self.j += 1
+        tempname = 'cutflow_{0}_{1}_{2}'.format(self.analysis,self.sample,self.j)
+        hist = self.__bookHist(tempname,{'xBinning':getMaskBinning(cuts)})
+        hist.SetTitle('cutflow')
+        drawer = MultiDraw(self.__getTree([selection],[scalefactor]+list(cuts)))
+        drawer.book(hist,'{0}*({1})'.format(self.__scaleToLumi(scalefactor),selection),getMaskExpression(cuts))
+        drawer.fill()
+        return hist
+
     def flatten(self,histName,selectionName):
         '''Flatten a histogram'''
         self.temp = False
@@ -629,19 +757,86 @@ class NtupleWrapper(object):
         kwargs = self.selections[selectionName]['kwargs']
         updated = self.__flatten(selectionName,histName,selection,params,**kwargs)
         # project stuff
-        if updated and len(self.projections.keys())>1: # if it changed and there are channels to project
-            variable = '/'.join([selectionName,histName])
-            self.__projectChannel(variable)
-            chans = [x for x in self.projections.keys() if 'gen' not in x]
-            genchans = [x for x in self.projections.keys() if 'gen' in x]
-            genchans = [] # block genchans unless i really want it
-            for chan in chans:
-                variable = '/'.join([selectionName,chan,histName])
-                self.__projectChannel(variable)
-                for genchan in genchans:
-                    variable = '/'.join([selectionName,chan,genchan,histName])
-                    self.__projectChannel(variable)
+        if updated: self.__projectAll(selectionName,histName)
+        self.temp = True
+
+    def __projectAll(self,selectionName,histName):
+        '''Project a flattened histogram onto all channels.'''
+        if len(self.projections.keys())<=1: return # no channels to project
+        if histName not in self.histParams:
+            logging.error('Unrecognized histogram {0}'.format(histName))
+            return
+        chans = [x for x in self.projections.keys() if 'gen' not in x]
+        genchans = [x for x in self.projections.keys() if 'gen' in x]
+        genchans = [] # block genchans unless i really want it
+        # same channels as calling __projectChannel on each variable
+        targets = [('all','')]
+        for chan in chans:
+            targets += [(chan,'')]
             for genchan in genchans:
-                variable = '/'.join([selectionName,genchan,histName])
-            self.__projectChannel(variable)
+                targets += [(chan,genchan)]
+        for genchan in genchans:
+            targets += [(genchan,'')]
+        # read once, project all channels from the same bin contents
+        histNd = self.__read('/'.join([selectionName,histName]))
+        if not histNd or not (histNd.InheritsFrom('TH2') or histNd.InheritsFrom('TH3')): return
+        projector = BulkProjection(histNd)
+        for channel, genchannel in targets:
+            if histNd.InheritsFrom('TH3') and genchannel:
+                directory = '/'.join([selectionName,channel,genchannel])
+                hist = projector.project(histName,binLabels1=self.projections[channel],binLabels2=self.projections[genchannel])
+            else:
+                directory = '/'.join([selectionName,channel])
+                hist = projector.project(histName,binLabels1=self.projections[channel])
+            self.__writeProjection(hist,directory=directory)
+
+    def flattenBatch(self,jobs,pool=None):
+        '''
+        Flatten a list of [histName,selectionName] in a single pass over the tree.
+        Only histograms whose hash changed are refilled.
+        If a FlattenPool is given, the tree is filled by the pool and the histograms
+        are written when the pool is joined.
+        '''
+        self.temp = False
+        if not self.initialized: self.__initializeNtuple()
+        drawer = MultiDraw(self.sampleTree)
+        booked = []
+        for histName, selectionName in jobs:
+            if histName not in self.histParams:
+                logging.error('Unrecognized histogram {0}'.format(histName))
+                continue
+            params = self.histParams[histName]
+            if not params: continue
+            if selectionName not in self.selections:
+                logging.error('Unrecognized selection {0}'.format(selectionName))
+                continue
+            selection = self.selections[selectionName]['args'][0]
+            kwargs = self.selections[selectionName]['kwargs']
+            selection, scalefactor = self.__getFlattenSelection(selection,params,**kwargs)
+            if self.__checkHash(histName,selectionName,strings=self.__getHashStrings(params,selection,scalefactor)): continue
+            self.j += 1
+            hist = self.__bookHist('h_{0}_{1}_{2}'.format(histName,self.sample,self.j),params)
+            weight = '{0}*({1})'.format(self.__scaleToLumi(scalefactor),selection)
+            booked += [(histName,selectionName,hist,weight,params['xVariable'],params.get('yVariable',''),params.get('zVariable',''))]
+        self.temp = True
+        if pool is not None:
+            logging.info('{0} {1}: submitting {2} of {3} histograms, {4} events'.format(self.analysis,self.sample,len(booked),len(jobs),sum(self.fileEntries)))
+            pool.submit(self.treeName,self.chainFiles,self.fileEntries,[b[2:] for b in booked],lambda hists: self.__writeBatch(booked))
+            return len(booked)
+        logging.info('{0} {1}: filling {2} of {3} histograms in a single pass'.format(self.analysis,self.sample,len(booked),len(jobs)))
+        for histName, selectionName, hist, weight, xVariable, yVariable, zVariable in booked:
+            drawer.book(hist,weight,xVariable,yVariable,zVariable)
+        drawer.fill()
+        self.__writeBatch(booked)
+        return len(booked)
+
+    def __writeBatch(self,booked):
+        '''Write and project the filled histograms of flattenBatch.'''
+        self.temp = False
+        for histName, selectionName, hist, weight, xVariable, yVariable, zVariable in booked:
+            hist.SetTitle(histName)
+            hist.SetName(histName)
+            self.__write(hist,directory=selectionName)
+            self.__projectAll(selectionName,histName)
         self.temp = True
+        self.flush()
@@ -2,16 +2,21 @@ import os
 import sys
 import logging
 import math
+import time
+import traceback
 from array import array
 from collections import OrderedDict
+from multiprocessing import Pool
 
 import ROOT
 
 from DevTools.Plotter.PlotterBase import PlotterBase
 from DevTools.Plotter.NtupleWrapper import NtupleWrapper
+from DevTools.Plotter.HistCache import getHistCache
 from DevTools.Plotter.utilities import getLumi, isData
 from DevTools.Plotter.style import getStyle
 from DevTools.Utilities.utilities import *
+import DevTools.Plotter.HistScan as HistScan
 import DevTools.Plotter.CMS_lumi as CMS_lumi
 import DevTools.Plotter.tdrstyle as tdrstyle
 
@@ -33,6 +38,27 @@ blue  = array('d', [ 39./255., 26./255., 21./255.,  18./255.,  15./255.,  14./25
 Idx = ROOT.TColor.CreateGradientColorTable(9, stops, red, green, blue, 255);
 ROOT.gStyle.SetNumberContours(255)
 
+# deferred plots of the plotter being run, inherited by the forked workers
+deferredPlots = None
+
+def initPlotWorker():
+    '''Give each worker its own file handles instead of the ones inherited from the parent'''
+    getHistCache().clear()
+    ROOT.gROOT.cd()
+
+def runDeferredPlot(index):
+    '''Run a single deferred plot, returns the savename, the time taken and the error, if any'''
+    plotter, deferred = deferredPlots
+    method, savename, args, kwargs, state = deferred[index]
+    for attr, val in state.iteritems(): setattr(plotter,attr,val)
+    start = time.time()
+    try:
+        getattr(plotter,method)(*args,**kwargs)
+        error = ''
+    except Exception:
+        error = traceback.format_exc()
+    return savename, time.time()-start, error
+
 
 class Plotter(PlotterBase):
     '''Basic plotter utilities'''
@@ -41,6 +67,8 @@ class Plotter(PlotterBase):
         '''Initialize the plotter'''
         super(Plotter, self).__init__(analysis,**kwargs)
         self.new = kwargs.pop('new',False)
+        histCacheSize = kwargs.pop('histCacheSize',0) # bytes, 0 to keep the default
+        if histCacheSize: getHistCache().maxSize = histCacheSize
 
         # empty initialization
         self.histDict = {}
@@ -54,6 +82,7 @@ class Plotter(PlotterBase):
         self.sampleSelection = {}
         self.uncertainties = {}
         self.j = 0
+        self.deferred = []
 
     #def __exit__(self, type, value, traceback):
     #    self.finish()
@@ -63,7 +92,9 @@ class Plotter(PlotterBase):
 
     def finish(self):
         '''Cleanup stuff'''
+        self.finishSaving()
         logging.info('Finished plotting')
+        logging.debug('Histogram cache: {0}'.format(getHistCache().stats()))
         #self.saveFile.Close()
 
     def _openFile(self,sampleName,**kwargs):
@@ -130,14 +161,56 @@ class Plotter(PlotterBase):
         self.sampleSelection = {}
         self.uncertainties = {}
 
+    stateAttributes = ['sampleFiles','analysisDict','histDict','histOrder','stackOrder','styles','signals','histScales','sampleSelection','uncertainties']
+
+    def _defer(self,method,savename,*args,**kwargs):
+        '''Queue a plot with a snapshot of the current histograms, to be made in run()'''
+        state = {}
+        for attr in self.stateAttributes:
+            val = getattr(self,attr)
+            state[attr] = val.copy() if hasattr(val,'copy') else list(val)
+        self.deferred += [(method,savename,args,kwargs,state)]
+        return 0
+
+    def run(self,jobs=1):
+        '''
+        Make all deferred plots, on jobs processes.
+        Returns a list of (savename, seconds, error) with an empty error for successful plots.
+        '''
+        global deferredPlots
+        deferred, self.deferred = self.deferred, []
+        if not deferred: return []
+        state = dict([(attr,getattr(self,attr)) for attr in self.stateAttributes])
+        deferredPlots = (self,deferred)
+        logging.info('Making {0} plots on {1} processes'.format(len(deferred),jobs))
+        start = time.time()
+        if jobs>1:
+            pool = Pool(jobs,initializer=initPlotWorker)
+            results = pool.map(runDeferredPlot,range(len(deferred)),chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            results = [runDeferredPlot(i) for i in range(len(deferred))]
+        deferredPlots = None
+        # restore the histograms as they were before running
+        for attr, val in state.iteritems(): setattr(self,attr,val)
+        for savename, elapsed, error in results:
+            logging.debug('{0}: {1:.1f} s'.format(savename,elapsed))
+            if error: logging.error('Failed to plot {0}:\n{1}'.format(savename,error))
+        failed = len([r for r in results if r[2]])
+        slowest = sorted(results,key=lambda r: -r[1])[:5]
+        logging.info('Made {0} plots in {1:.1f} s, {2} failed. Slowest: {3}'.format(len(results)-failed,time.time()-start,failed,', '.join(['{0} ({1:.1f} s)'.format(r[0],r[1]) for r in slowest])))
+        return results
+
     def _readSampleVariable(self,sampleName,variable,**kwargs):
         '''Read the histogram from file'''
         analysis = kwargs.pop('analysis',self.analysis)
         hist = self.sampleFiles[analysis][sampleName].getHist(variable)
         logging.debug('Read {0} {1} {2}: {3}'.format(analysis, sampleName, variable, hist))
         if hist:
+            # already a private copy, just rename
             self.j += 1
-            hist = hist.Clone('h_temp_{0}'.format(self.j))
+            hist.SetName('h_temp_{0}'.format(self.j))
         return hist
 
     def _getTempHistogram(self,sampleName,histName,selection,scalefactor,variable,binning,**kwargs):
@@ -488,7 +561,9 @@ class Plotter(PlotterBase):
         return super(Plotter,self)._getLegend(entries=entries,**kwargs)
 
     def plot(self,variable,savename,**kwargs):
-        '''Plot a variable and save'''
+        '''Plot a variable and save, defer=True to queue it for run()'''
+        if kwargs.pop('defer',False): return self._defer('plot',savename,variable,savename,**kwargs)
+        formats = kwargs.pop('formats',None)
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Events')
         logy = kwargs.pop('logy',False)
@@ -689,14 +764,16 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
             logging.debug('Done')
             return 0
         else:
             return self._saveTemp(canvas)
 
     def plotCounts(self,bins,labels,savename,**kwargs):
-        '''Plot a histogram of counts for each bin and save'''
+        '''Plot a histogram of counts for each bin and save, defer=True to queue it for run()'''
+        if kwargs.pop('defer',False): return self._defer('plotCounts',savename,bins,labels,savename,**kwargs)
+        formats = kwargs.pop('formats',None)
         xaxis = kwargs.pop('xaxis', '')
         yaxis = kwargs.pop('yaxis', 'Events')
         logy = kwargs.pop('logy',False)
@@ -842,13 +919,15 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
 
     def plotRatio(self,numerator,denominator,savename,**kwargs):
-        '''Plot a ratio of two variables and save'''
+        '''Plot a ratio of two variables and save, defer=True to queue it for run()'''
+        if kwargs.pop('defer',False): return self._defer('plotRatio',savename,numerator,denominator,savename,**kwargs)
+        formats = kwargs.pop('formats',None)
         xaxis = kwargs.pop('xaxis', 'Variable')
         yaxis = kwargs.pop('yaxis', 'Efficiency')
         logy = kwargs.pop('logy',False)
@@ -972,7 +1051,7 @@ class Plotter(PlotterBase):
 
         # save
         if save:
-            self._save(canvas,savename)
+            self._save(canvas,savename,formats=formats)
         else:
             return self._saveTemp(canvas)
 
@@ -1009,28 +1088,11 @@ class Plotter(PlotterBase):
             signal, background = histNames
             sig = self._getHistogram(signal,variable,nofill=True,**kwargs)
             bg = self._getHistogram(background,variable,nofill=True,**kwargs)
-            numBins = sig.GetNbinsX()
             self.j += 1
             name = 'h_sOverB_{0}'.format(self.j)
-            sOverB = ROOT.TH1D(name,name,numBins,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax())
-            thisMin = 999999.
-            for b in range(numBins):
-                blow = 1 if invert else b+1
-                bhigh = b+1 if invert else numBins
-                sigVal = 0
-                sigErr2 = 0
-                bgVal = 0
-                bgErr2 = 0
-                for j in range(blow,bhigh+1):
-                    sigVal += sig.GetBinContent(j)
-                    sigErr2 += sig.GetBinError(j)**2
-                    bgVal += bg.GetBinContent(j)
-                    bgErr2 += bg.GetBinError(j)**2
-                sOverBVal = divWithError((sigVal,sigErr2**0.5),(bgVal,bgErr2**0.5))
-                if sOverBVal>0: thisMin = min(thisMin,sOverBVal)
-                sOverB.SetBinContent(b+1,sOverBVal[0])
-                sOverB.SetBinError(b+1,sOverBVal[1])
-            lowestMin = min(lowestMin,thisMin)
+            vals, errs = HistScan.sOverB(HistScan.HistScan(sig),HistScan.HistScan(bg),invert=invert)
+            sOverB = HistScan.arrayToHist(name,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax(),vals,errs)
+            if (vals>0).any(): lowestMin = min(lowestMin,vals[vals>0].min())
             sOverB.SetMinimum(lowestMin)
             style = self.styles[signal]
             sOverB.SetLineWidth(2)
@@ -1096,28 +1158,11 @@ class Plotter(PlotterBase):
             signal, background = histNames
             sig = self._getHistogram(signal,variable,nofill=True,**kwargs)
             bg = self._getHistogram(background,variable,nofill=True,**kwargs)
-            numBins = sig.GetNbinsX()
             self.j += 1
             name = 'h_sOverB_{0}'.format(self.j)
-            significance = ROOT.TH1D(name,name,numBins,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax())
-            thisMin = 999999.
-            for b in range(numBins):
-                blow = 1 if invert else b+1
-                bhigh = b+1 if invert else numBins
-                sigVal = 0
-                sigErr2 = 0
-                bgVal = 0
-                bgErr2 = 0
-                for j in range(blow,bhigh+1):
-                    sigVal += sig.GetBinContent(j)
-                    sigErr2 += sig.GetBinError(j)**2
-                    bgVal += bg.GetBinContent(j)
-                    bgErr2 += bg.GetBinError(j)**2
-                significanceVal = sigVal / (sigVal+bgVal) if sigVal+bgVal else 0.
-                if significanceVal>0: thisMin = min(thisMin,significanceVal)
-                significance.SetBinContent(b+1,significanceVal)
-                significance.SetBinError(b+1,0.)
-            lowestMin = min(lowestMin,thisMin)
+            vals = HistScan.significance(HistScan.HistScan(sig),HistScan.HistScan(bg),invert=invert)
+            significance = HistScan.arrayToHist(name,sig.GetXaxis().GetXmin(),sig.GetXaxis().GetXmax(),vals)
+            if (vals>0).any(): lowestMin = min(lowestMin,vals[vals>0].min())
             significance.SetMinimum(lowestMin)
             style = self.styles[signal]
             significance.SetLineWidth(2)
@@ -1172,14 +1217,9 @@ class Plotter(PlotterBase):
         histOrder = customOrder if customOrder else self.histOrder
         for i,histName in enumerate(histOrder):
             sig = self._getHistogram(histName,variable,nofill=True,**kwargs)
-            numBins = sig.GetNbinsX()
-            sigEff = [0]*numBins
-            sigVal = [0]*numBins
-            totSig = sig.Integral()
-            for b in range(numBins):
-                sigEff[b] = sig.Integral(1,b+1)/totSig if invert else sig.Integral(b+1,numBins)/totSig
-                sigVal[b] = sig.GetBinLowEdge(b+1)
-            eff = ROOT.TGraph(numBins,array('f',sigVal),array('f',sigEff))
+            sigScan = HistScan.HistScan(sig)
+            sigEff = sigScan.efficiency(invert)
+            eff = ROOT.TGraph(sigScan.nbins,array('f',sigScan.lowEdges),array('f',sigEff))
             style = self.styles[histName]
             eff.SetLineWidth(2)
             eff.SetLineColor(style['linecolor'])
@@ -1240,15 +1280,8 @@ class Plotter(PlotterBase):
         for i,(sigName,bgName) in enumerate(zip(sigHists,bgHists)):
             sig = self._getHistogram(sigName,signalVariable,nofill=True,**kwargs)
             bg = self._getHistogram(bgName,backgroundVariable,nofill=True,**kwargs)
-            numBins = sig.GetNbinsX()
-            sigEff = [0]*numBins
-            bgEff = [0]*numBins
-            totSig = sig.Integral()
-            totBg = bg.Integral()
-            for b in range(numBins):
-                sigEff[b] = sig.Integral(1,b+1)/totSig if invert else sig.Integral(b+1,numBins)/totSig
-                bgEff[b] = (totBg-bg.Integral(1,b+1))/totBg if invert else (totBg-bg.Integral(b+1,numBins))/totBg
-            roc = ROOT.TGraph(numBins,array('f',sigEff),array('f',bgEff))
+            sigEff, bgEff = HistScan.roc(HistScan.HistScan(sig),HistScan.HistScan(bg),invert=invert)
+            roc = ROOT.TGraph(len(sigEff),array('f',sigEff),array('f',bgEff))
             style = self.styles[sigName]
             roc.SetLineWidth(2)
             roc.SetLineColor(style['linecolor'])
@@ -1435,12 +1468,8 @@ class Plotter(PlotterBase):
         for x,histName in sorted(xvalMap.iteritems()):
             hist = self._getHistogram(histName,variable,**kwargs)
             hists[x] = hist
-            total = hist.Integral()
-            for b in range(hist.GetNbinsX()):
-                thisInt = hist.Integral(0,b+1)
-                ratio = thisInt/total if total else 0.
-                for e in envelopePoints:
-                    if ratio < e: envelopes[e][x] = hist.GetBinLowEdge(b+1)
+            for e,edge in HistScan.HistScan(hist).quantileEdges(envelopePoints).iteritems():
+                if edge is not None: envelopes[e][x] = edge
 
         highestMax = max([max(envelopes[e].values()) for e in envelopePoints])
 
@@ -5,6 +5,8 @@ import math
 from array import array
 from collections import OrderedDict
 import tempfile
+import atexit
+import multiprocessing
 
 import ROOT
 
@@ -18,6 +20,24 @@ ROOT.gROOT.ProcessLine("gErrorIgnoreLevel = 2001;")
 tdrstyle.setTDRStyle()
 ROOT.gStyle.SetPalette(1)
 
+def convertCanvas(rootName,names,remove=False):
+    '''Print the canvas saved in a ROOT file to other formats, run in the conversion workers'''
+    try:
+        tfile = ROOT.TFile.Open(rootName)
+        # the canvas is the only key, its name is the savename which may have slashes
+        keys = tfile.GetListOfKeys() if tfile else None
+        canvas = keys.At(0).ReadObj() if keys and keys.GetSize() else None
+        if not canvas or not canvas.InheritsFrom('TCanvas'):
+            if tfile: tfile.Close()
+            raise Exception('No canvas in {0}'.format(rootName))
+        canvas.Draw()
+        for name in names:
+            canvas.Print(name)
+        tfile.Close()
+    finally:
+        if remove and os.path.exists(rootName): os.remove(rootName)
+    return names
+
 class PlotterBase(object):
     '''Basic plotter utilities'''
 
@@ -26,6 +46,13 @@ class PlotterBase(object):
         # plot directory
         self.analysis = analysis
         self.outputDirectory = kwargs.pop('outputDirectory','plots/{0}'.format(self.analysis))
+        # output formats, the canvas is written once to ROOT and the others are converted
+        # from that file on convertJobs background processes (0 to print them all directly)
+        self.formats = kwargs.pop('formats',['pdf','root','png'])
+        self.convertJobs = kwargs.pop('convertJobs',2)
+        self.convertPool = None
+        self.converting = []
+        self.finishRegistered = False
         # initialize stuff
 
     def _getLegend(self,**kwargs):
@@ -93,15 +120,55 @@ class PlotterBase(object):
             CMS_lumi.lumi_13TeV = "%0.1f pb^{-1}" % (float(getLumi))
         CMS_lumi.CMS_lumi(pad,period_int,position)
 
-    def _save(self, canvas, savename):
+    def _getSaveName(self, savename, type):
+        name = '{0}/{1}/{2}.{1}'.format(self.outputDirectory, type, savename)
+        python_mkdir(os.path.dirname(name))
+        return name
+
+    def _save(self, canvas, savename, formats=None):
         '''Save the canvas in multiple formats.'''
         logging.debug('Saving {0}'.format(savename))
         canvas.SetName(savename)
-        for type in ['pdf','root','png']:
-            name = '{0}/{1}/{2}.{1}'.format(self.outputDirectory, type, savename)
-            python_mkdir(os.path.dirname(name))
-            logging.debug('Writing {0}'.format(name))
-            canvas.Print(name)
+        formats = formats or self.formats
+        others = [type for type in formats if type!='root']
+        # daemonic processes (ie deferred plots) can not start a pool, print directly there
+        if self.convertJobs<1 or (len(others)<2 and 'root' not in formats) or multiprocessing.current_process().daemon:
+            for type in formats:
+                name = self._getSaveName(savename, type)
+                logging.debug('Writing {0}'.format(name))
+                canvas.Print(name)
+            return
+        # serialize once, convert in the background
+        if 'root' in formats:
+            rootName = self._getSaveName(savename, 'root')
+        else:
+            rootName = tempfile.NamedTemporaryFile(suffix='.root',delete=False).name
+        canvas.SaveAs(rootName)
+        if not others: return
+        names = [self._getSaveName(savename, type) for type in others]
+        if self.convertPool is None:
+            self.convertPool = multiprocessing.Pool(self.convertJobs)
+        if not self.finishRegistered:
+            atexit.register(self.finishSaving)
+            self.finishRegistered = True
+        # the worker removes a temporary file once it is converted
+        tempName = rootName if 'root' not in formats else ''
+        result = self.convertPool.apply_async(convertCanvas,(rootName,names),{'remove':bool(tempName)})
+        self.converting += [(savename, tempName, result)]
+
+    def finishSaving(self):
+        '''Wait for the background conversions to finish'''
+        while self.converting:
+            savename, tempName, result = self.converting.pop(0)
+            try:
+                result.get()
+            except Exception as e:
+                logging.error('Failed to convert {0}: {1}'.format(savename,e))
+            if tempName and os.path.exists(tempName): os.remove(tempName)
+        if self.convertPool is not None:
+            self.convertPool.close()
+            self.convertPool.join()
+            self.convertPool = None
 
     def _saveTemp(self, canvas):
         '''Save the canvas in multiple formats.'''
@@ -0,0 +1,241 @@
+import logging
+import os
+import sys
+import json
+import time
+import socket
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+
+# methods timed when present on the flattener or skimmer, by phase
+profiledMethods = {
+    'getWeight'         : 'weight',
+    'getWeights'        : 'weight',
+    'getChunkWeight'    : 'weight',
+    'getChunkWeights'   : 'weight',
+    'getFakeRate'       : 'fakeRate',
+    'getFakeRateColumn' : 'fakeRate',
+    'fill'              : 'fill',
+    'fillChunk'         : 'fill',
+    'increment'         : 'fill',
+}
+
+# dicts of selection functions whose pass rates are counted
+profiledSelections = ['selectionMap','selections']
+
+def getProfileReport(mode,analysis,sample,shift=''):
+    '''Local profile report of a flatten or skim job'''
+    if shift: return 'profiles/{0}/{1}/{2}/{3}.json'.format(analysis,mode,shift,sample)
+    return 'profiles/{0}/{1}/{2}.json'.format(analysis,mode,sample)
+
+def getProfileSummary(mode,analysis,shift=''):
+    '''Merged profile report of all jobs of a flatten or skim run'''
+    if shift: return 'profiles/{0}/{1}_{2}.json'.format(analysis,mode,shift)
+    return 'profiles/{0}/{1}.json'.format(analysis,mode)
+
+class Profiler(object):
+    '''
+    Timers and counters for the event loops of the flatteners and skimmers.
+
+    Reading the tree and the per event action are timed for every event.
+    The finer phases (weights, fake rates, selections, fills, and each
+    histogram) are only timed on one event in sampleEvery, and scaled up
+    to the full sample in the report, so that profiling can stay on.
+    Selection pass counts are counted for every event.
+    Phase times are inclusive, ie the weight time includes the fake rates.
+    '''
+
+    def __init__(self,name,**kwargs):
+        self.name = name
+        self.sampleEvery = kwargs.pop('sampleEvery',100)
+        self.events = 0
+        self.sampledEvents = 0
+        self.sampling = False
+        self.times = {}
+        self.sampledTimes = {}
+        self.counters = {}
+        self.startTime = 0.
+        self.endTime = 0.
+        self.bytesStart = 0
+        self.bytesRead = 0
+
+    def begin(self):
+        '''Start the clock and the count of bytes read from files'''
+        self.startTime = time.time()
+        self.bytesStart = ROOT.TFile.GetFileBytesRead()
+
+    def end(self):
+        '''Stop the clock'''
+        self.endTime = time.time()
+        self.bytesRead = ROOT.TFile.GetFileBytesRead()-self.bytesStart
+
+    def event(self,n=1):
+        '''Count n events, the finer timers run if one of them is a sampled event'''
+        first = self.events
+        self.events += n
+        self.sampling = (self.events-1)//self.sampleEvery != (first-1)//self.sampleEvery
+        if self.sampling: self.sampledEvents += n
+
+    def addTime(self,phase,elapsed,calls=1):
+        '''Add time to a phase timed on every event'''
+        if phase not in self.times: self.times[phase] = [0.,0]
+        self.times[phase][0] += elapsed
+        self.times[phase][1] += calls
+
+    def addSampledTime(self,phase,elapsed,calls=1):
+        '''Add time to a phase timed only on the sampled events'''
+        if phase not in self.sampledTimes: self.sampledTimes[phase] = [0.,0]
+        self.sampledTimes[phase][0] += elapsed
+        self.sampledTimes[phase][1] += calls
+
+    def count(self,name,n=1):
+        '''Increment a counter'''
+        self.counters[name] = self.counters.get(name,0)+n
+
+    def iterate(self,iterable,phase='read',sized=False):
+        '''Iterate over the rows (or chunks if sized) of a tree, timing the reading and counting events'''
+        it = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.addTime(phase,time.time()-start)
+            self.event(len(item) if sized else 1)
+            yield item
+
+    def wrap(self,func,phase,sampled=True):
+        '''Time a function, on every call or only on sampled events'''
+        def timed(*args,**kwargs):
+            if sampled and not self.sampling: return func(*args,**kwargs)
+            start = time.time()
+            result = func(*args,**kwargs)
+            if sampled:
+                self.addSampledTime(phase,time.time()-start)
+            else:
+                self.addTime(phase,time.time()-start)
+            return result
+        return timed
+
+    def wrapSelection(self,func,name):
+        '''Time a selection function on sampled events and count the events it passes'''
+        timed = self.wrap(func,'selection/{0}'.format(name))
+        counter = 'selection/{0}'.format(name)
+        def counted(row):
+            result = timed(row)
+            if hasattr(result,'sum'):
+                self.count(counter,int(result.sum()))
+            elif result:
+                self.count(counter)
+            return result
+        return counted
+
+    def instrument(self,obj):
+        '''Wrap the profiled methods and selections of a flattener or skimmer instance'''
+        for method,phase in profiledMethods.iteritems():
+            if hasattr(obj,method): setattr(obj,method,self.wrap(getattr(obj,method),phase))
+        for method in ['perRowAction','perChunkAction']:
+            if hasattr(obj,method): setattr(obj,method,self.wrap(getattr(obj,method),'event',sampled=False))
+        for attr in profiledSelections:
+            selections = getattr(obj,attr,None)
+            if not isinstance(selections,dict): continue
+            setattr(obj,attr,dict([(name,self.wrapSelection(selections[name],name)) for name in selections]))
+
+    def getReport(self):
+        '''Dict of the timers and counters'''
+        wallTime = self.endTime-self.startTime
+        scale = float(self.events)/self.sampledEvents if self.sampledEvents else 0.
+        phases = {}
+        for phase,(elapsed,calls) in self.times.iteritems():
+            phases[phase] = {'time': elapsed, 'calls': calls, 'estimatedTime': elapsed, 'sampled': False,}
+        for phase,(elapsed,calls) in self.sampledTimes.iteritems():
+            phases[phase] = {'time': elapsed, 'calls': calls, 'estimatedTime': elapsed*scale, 'sampled': True,}
+        return {
+            'name'           : self.name,
+            'host'           : socket.gethostname(),
+            'pid'            : os.getpid(),
+            'startTime'      : self.startTime,
+            'endTime'        : self.endTime,
+            'wallTime'       : wallTime,
+            'events'         : self.events,
+            'sampledEvents'  : self.sampledEvents,
+            'eventsPerSecond': self.events/wallTime if wallTime>0 else 0.,
+            'bytesRead'      : self.bytesRead,
+            'phases'         : phases,
+            'counters'       : self.counters,
+            'passRates'      : getPassRates(self.counters,self.events),
+        }
+
+    def writeReport(self,fileName):
+        '''Write the report as JSON'''
+        report = self.getReport()
+        writeReport(fileName,report)
+        logging.info('{0}: {1} events in {2:.1f} s, {3:.0f} events/s, {4:.1f} MB read'.format(self.name,report['events'],report['wallTime'],report['eventsPerSecond'],report['bytesRead']/1e6))
+        return report
+
+def getPassRates(counters,events):
+    '''Fraction of events passing each counted selection'''
+    passRates = {}
+    for name,n in counters.iteritems():
+        if name.startswith('selection/'): passRates[name[len('selection/'):]] = float(n)/events if events else 0.
+    return passRates
+
+def writeReport(fileName,report):
+    '''Write a report, or a merged report, as JSON'''
+    if os.path.dirname(fileName): python_mkdir(os.path.dirname(fileName))
+    with open(fileName,'w') as f:
+        f.write(json.dumps(report, indent=4, sort_keys=True))
+
+def mergeReports(reports,name='merged'):
+    '''
+    Sum the reports of several jobs, ie from the worker processes of a run.
+
+    The wall time is from the first start to the last end, so the
+    events per second is the throughput of the whole run.
+    '''
+    merged = {
+        'name'         : name,
+        'jobs'         : [report['name'] for report in reports],
+        'events'       : 0,
+        'sampledEvents': 0,
+        'bytesRead'    : 0,
+        'phases'       : {},
+        'counters'     : {},
+    }
+    for report in reports:
+        for key in ['events','sampledEvents','bytesRead']:
+            merged[key] += report[key]
+        for phase,vals in report['phases'].iteritems():
+            if phase not in merged['phases']:
+                merged['phases'][phase] = {'time': 0., 'calls': 0, 'estimatedTime': 0., 'sampled': vals['sampled'],}
+            for key in ['time','calls','estimatedTime']:
+                merged['phases'][phase][key] += vals[key]
+        for counter,n in report['counters'].iteritems():
+            merged['counters'][counter] = merged['counters'].get(counter,0)+n
+    merged['startTime'] = min([report['startTime'] for report in reports]) if reports else 0.
+    merged['endTime'] = max([report['endTime'] for report in reports]) if reports else 0.
+    merged['wallTime'] = merged['endTime']-merged['startTime']
+    merged['eventsPerSecond'] = merged['events']/merged['wallTime'] if merged['wallTime']>0 else 0.
+    merged['passRates'] = getPassRates(merged['counters'],merged['events'])
+    return merged
+
+def mergeReportFiles(fileName,inputFiles,name='merged'):
+    '''Merge the report files of a run into fileName, missing reports (ie failed jobs) are skipped'''
+    reports = []
+    for inputFile in inputFiles:
+        if not os.path.isfile(inputFile):
+            logging.warning('No profile report {0}'.format(inputFile))
+            continue
+        with open(inputFile) as f:
+            reports += [json.load(f)]
+    merged = mergeReports(reports,name=name)
+    writeReport(fileName,merged)
+    logging.info('{0}: {1} events from {2} jobs in {3:.1f} s, {4:.0f} events/s'.format(name,merged['events'],len(reports),merged['wallTime'],merged['eventsPerSecond']))
+    return merged
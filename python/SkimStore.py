@@ -0,0 +1,134 @@
+import logging
+import os
+import mmap
+import struct
+from bisect import bisect_left
+
+import numpy as np
+
+from DevTools.Utilities.utilities import python_mkdir
+
+# file layout:
+#   header:  magic, number of keys, size of the key blob
+#   offsets: uint64[nkeys+1], start of each key in the key blob
+#   keys:    the sorted keys, utf-8 encoded, concatenated
+#   records: nkeys fixed width (val, err2, count) records, in key order
+MAGIC = 'DTSKIM01'
+headerFormat = '<8sQQ'
+headerSize = struct.calcsize(headerFormat)
+recordType = np.dtype([('val','<f8'),('err2','<f8'),('count','<i8')])
+
+def writeSkimStore(fileName,counts):
+    '''Write a dict of {key: {'val','count','err2'}} as a skim store'''
+    keys = sorted(counts.keys())
+    encoded = [key.encode('utf-8') for key in keys]
+    offsets = np.zeros(len(keys)+1,dtype='<u8')
+    offsets[1:] = np.cumsum([len(key) for key in encoded])
+    records = np.zeros(len(keys),dtype=recordType)
+    for i,key in enumerate(keys):
+        records[i] = (counts[key]['val'],counts[key]['err2'],counts[key]['count'])
+    blob = ''.join(encoded)
+    if os.path.dirname(fileName): python_mkdir(os.path.dirname(fileName))
+    # write to a temporary file first so readers never see a partial store
+    tmpFile = '{0}.{1}'.format(fileName,os.getpid())
+    with open(tmpFile,'wb') as f:
+        f.write(struct.pack(headerFormat,MAGIC,len(keys),len(blob)))
+        f.write(offsets.tostring())
+        f.write(blob)
+        # align the records on 8 bytes
+        f.write('\0'*(-len(blob)%8))
+        f.write(records.tostring())
+    os.rename(tmpFile,fileName)
+    logging.debug('Wrote {0} counts to {1}'.format(len(keys),fileName))
+
+class _KeyList(object):
+    '''Sequence view of the sorted keys of a store, for bisect'''
+
+    def __init__(self,store):
+        self.store = store
+
+    def __len__(self):
+        return self.store.nkeys
+
+    def __getitem__(self,i):
+        return self.store._getKey(i)
+
+class SkimStore(object):
+    '''
+    Read only access to a skim store written by writeSkimStore.
+
+    The file is memory mapped, lookups are a binary search of the sorted
+    keys so only the pages touched are read.
+    '''
+
+    def __init__(self,fileName):
+        self.fileName = fileName
+        self.file = open(fileName,'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size<headerSize:
+            raise IOError('Not a skim store: {0}'.format(fileName))
+        self.map = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic, self.nkeys, blobSize = struct.unpack(headerFormat,self.map[:headerSize])
+        if magic!=MAGIC:
+            raise IOError('Not a skim store: {0}'.format(fileName))
+        self.offsets = np.frombuffer(self.map,dtype='<u8',count=self.nkeys+1,offset=headerSize)
+        self.blobStart = headerSize+8*(self.nkeys+1)
+        recordStart = self.blobStart+blobSize+(-blobSize%8)
+        self.records = np.frombuffer(self.map,dtype=recordType,count=self.nkeys,offset=recordStart)
+        self.keyList = _KeyList(self)
+
+    def _getKey(self,i):
+        return self.map[self.blobStart+int(self.offsets[i]):self.blobStart+int(self.offsets[i+1])]
+
+    def _find(self,key):
+        key = key.encode('utf-8')
+        i = bisect_left(self.keyList,key)
+        if i<self.nkeys and self._getKey(i)==key: return i
+        return -1
+
+    def __len__(self):
+        return self.nkeys
+
+    def __contains__(self,key):
+        return self._find(key)>=0
+
+    def get(self,key,default=None):
+        '''The {'val','count','err2'} of a key'''
+        i = self._find(key)
+        if i<0: return default
+        record = self.records[i]
+        return {'val':float(record['val']),'count':int(record['count']),'err2':float(record['err2']),}
+
+    def __getitem__(self,key):
+        result = self.get(key)
+        if result is None: raise KeyError(key)
+        return result
+
+    def keys(self):
+        return [self._getKey(i).decode('utf-8') for i in range(self.nkeys)]
+
+    def toDict(self):
+        '''Load the full store as a dict'''
+        return dict([(key,self.get(key)) for key in self.keys()])
+
+    def close(self):
+        self.records = None
+        self.offsets = None
+        self.map.close()
+        self.file.close()
+
+def mergeSkimStores(fileName,inputFiles):
+    '''Sum the counts of several stores, ie the outputs of split jobs, into a new store'''
+    counts = {}
+    for inputFile in inputFiles:
+        store = SkimStore(inputFile)
+        keys = store.keys()
+        for key,record in zip(keys,store.records):
+            if key not in counts:
+                counts[key] = {'val':0.,'count':0,'err2':0.,}
+            counts[key]['val'] += float(record['val'])
+            counts[key]['count'] += int(record['count'])
+            counts[key]['err2'] += float(record['err2'])
+        store.close()
+    logging.info('Merged {0} skims into {1}'.format(len(inputFiles),fileName))
+    writeSkimStore(fileName,counts)
@@ -0,0 +1,142 @@
+import logging
+import os
+import sys
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+from DevTools.Plotter.histParams import getHistParams, getHistSelections
+from DevTools.Plotter.BranchPruning import getBranchNames, getFormulaBranches, getExpressionBranches
+
+# loose preselection of the slim ntuples, a term of every selection of the analysis
+slimSelections = {
+    'Hpp3l': '3l_mass>100',
+    'DY'   : 'z_mass>50.',
+}
+
+# keys of the hist params and selection kwargs that hold TTreeFormula strings
+formulaKeys = ['xVariable','yVariable','zVariable','selection','mccut','datacut','scale','mcscale','datascale','scalefactor','mcscalefactor','datascalefactor']
+
+def getSlimSelection(analysis):
+    '''Default preselection of the slim ntuples of an analysis, 1 to only drop branches'''
+    return slimSelections.get(analysis,'1')
+
+def stripParentheses(expression):
+    '''Remove parentheses around a whole expression'''
+    while expression.startswith('(') and expression.endswith(')'):
+        depth = 0
+        for i,c in enumerate(expression):
+            if c=='(': depth += 1
+            elif c==')': depth -= 1
+            if depth==0 and i<len(expression)-1: return expression
+        expression = expression[1:-1]
+    return expression
+
+def splitSelection(selection):
+    '''
+    Set of the terms of a selection joined by && at the top level.
+
+    Whitespace and enclosing parentheses are removed and trivial terms (1) dropped.
+    A selection with a top level || (or ?) is a single term.
+    '''
+    selection = stripParentheses(''.join(str(selection).split()))
+    terms = []
+    depth = 0
+    start = 0
+    for i,c in enumerate(selection):
+        if c=='(':
+            depth += 1
+        elif c==')':
+            depth -= 1
+        elif depth==0 and (selection[i:i+2]=='||' or c=='?'):
+            return set([selection]) if selection!='1' else set()
+        elif depth==0 and selection[i:i+2]=='&&':
+            terms += [selection[start:i]]
+            start = i+2
+    terms += [selection[start:]]
+    if len(terms)==1: return set([t for t in terms if t and t!='1'])
+    result = set()
+    for term in terms:
+        result.update(splitSelection(term))
+    return result
+
+def getSlimBranches(analysis,sample,tree,**kwargs):
+    '''Branches of a tree read by the histograms and selections of a sample, plus extra branches'''
+    shift = kwargs.pop('shift','')
+    branches = kwargs.pop('branches',[])
+    expressions = []
+    for params in getHistParams(analysis,sample,shift=shift).values():
+        if not params: continue
+        expressions += [params[key] for key in formulaKeys if key in params]
+    for params in getHistSelections(analysis,sample,shift=shift).values():
+        if not params: continue
+        expressions += params['args']
+        expressions += [params['kwargs'][key] for key in formulaKeys if key in params['kwargs']]
+    available = set(getBranchNames(tree))
+    return getExpressionBranches(available,expressions) | (set(branches) & available)
+
+def writeSlimNtuple(fileName,tree,selection,branches,**kwargs):
+    '''
+    Write the entries of a tree passing selection, with only the branches, to fileName.
+
+    The summed weights are written as the summedWeights histogram of the ntuples,
+    the selection, source fingerprint and branches of the tree as TNamed to check
+    the slim ntuple against later queries (see SlimNtuple).
+    '''
+    source = kwargs.pop('source','')
+    summedWeights = kwargs.pop('summedWeights',0.)
+    sourceBranches = getBranchNames(tree)
+    keep = (set(branches) | getFormulaBranches(tree,[selection])) & set(sourceBranches)
+    tree.SetBranchStatus('*',0)
+    for name in keep:
+        tree.SetBranchStatus(name,1)
+    if os.path.dirname(fileName): python_mkdir(os.path.dirname(fileName))
+    # write to a temporary file first so readers never see a partial slim ntuple
+    tmpFile = '{0}.{1}.tmp'.format(fileName,os.getpid())
+    tfile = ROOT.TFile(tmpFile,'recreate')
+    tfile.cd()
+    slimTree = tree.CopyTree(selection)
+    entries = slimTree.GetEntries()
+    hist = ROOT.TH1F('summedWeights','summedWeights',1,0,1)
+    hist.SetBinContent(1,summedWeights)
+    tfile.Write()
+    for name, val in [('slimSelection',selection),('slimSource',source),('slimSourceBranches',','.join(sourceBranches))]:
+        ROOT.TNamed(name,val).Write()
+    tfile.Close()
+    os.rename(tmpFile,fileName)
+    tree.SetBranchStatus('*',1)
+    logging.info('Wrote {0} of {1} entries and {2} of {3} branches to {4}'.format(entries,tree.GetEntries(),len(keep),len(sourceBranches),fileName))
+    return entries
+
+class SlimNtuple(object):
+    '''
+    A slim ntuple of a sample, read in place of the full ntuple when it covers a query.
+
+    It covers a query if every term of its preselection is a term of each
+    selection of the query, and it has every branch of the full ntuple that
+    the formulas of the query read.
+    '''
+
+    def __init__(self,fileName,treeName):
+        self.fileName = fileName
+        self.treeName = treeName
+        tfile = ROOT.TFile.Open(fileName)
+        self.selection, self.source, sourceBranches = [str(tfile.Get(name).GetTitle()) if tfile.Get(name) else '' for name in ['slimSelection','slimSource','slimSourceBranches']]
+        tfile.Close()
+        self.sourceBranches = set([b for b in sourceBranches.split(',') if b])
+        self.terms = splitSelection(self.selection)
+        self.tree = ROOT.TChain(treeName)
+        self.tree.Add(fileName)
+        self.branches = set(getBranchNames(self.tree))
+
+    def covers(self,selections,expressions):
+        '''The slim ntuple has all entries passing each selection and all branches read by the expressions'''
+        # without the branches of the full ntuple the missing ones can not be told apart
+        if not self.sourceBranches: return False
+        for selection in selections:
+            if not self.terms <= splitSelection(selection): return False
+        return getExpressionBranches(self.sourceBranches,list(selections)+list(expressions)) <= self.branches
@@ -0,0 +1,243 @@
+import logging
+import os
+import sys
+import re
+import math
+from array import array
+
+import numpy as np
+
+sys.argv.append('-b')
+import ROOT
+sys.argv.pop()
+
+ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+from DevTools.Utilities.utilities import python_mkdir
+from DevTools.Plotter.utilities import getTreeName, isData
+from DevTools.Plotter.FakeRateTable import hppFakeRateFiles
+
+# leptons in each tree, the first channelLeptons of them make up the channel
+syntheticLeptons = {
+    'Hpp3l': ['hpp1','hpp2','hm1','z1','z2','w1'],
+    'Hpp4l': ['hpp1','hpp2','hmm1','hmm2','z1','z2'],
+    'WZ'   : ['z1','z2','w1'],
+    'DY'   : ['z1','z2'],
+}
+channelLeptons = {
+    'Hpp3l': 3,
+    'Hpp4l': 4,
+    'WZ'   : 3,
+    'DY'   : 2,
+}
+
+# candidates in each tree, each with the candidateVariables
+syntheticCandidates = {
+    'Hpp3l': ['hpp','hm','z','w','3l'],
+    'Hpp4l': ['hpp','hmm','z','4l'],
+    'WZ'   : ['z','w','3l','w1_z1','w1_z2'],
+    'DY'   : ['z'],
+}
+candidateVariables = ['mass','pt','eta','deltaR','mt']
+
+# per lepton branches
+leptonVariables = ['pt','eta','phi','charge','isolation','genDeltaR']
+leptonFlags = ['genMatch','passLoose','passMedium','passTight']
+leptonScales = ['looseScale','mediumScale','tightScale','looseFakeRate','mediumFakeRate','tightFakeRate']
+
+# per event branches
+eventVariables = ['genWeight','pileupWeight','pileupWeightUp','pileupWeightDown','triggerEfficiency','triggerEfficiencyUp','triggerEfficiencyDown','qqZZkfactor','met_pt','met_phi','rho']
+eventCounts = ['isData','numVertices','numJetsTight30','numBjetsTight30','numGenJets']
+extraVariables = {
+    'DY'   : ['pileupWeight_{0}'.format(xsec) for xsec in range(60000,80001,1000)],
+    'WZ'   : ['leadJet_pt','subleadJet_pt','dijet_mass','dijet_deltaEta'],
+    'Hpp4l': ['hppmet_mt','hmmmet_mt'],
+}
+
+# the char branches are written with a fixed width
+stringWidth = 16
+
+def getSyntheticBranches(analysis):
+    '''List of (branch, type) in a synthetic tree, type is a TTree leaf type (D, I or C)'''
+    if analysis not in syntheticLeptons:
+        raise ValueError('No synthetic ntuple for {0}, must be one of {1}'.format(analysis,sorted(syntheticLeptons.keys())))
+    branches = [('channel','C'),('genChannel','C')]
+    branches += [(var,'D') for var in eventVariables+extraVariables.get(analysis,[])]
+    branches += [(var,'I') for var in eventCounts]
+    for cand in syntheticCandidates[analysis]:
+        branches += [('{0}_{1}'.format(cand,var),'D') for var in candidateVariables]
+    for lep in syntheticLeptons[analysis]:
+        branches += [('{0}_{1}'.format(lep,var),'D') for var in leptonVariables]
+        branches += [('{0}_{1}'.format(lep,var),'I') for var in leptonFlags]
+        for scale in leptonScales:
+            branches += [('{0}_{1}{2}'.format(lep,scale,shift),'D') for shift in ['','Up','Down']]
+    return branches
+
+def getSignalMass(sample):
+    '''Mass of a signal sample from its name, 0 for backgrounds'''
+    result = re.search('HPlusPlus.*_M-([0-9]+)_',sample)
+    return float(result.group(1)) if result else 0.
+
+def generateColumns(analysis,sample,nevents,rng):
+    '''Dict of branch to a column of nevents values'''
+    data = isData(sample)
+    mass = getSignalMass(sample)
+    nleps = channelLeptons[analysis]
+    flavors = np.array(list('emt' if analysis in ['Hpp3l','Hpp4l'] else 'em'))
+    columns = {}
+    # channels, a flavor for each of the first leptons
+    chans = flavors[rng.randint(0,len(flavors),size=(nevents,nleps))]
+    columns['channel'] = [''.join(c) for c in chans]
+    columns['genChannel'] = columns['channel'] if mass else ['a'*nleps]*nevents
+    # per event
+    for var in eventVariables+extraVariables.get(analysis,[]):
+        if var.startswith('pileupWeight') or var.startswith('triggerEfficiency') or var=='qqZZkfactor':
+            columns[var] = np.ones(nevents) if data else rng.normal(1.,0.05,nevents)
+        else:
+            columns[var] = rng.exponential(50.,nevents)
+    columns['genWeight'] = np.ones(nevents)
+    columns['met_phi'] = rng.uniform(-math.pi,math.pi,nevents)
+    columns['isData'] = np.ones(nevents,dtype=int)*int(data)
+    columns['numVertices'] = rng.poisson(20,nevents)
+    columns['numJetsTight30'] = rng.poisson(1.,nevents)
+    columns['numBjetsTight30'] = rng.poisson(0.2,nevents)
+    columns['numGenJets'] = rng.poisson(1.,nevents)
+    # candidates
+    for cand in syntheticCandidates[analysis]:
+        if cand in ['hpp','hmm','hm'] and mass:
+            columns['{0}_mass'.format(cand)] = rng.normal(mass,0.05*mass,nevents)
+        elif cand=='z':
+            columns['z_mass'] = np.where(rng.uniform(size=nevents)<0.9,rng.normal(91.,5.,nevents),-1.)
+        else:
+            columns['{0}_mass'.format(cand)] = rng.exponential(150.,nevents)
+        columns['{0}_mt'.format(cand)] = columns['{0}_mass'.format(cand)]*rng.uniform(0.5,1.,nevents)
+        columns['{0}_pt'.format(cand)] = rng.exponential(60.,nevents)
+        columns['{0}_eta'.format(cand)] = rng.uniform(-3.,3.,nevents)
+        columns['{0}_deltaR'.format(cand)] = rng.uniform(0.,5.,nevents)
+    # leptons, tight within medium within loose
+    for lep in syntheticLeptons[analysis]:
+        columns['{0}_pt'.format(lep)] = 10.+rng.exponential(40.,nevents)
+        columns['{0}_eta'.format(lep)] = rng.uniform(-2.4,2.4,nevents)
+        columns['{0}_phi'.format(lep)] = rng.uniform(-math.pi,math.pi,nevents)
+        columns['{0}_charge'.format(lep)] = rng.choice([-1.,1.],nevents)
+        columns['{0}_isolation'.format(lep)] = rng.exponential(0.05,nevents)
+        columns['{0}_genDeltaR'.format(lep)] = rng.exponential(0.02,nevents)
+        columns['{0}_genMatch'.format(lep)] = (rng.uniform(size=nevents)<0.9).astype(int)
+        quality = rng.uniform(size=nevents)
+        columns['{0}_passLoose'.format(lep)] = np.ones(nevents,dtype=int)
+        columns['{0}_passMedium'.format(lep)] = (quality<0.8).astype(int)
+        columns['{0}_passTight'.format(lep)] = (quality<0.7).astype(int)
+        for scale in leptonScales:
+            if 'FakeRate' in scale:
+                val = rng.uniform(0.05,0.3,nevents)
+                err = 0.2*val
+            else:
+                val = rng.normal(1.,0.02,nevents)
+                err = np.ones(nevents)*0.02
+            columns['{0}_{1}'.format(lep,scale)] = val
+            columns['{0}_{1}Up'.format(lep,scale)] = val+err
+            columns['{0}_{1}Down'.format(lep,scale)] = val-err
+    return columns
+
+def hasSyntheticBranches(fileName,analysis):
+    '''The file has a tree with every synthetic branch, False for files written before a branch was added'''
+    tfile = ROOT.TFile.Open(fileName)
+    tree = tfile.Get(getTreeName(analysis)) if tfile else None
+    complete = bool(tree) and set([name for name,leafType in getSyntheticBranches(analysis)]) <= set([branch.GetName() for branch in tree.GetListOfBranches()])
+    if tfile: tfile.Close()
+    return complete
+
+def writeSyntheticFile(fileName,analysis,sample,nevents,seed=0):
+    '''Write a tree of nevents synthetic events and its summedWeights histogram'''
+    rng = np.random.RandomState(seed)
+    columns = generateColumns(analysis,sample,nevents,rng)
+    branches = getSyntheticBranches(analysis)
+    if os.path.dirname(fileName): python_mkdir(os.path.dirname(fileName))
+    # write to a temporary file first so a killed job does not leave a partial ntuple
+    tmpFile = '{0}.{1}.tmp'.format(fileName,os.getpid())
+    tfile = ROOT.TFile(tmpFile,'recreate')
+    tree = ROOT.TTree(getTreeName(analysis),getTreeName(analysis))
+    buffers = {}
+    for name,leafType in branches:
+        if leafType=='C':
+            buffers[name] = array('c','\0'*stringWidth)
+        elif leafType=='I':
+            buffers[name] = array('i',[0])
+        else:
+            buffers[name] = array('d',[0.])
+        tree.Branch(name,buffers[name],'{0}/{1}'.format(name,leafType))
+    numbers = [(buffers[name],columns[name]) for name,leafType in branches if leafType!='C']
+    strings = [(buffers[name],columns[name]) for name,leafType in branches if leafType=='C']
+    for i in xrange(nevents):
+        for buf,column in numbers:
+            buf[0] = column[i]
+        for buf,column in strings:
+            val = column[i][:stringWidth-1]
+            buf[:len(val)+1] = array('c',val+'\0')
+        tree.Fill()
+    summedWeights = ROOT.TH1F('summedWeights','summedWeights',1,0,1)
+    summedWeights.SetBinContent(1,float(np.sum(columns['genWeight'])))
+    tfile.Write()
+    tfile.Close()
+    os.rename(tmpFile,fileName)
+    logging.debug('Wrote {0} synthetic {1} events to {2}'.format(nevents,analysis,fileName))
+
+def writeSyntheticSample(directory,analysis,sample,nevents,**kwargs):
+    '''
+    Write the synthetic ntuples of a sample split into nfiles files in directory/sample.
+
+    Files that already exist are kept, the seed of each file is derived from
+    seed, the sample and the file number so the same options give the same ntuples.
+    '''
+    nfiles = kwargs.pop('nfiles',1)
+    seed = kwargs.pop('seed',0)
+    fileNames = []
+    for f in range(nfiles):
+        fileName = os.path.join(directory,sample,'synthetic_{0}.root'.format(f))
+        fileNames += [fileName]
+        if os.path.isfile(fileName) and hasSyntheticBranches(fileName,analysis): continue
+        n = nevents//nfiles + (1 if f < nevents%nfiles else 0)
+        fileSeed = (seed*1000003 + sum([ord(c) for c in sample])*101 + f) % (2**32)
+        writeSyntheticFile(fileName,analysis,sample,n,seed=fileSeed)
+    return fileNames
+
+def writeSyntheticFakeRates(dataDirectory):
+    '''
+    Write flat fake rate histograms with the names read by the flatteners and skimmers,
+    under dataDirectory (ie $CMSSW_BASE/src/DevTools/Analyzer/data).
+    '''
+    python_mkdir(dataDirectory)
+    ptBins = array('d',[10,20,30,40,50,60,100])
+    etaBins = array('d',[0,1.479,2.5])
+    paths = {}
+    for lep,(fileName,path) in hppFakeRateFiles.iteritems():
+        if fileName not in paths: paths[fileName] = []
+        for num in ['medium','tight']:
+            paths[fileName] += [path.format(num=num,denom='loose')]
+            if lep in ['electrons','muons']:
+                flavor = path.split('/')[0]
+                paths[fileName] += ['{0}/{1}/fakeratePtEta'.format(flavor,num)]
+                paths[fileName] += ['{0}/{1}_loose/fakeratePtEta_jetPt{2}'.format(flavor,num,jetPt) for jetPt in range(20,55,5)]
+                # read by WZSkimmer
+                paths[fileName] += ['{0}/{1}/fakeratePtEta_jetPt{2}'.format(flavor,num,jetPt) for jetPt in range(20,55,5)]
+    for fileName in paths:
+        fullName = os.path.join(dataDirectory,fileName)
+        if os.path.isfile(fullName):
+            # rewrite files from before a histogram was added
+            tfile = ROOT.TFile.Open(fullName)
+            complete = bool(tfile) and all([bool(tfile.Get(path)) for path in paths[fileName]])
+            if tfile: tfile.Close()
+            if complete: continue
+        tfile = ROOT.TFile(fullName,'recreate')
+        for path in paths[fileName]:
+            directory, histName = os.path.dirname(path), os.path.basename(path)
+            if not tfile.GetDirectory(directory): tfile.mkdir(directory)
+            tfile.cd(directory)
+            hist = ROOT.TH2D(histName,histName,len(ptBins)-1,ptBins,len(etaBins)-1,etaBins)
+            for x in range(hist.GetNbinsX()+2):
+                for y in range(hist.GetNbinsY()+2):
+                    hist.SetBinContent(x,y,0.1+0.02*y)
+                    hist.SetBinError(x,y,0.01)
+            hist.Write()
+        tfile.Close()
+        logging.debug('Wrote synthetic fake rates to {0}'.format(fullName))
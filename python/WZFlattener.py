@@ -7,10 +7,13 @@ import itertools
 import operator
 from copy import deepcopy
 
+import numpy as np
+
 import ROOT
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 from NtupleFlattener import NtupleFlattener
+from DevTools.Plotter.ColumnChunk import passAll
 from DevTools.Utilities.utilities import prod, ZMASS
 
 
@@ -36,23 +39,23 @@ class WZFlattener(NtupleFlattener):
         self.channels = ['eee','eem','mme','mmm']
         self.cutMap = {
             'default': {
-                'zptCut'   : lambda row: row.z1_pt>25 and row.z2_pt>15,
+                'zptCut'   : lambda row: (row.z1_pt>25) & (row.z2_pt>15),
                 'wptCut'   : lambda row: row.w1_pt>20,
                 'bvetoCut' : lambda row: row.numBjetsTight30==0,
                 'metCut'   : lambda row: row.met_pt>30,
                 'zmassCut' : lambda row: abs(row.z_mass-ZMASS)<15,
-                'wmllCut'  : lambda row: row.w1_z1_mass>4 and row.w1_z2_mass>4,
+                'wmllCut'  : lambda row: (row.w1_z1_mass>4) & (row.w1_z2_mass>4),
                 '3lmassCut': lambda row: getattr(row,'3l_mass')>100,
             },
             'dy': {
-                'zptCut'   : lambda row: row.z1_pt>25 and row.z2_pt>15,
+                'zptCut'   : lambda row: (row.z1_pt>25) & (row.z2_pt>15),
                 'wptCut'   : lambda row: row.w1_pt>20,
                 'metCut'   : lambda row: row.met_pt<25,
                 'zmassCut' : lambda row: abs(row.z_mass-ZMASS)<15,
                 '3lmassCut': lambda row: getattr(row,'3l_mass')>100,
             },
             'tt': {
-                'zptCut'   : lambda row: row.z1_pt>25 and row.z2_pt>15,
+                'zptCut'   : lambda row: (row.z1_pt>25) & (row.z2_pt>15),
                 'wptCut'   : lambda row: row.w1_pt>20,
                 'bCut'     : lambda row: row.numBjetsTight30>0,
                 'metCut'   : lambda row: row.met_pt>25,
@@ -62,7 +65,7 @@ class WZFlattener(NtupleFlattener):
         }
 
         self.vbsMap = {
-            'jetPt'   : lambda row: row.leadJet_pt>50. and row.subleadJet_pt>50.,
+            'jetPt'   : lambda row: (row.leadJet_pt>50.) & (row.subleadJet_pt>50.),
             'jetDEta' : lambda row: row.dijet_deltaEta>2.5,
             'mjj'     : lambda row: row.dijet_mass>400.,
         }
@@ -244,23 +247,7 @@ class WZFlattener(NtupleFlattener):
         isData = row.isData
 
         # per sample cuts
-        keep = True
-        if self.sample=='DYJetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'  : keep = row.numGenJets==0 or row.numGenJets>4
-        if self.sample=='DY1JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==1
-        if self.sample=='DY2JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==2
-        if self.sample=='DY3JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==3
-        if self.sample=='DY4JetsToLL_M-10to50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8' : keep = row.numGenJets==4
-        if self.sample=='DYJetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'      : keep = row.numGenJets==0 or row.numGenJets>4
-        if self.sample=='DY1JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==1
-        if self.sample=='DY2JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==2
-        if self.sample=='DY3JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==3
-        if self.sample=='DY4JetsToLL_M-50_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'     : keep = row.numGenJets==4
-        if self.sample=='WJetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'           : keep = row.numGenJets==0 or row.numGenJets>4
-        if self.sample=='W1JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==1
-        if self.sample=='W2JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==2
-        if self.sample=='W3JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==3
-        if self.sample=='W4JetsToLNu_TuneCUETP8M1_13TeV-madgraphMLM-pythia8'          : keep = row.numGenJets==4
-        if not keep: return
+        if not self.passSampleCuts(row): return
 
 
         # define weights
@@ -291,19 +278,102 @@ class WZFlattener(NtupleFlattener):
         #print ''
         #print 'Processing'
         for baseSel in self.cutMap:
-            result = all([self.cutMap[baseSel][cut](row) for cut in self.cutMap[baseSel]])
+            result = passAll([self.cutMap[baseSel][cut](row) for cut in self.cutMap[baseSel]])
             #if baseSel=='vbs': result = result and all([self.cutMap['default'][cut](row) for cut in self.cutMap['default']])
             #print baseSel, result
             if result: fill(row,baseSel)
             if self.nMinusOne and baseSel in ['default']:
                 for sel in self.cutMap[baseSel]:
-                     result = all([self.cutMap[baseSel][cut](row) for cut in self.cutMap[baseSel] if cut!=sel])
+                     result = passAll([self.cutMap[baseSel][cut](row) for cut in self.cutMap[baseSel] if cut!=sel])
                      if result: fill(row,'{0}/{1}'.format(baseSel,sel))
             if self.nMinusOne and baseSel in ['default-vbs']:
                 for sel in self.vbsMap:
-                     result = all([self.cutMap[baseSel][cut](row) for cut in self.cutMap[baseSel] if cut!=sel])
+                     result = passAll([self.cutMap[baseSel][cut](row) for cut in self.cutMap[baseSel] if cut!=sel])
                      if result: fill(row,'{0}/{1}'.format(baseSel,sel))
 
+    def getChunkWeight(self,chunk,passID,doFake=False):
+        '''Columnar version of getWeight, fake rates are read from the tree'''
+        n = len(chunk)
+        isData = chunk.isData.astype(bool)
+        weight = np.ones(n)
+        if not isData.all():
+            # per event weights
+            base = ['genWeight','pileupWeight','triggerEfficiency']
+            if self.shift=='trigUp': base = ['genWeight','pileupWeight','triggerEfficiencyUp']
+            if self.shift=='trigDown': base = ['genWeight','pileupWeight','triggerEfficiencyDown']
+            if self.shift=='puUp': base = ['genWeight','pileupWeightUp','triggerEfficiency']
+            if self.shift=='puDown': base = ['genWeight','pileupWeightDown','triggerEfficiency']
+            vals = [getattr(chunk,scale) for scale in base]
+            shiftString = ''
+            if self.shift == 'lepUp': shiftString = 'Up'
+            if self.shift == 'lepDown': shiftString = 'Down'
+            for l,p in enumerate(passID):
+                base += [self.wzScaleMap['P'][l]+shiftString]
+                vals += [np.where(p,getattr(chunk,self.wzScaleMap['P'][l]+shiftString),getattr(chunk,self.wzScaleMap['F'][l]+shiftString))]
+            mcweight = np.ones(n)
+            for scale,val in zip(base,vals):
+                nans = val!=val
+                if nans.any(): logging.warning('{0}: {1} is NaN for {2} events'.format(self.sample,scale,nans.sum()))
+                mcweight *= np.where(nans,1.,val)
+            # scale to lumi/xsec
+            mcweight *= float(self.intLumi)/self.sampleLumi if self.sampleLumi else 0.
+            if hasattr(chunk,'qqZZkfactor'): mcweight *= chunk.qqZZkfactor/1.1 # ZZ variable k factor
+            weight = np.where(isData,1.,mcweight)
+        # fake scales
+        if doFake:
+            nf = sum([~p for p in passID])
+            weight = np.where((nf%2==0) & (nf>0),-weight,weight)
+            weight = np.where(~isData & (nf>0),-weight,weight) # subtract off MC in control
+            for l,p in enumerate(passID):
+                if p.all(): continue
+                fake = self.wzFakeRate[l]
+                if self.shift=='fakeUp': fake += 'Up'
+                if self.shift=='fakeDown': fake += 'Down'
+                fakeEff = np.where(p,0.,getattr(chunk,fake))
+                weight = np.where(p,weight,weight*fakeEff/(1-fakeEff))
+
+        return weight
+
+    def perChunkAction(self,chunk):
+        isData = chunk.isData.astype(bool)
+
+        # per sample cuts
+        keep = np.broadcast_to(self.passSampleCuts(chunk),(len(chunk),))
+        if not keep.any(): return
+
+        # define weights
+        passID = [getattr(chunk,self.wzTightVar[l]).astype(bool) for l in range(3)]
+        w = self.getChunkWeight(chunk,passID)
+        wf = self.getChunkWeight(chunk,passID,doFake=True)
+
+        # setup channels
+        fakeChans = np.array([''.join(['P' if p else 'F' for p in pids]) for pids in zip(*passID)])
+        recoChan = np.array([''.join([x for x in c if x in 'emt']) for c in chunk.channel])
+
+        # define count regions
+        genCut = isData
+        if not isData.all():
+            genCut = isData | passAll([getattr(chunk,'{0}_genMatch'.format(lep)).astype(bool) & (getattr(chunk,'{0}_genDeltaR'.format(lep))<0.1) for lep in self.leps])
+
+        allPass = passAll(passID)
+        def fill(result,sel):
+            result = keep & result
+            self.fillChunk(chunk,sel,result & allPass,w,recoChan)
+            if not self.datadriven: return
+            for fakeChan in np.unique(fakeChans[result]):
+                fakeResult = result & (fakeChans==fakeChan)
+                self.fillChunk(chunk,fakeChan+'/'+sel,fakeResult & genCut,wf,recoChan)
+                if self.datadrivenRegular: self.fillChunk(chunk,fakeChan+'_regular/'+sel,fakeResult,w,recoChan)
+
+        for baseSel in self.cutMap:
+            results = dict([(cut,self.cutMap[baseSel][cut](chunk)) for cut in self.cutMap[baseSel]])
+            fill(passAll(results.values()),baseSel)
+            if self.nMinusOne and baseSel in ['default']:
+                for sel in self.cutMap[baseSel]:
+                    fill(passAll([results[cut] for cut in results if cut!=sel]),'{0}/{1}'.format(baseSel,sel))
+            if self.nMinusOne and baseSel in ['default-vbs']:
+                for sel in self.vbsMap:
+                    fill(passAll([results[cut] for cut in results if cut!=sel]),'{0}/{1}'.format(baseSel,sel))
 
 
 
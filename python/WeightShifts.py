@@ -0,0 +1,84 @@
+import logging
+import operator
+
+import numpy as np
+
+# shifts that only change which branches enter the event weight,
+# so they can be filled from the nominal ntuples in the same pass
+weightShifts = ['trigUp','trigDown','puUp','puDown','lepUp','lepDown']
+
+# per event weights and their replacement in each shift
+baseWeights = ['genWeight','pileupWeight','triggerEfficiency']
+shiftedBaseWeights = {
+    'trigUp'  : {'triggerEfficiency': 'triggerEfficiencyUp'},
+    'trigDown': {'triggerEfficiency': 'triggerEfficiencyDown'},
+    'puUp'    : {'pileupWeight': 'pileupWeightUp'},
+    'puDown'  : {'pileupWeight': 'pileupWeightDown'},
+}
+
+# suffix of the lepton scale factors in each shift
+leptonScaleShifts = {
+    'lepUp'  : 'Up',
+    'lepDown': 'Down',
+}
+
+def getBaseWeights(shift=''):
+    '''Per event weight branches of a shift'''
+    return [shiftedBaseWeights.get(shift,{}).get(base,base) for base in baseWeights]
+
+def getLeptonScale(scale,shift=''):
+    '''Lepton scale factor branch of a shift'''
+    return scale+leptonScaleShifts.get(shift,'')
+
+class WeightShifts(object):
+    '''
+    Event weights of the nominal and of several weight shifts.
+
+    Every shift is the product of its base weights and lepton scale factors.
+    Branches common to several shifts are read and checked for NaN once per
+    row or chunk, NaN factors are replaced by 1 as before.
+    '''
+
+    def __init__(self,shifts,**kwargs):
+        self.shifts = shifts
+        self.sample = kwargs.pop('sample','')
+        self.factors = {}
+
+    def _getFactor(self,obj,passScale,failScale=None,passID=True):
+        if isinstance(passID,np.ndarray):
+            key = (passScale,failScale)
+            if key not in self.factors:
+                self.factors[key] = self._checkNaN(obj,passScale,np.where(passID,getattr(obj,passScale),getattr(obj,failScale)))
+        else:
+            key = passScale if passID else failScale
+            if key not in self.factors:
+                self.factors[key] = self._checkNaN(obj,key,getattr(obj,key))
+        return self.factors[key]
+
+    def _checkNaN(self,obj,scale,val):
+        if isinstance(val,np.ndarray):
+            nans = val!=val
+            if nans.any():
+                logging.warning('{0}: {1} is NaN for {2} events'.format(self.sample,scale,nans.sum()))
+                val = np.where(nans,1.,val)
+        elif val != val:
+            logging.warning('{0}: {1} is NaN'.format(obj.channel,scale))
+            val = 1.
+        return val
+
+    def getWeights(self,obj,leptonScales=[]):
+        '''
+        Dict of shift to weight for a row, or to an array of weights for a chunk.
+
+        leptonScales is a list of (passScale, failScale, passID) per lepton, passID
+        a bool for a row or an array for a chunk choosing the scale factor of each entry.
+        '''
+        self.factors = {}
+        weights = {}
+        for shift in self.shifts:
+            factors = [self._getFactor(obj,base) for base in getBaseWeights(shift)]
+            for passScale,failScale,passID in leptonScales:
+                factors += [self._getFactor(obj,getLeptonScale(passScale,shift),getLeptonScale(failScale,shift),passID)]
+            weights[shift] = reduce(operator.mul,factors,1.)
+        self.factors = {}
+        return weights
@@ -576,63 +576,107 @@ for sigMap in sigMaps:
 #    },
 #}
 
+# variables the signal region cuts are applied to
+selectionVariables = {
+    'Hpp3l': {
+        'st'   : lambda row: row.hpp1_pt+row.hpp2_pt+row.hm1_pt,
+        'zveto': lambda row: abs(row.z_mass-ZMASS),
+        'met'  : lambda row: row.met_pt,
+        'dr'   : lambda row: row.hpp_deltaR,
+        'mass' : lambda row: row.hpp_mass,
+    },
+    'Hpp4l': {
+        'st'   : lambda row: row.hpp1_pt+row.hpp2_pt+row.hmm1_pt+row.hmm2_pt,
+        'zveto': lambda row: abs(row.z_mass-ZMASS),
+        'drpp' : lambda row: row.hpp_deltaR,
+        'drmm' : lambda row: row.hmm_deltaR,
+        'hpp'  : lambda row: row.hpp_mass,
+        'hmm'  : lambda row: row.hmm_mass,
+    },
+}
+
+# signal region cuts for each number of taus
+# [lower slope, lower offset, upper slope, upper offset], the cut is lower < var < upper
+# with lower = slope*mass+offset, None for no bound or no cut
+selectionParams = {
+    'Hpp3l': {
+        'st'   : [[1.38,-94,None,None], [1.07,36,None,None], [1.24,-14,None,None]],
+        'zveto': [[0,10,None,None],     [0,10,None,None],    [0,10,None,None]],
+        'met'  : [None,                 [0,80,None,None],    [0,80,None,None]],
+        'dr'   : [[None,None,0,2.9],    [None,None,0,2.9],   [None,None,0,2.5]],
+        'mass' : [[0.9,0,1.1,0],        [0.4,0,1.1,0],       [0.3,0,1.1,0]],
+    },
+    'Hpp4l': {
+        'st'   : [[1.23,54,None,None],  [1.30,-34,None,None],[0.56,194,None,None]],
+        'zveto': [[0,10,None,None],     [0,10,None,None],    [0,10,None,None]],
+        'drpp' : [None,                 [None,None,0,3.3],   [None,None,0,2.5]],
+        'drmm' : [None,                 [None,None,0,3.3],   [None,None,0,2.5]],
+        'hpp'  : [[0.9,0,1.1,0],        [0.4,0,1.1,0],       [0.3,0,1.1,0]],
+        'hmm'  : [[0.9,0,1.1,0],        [0.4,0,1.1,0],       [0.3,0,1.1,0]],
+    },
+}
+
+def buildCut(variable,params,mass):
+    '''Build the cut lambda for a single mass'''
+    if params is None: return lambda row: True
+    loSlope, loOffset, hiSlope, hiOffset = params
+    if hiSlope is None:
+        lo = loSlope*mass+loOffset
+        return lambda row: variable(row)>lo
+    if loSlope is None:
+        hi = hiSlope*mass+hiOffset
+        return lambda row: variable(row)<hi
+    lo = loSlope*mass+loOffset
+    hi = hiSlope*mass+hiOffset
+    return lambda row: (variable(row)>lo) & (variable(row)<hi)
+
 def getSelectionMap(analysis,mass):
-    if analysis=='Hpp3l':
-        cutRegions = {
-            0: {
-                'st'   : lambda row: (row.hpp1_pt+row.hpp2_pt+row.hm1_pt)>1.38*mass-94,
-                'zveto': lambda row: abs(row.z_mass-ZMASS)>10,
-                'met'  : lambda row: True,
-                'dr'   : lambda row: row.hpp_deltaR<2.9,
-                'mass' : lambda row: row.hpp_mass>0.9*mass and row.hpp_mass<1.1*mass,
-            },
-            1: {
-                'st'   : lambda row: (row.hpp1_pt+row.hpp2_pt+row.hm1_pt)>1.07*mass+36,
-                'zveto': lambda row: abs(row.z_mass-ZMASS)>10,
-                'met'  : lambda row: row.met_pt>80,
-                'dr'   : lambda row: row.hpp_deltaR<2.9,
-                'mass' : lambda row: row.hpp_mass>0.4*mass and row.hpp_mass<1.1*mass,
-            },
-            2: {
-                'st'   : lambda row: (row.hpp1_pt+row.hpp2_pt+row.hm1_pt)>1.24*mass-14,
-                'zveto': lambda row: abs(row.z_mass-ZMASS)>10,
-                'met'  : lambda row: row.met_pt>80,
-                'dr'   : lambda row: row.hpp_deltaR<2.5,
-                'mass' : lambda row: row.hpp_mass>0.3*mass and row.hpp_mass<1.1*mass,
-            },
-        }
-    elif analysis=='Hpp4l':
-        cutRegions = {
-            0: {
-                'st'   : lambda row: (row.hpp1_pt+row.hpp2_pt+row.hmm1_pt+row.hmm2_pt)>1.23*mass+54,
-                'zveto': lambda row: abs(row.z_mass-ZMASS)>10,
-                'drpp' : lambda row: True,
-                'drmm' : lambda row: True,
-                'hpp'  : lambda row: row.hpp_mass>0.9*mass and row.hpp_mass<1.1*mass,
-                'hmm'  : lambda row: row.hmm_mass>0.9*mass and row.hmm_mass<1.1*mass,
-            },
-            1: {
-                'st'   : lambda row: (row.hpp1_pt+row.hpp2_pt+row.hmm1_pt+row.hmm2_pt)>1.30*mass-34,
-                'zveto': lambda row: abs(row.z_mass-ZMASS)>10,
-                'drpp' : lambda row: row.hpp_deltaR<3.3,
-                'drmm' : lambda row: row.hmm_deltaR<3.3,
-                'hpp'  : lambda row: row.hpp_mass>0.4*mass and row.hpp_mass<1.1*mass,
-                'hmm'  : lambda row: row.hmm_mass>0.4*mass and row.hmm_mass<1.1*mass,
-            },
-            2: {
-                'st'   : lambda row: (row.hpp1_pt+row.hpp2_pt+row.hmm1_pt+row.hmm2_pt)>0.56*mass+194,
-                'zveto': lambda row: abs(row.z_mass-ZMASS)>10,
-                'drpp' : lambda row: row.hpp_deltaR<2.5,
-                'drmm' : lambda row: row.hmm_deltaR<2.5,
-                'hpp'  : lambda row: row.hpp_mass>0.3*mass and row.hpp_mass<1.1*mass,
-                'hmm'  : lambda row: row.hmm_mass>0.3*mass and row.hmm_mass<1.1*mass,
-            },
-        }
-
-    else:
-        cutRegions = {}
+    cutRegions = {}
+    if analysis not in selectionParams: return cutRegions
+    for nTaus in range(3):
+        cutRegions[nTaus] = {}
+        for cut in selectionParams[analysis]:
+            cutRegions[nTaus][cut] = buildCut(selectionVariables[analysis][cut],selectionParams[analysis][cut][nTaus],mass)
     return cutRegions
 
+class SelectionTable(object):
+    '''
+    The getSelectionMap cuts for a list of masses, stored as arrays of thresholds
+    indexed [mass,nTaus] so that all masses and tau categories are evaluated in
+    one step for an event, or for a column of events.
+    '''
+
+    def __init__(self,analysis,masses):
+        self.analysis = analysis
+        self.masses = list(masses)
+        self.massIndex = dict([(mass,m) for m,mass in enumerate(self.masses)])
+        self.variables = selectionVariables[analysis]
+        self.cuts = {}
+        m = np.array(self.masses,dtype=float)[:,np.newaxis]
+        for cut, params in selectionParams[analysis].iteritems():
+            active = np.array([p is not None for p in params])
+            lo = np.hstack([p[0]*m+p[1] if p is not None and p[0] is not None else np.full_like(m,-np.inf) for p in params])
+            hi = np.hstack([p[2]*m+p[3] if p is not None and p[2] is not None else np.full_like(m,np.inf) for p in params])
+            self.cuts[cut] = (active[np.newaxis,:],lo,hi)
+
+    def evaluate(self,row,cuts=[]):
+        '''Evaluate the cuts, returns boolean arrays indexed [mass,nTaus] (or [mass,nTaus,entry] for columns)'''
+        results = {}
+        for cut in cuts or self.cuts:
+            active, lo, hi = self.cuts[cut]
+            val = np.asarray(self.variables[cut](row),dtype=float)
+            extra = (1,)*val.ndim
+            lo = lo.reshape(lo.shape+extra)
+            hi = hi.reshape(hi.shape+extra)
+            results[cut] = ~active.reshape(active.shape+extra) | ((val>lo) & (val<hi))
+        return results
+
+    def passes(self,row,mass,nTaus,cuts):
+        '''Test if a row (or column of rows) passes all of cuts for a mass and number of taus'''
+        m = self.massIndex[mass]
+        results = self.evaluate(row,cuts=cuts)
+        return np.all([results[cut][m,nTaus] for cut in cuts],axis=0)
+
 ###########################
 ### Functions to access ###
 ###########################
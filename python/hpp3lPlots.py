@@ -26,6 +26,8 @@ plotSOverB = False
 plotSignificance = False
 plotAllMasses = False
 plotSig500 = True
+plotParallel = False # queue the plots and make them at the end on plotJobs processes
+plotJobs = 8
 
 hpp3lPlotter = Plotter('Hpp3l',new=True)
 
@@ -100,7 +102,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + chanLabels
     savename = '/'.join([x for x in [saveDir,'individualChannels'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1,labelsOption='v')
+    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1,labelsOption='v',defer=plotParallel)
 
     # per category counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -115,7 +117,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + catLabels
     savename = '/'.join([x for x in [saveDir,'individualCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1)
+    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1,defer=plotParallel)
 
     # per subcategory counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -128,7 +130,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + subCatLabels
     savename = '/'.join([x for x in [saveDir,'individualSubCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1)
+    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=5000,ymin=1,defer=plotParallel)
 
 # variable binning
 variable_binning = {
@@ -182,7 +184,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
     plotvars = getDataDrivenPlot(plotname) if datadriven else plotname
     savename = '/'.join([x for x in [saveDir,plot] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plot(plotvars,savename,**kwargs)
+    plotter.plot(plotvars,savename,defer=plotParallel,**kwargs)
     for cat in cats:
         plotnames = []
         for subcat in subCatChannels[cat]:
@@ -195,7 +197,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
             kwargs['yaxis'] = 'Events / 1 GeV'
             kwargs['scalewidth'] = True
         if perCatBins and plot in ymin and kwargs.get('logy',False): kwargs['ymin'] = ymin[plot][cat]
-        if doCat: plotter.plot(plotvars,savename,**kwargs)
+        if doCat: plotter.plot(plotvars,savename,defer=plotParallel,**kwargs)
 
 def plotChannels(plotter,plot,baseDir='default',saveDir='',datadriven=False,postfix='',**kwargs):
     for chan in chans:
@@ -203,7 +205,7 @@ def plotChannels(plotter,plot,baseDir='default',saveDir='',datadriven=False,post
         plotvars = getDataDrivenPlot(plotname) if datadriven else plotname
         savename = '/'.join([x for x in [saveDir,'channels',chan,plot] if x])
         if postfix: savename += '_{0}'.format(postfix)
-        plotter.plot(plotvars,savename,**kwargs)
+        plotter.plot(plotvars,savename,defer=plotParallel,**kwargs)
 
 ########################
 ### plot definitions ###
@@ -745,3 +747,7 @@ if plotROC:
                 hpp3lPlotter.plotROC(plotnames,bgnames,savename,sigOrder=sigOrder,bgOrder=bgOrder,workingPoints=wp,**kwargs)
                     
                                                                                                           
+
+# make the deferred plots
+hpp3lPlotter.run(jobs=plotJobs)
+hpp3lPlotter.finish()
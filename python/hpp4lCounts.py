@@ -209,6 +209,14 @@ for bp in ['ee100','em100','et100','mm100','mt100','tt100']:
     baseSelection += ' && {0}'.format(recoSelection)
     mcscalefactor = 'hpp1_mediumScale*hpp2_mediumScale*hmm1_mediumScale*hmm2_mediumScale*genWeight*pileupWeight*triggerEfficiency'
     
+    # count every row in a single pass over each sample
+    rowSelections = [baseSelection]
+    for chan in sorted(chans):
+        if chan not in genRecoMap[genChanMap[bp]]: continue
+        recoCut = '(' + ' || '.join(['channel=="{0}"'.format(c) for c in chans[chan]]) + ')'
+        rowSelections += ['{0} && {1}'.format(baseSelection,recoCut)]
+    hpp4lCounter.prefetchCounts(rowSelections,mcscalefactor=mcscalefactor)
+
     hpp4lCounter.printHeader(bp)
     hpp4lCounter.printDivider()
     hpp4lCounter.printCounts('All','none',selection=baseSelection,mcscalefactor=mcscalefactor,doError=True)
@@ -28,6 +28,8 @@ plotSOverB = False
 plotSignificance = False
 plotAllMasses = False
 plotSig500 = True
+plotParallel = False # queue the plots and make them at the end on plotJobs processes
+plotJobs = 8
 
 hpp4lPlotter = Plotter('Hpp4l',new=True)
 
@@ -117,7 +119,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + catLabels
     savename = '/'.join([x for x in [saveDir,'individualCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001)
+    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001,defer=plotParallel)
     
     # per subcategory counts
     countVars = [['/'.join([x for x in [baseDir,'count'] if x])]]
@@ -130,7 +132,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + subCatLabels
     savename = '/'.join([x for x in [saveDir,'individualSubCategories'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001)
+    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=1,legendpos=34,yscale=500,ymin=0.001,defer=plotParallel)
 
 # variable binning
 variable_binning = {
@@ -173,7 +175,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
     plotvars = getDataDrivenPlot(plotname) if datadriven else plotname
     savename = '/'.join([x for x in [saveDir,plot] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plot(plotvars,savename,**kwargs)
+    plotter.plot(plotvars,savename,defer=plotParallel,**kwargs)
     for cat in cats:
         plotnames = []
         for subcat in subCatChannels[cat]:
@@ -186,7 +188,7 @@ def plotWithCategories(plotter,plot,baseDir='default',saveDir='',datadriven=Fals
             kwargs['yaxis'] = 'Events / 1 GeV'
             kwargs['scalewidth'] = True
         if perCatBins and plot in ymax: kwargs['ymax'] = ymax[plot].get(cat,None)
-        if doCat: plotter.plot(plotvars,savename,**kwargs)
+        if doCat: plotter.plot(plotvars,savename,defer=plotParallel,**kwargs)
 
 
 ########################
@@ -797,3 +799,6 @@ if plotROC:
                 savename = 'signal/{0}/{1}_genMatched_roc'.format(higgsChan,plot)
                 wp = workingPoints[plot] if plot in workingPoints else {}
                 hpp4lPlotter.plotROC(plotnames,bgnames,savename,sigOrder=sigOrder,bgOrder=bgOrder,workingPoints=wp,**kwargs)
+
+# make the deferred plots
+hpp4lPlotter.run(jobs=plotJobs)
@@ -193,12 +193,8 @@ def getCounts(*selections,**kwargs):
 
     counter = getCounter(mode=mode,mass=mass,blind=False)
 
-    result = []
-    for selection in selections:
-        fullSelection = ' && '.join([selection]+['{0}_passMedium'.format(lep) for lep in leps])
-        mcscale = '*'.join(['genWeight','pileupWeight','triggerEfficiency'] + ['{0}_mediumScale'.format(lep) for lep in leps])
-
-        result += [counter.getCounts('none',selection=fullSelection,mcscalefactor=mcscale)]
+    fullSelections = [' && '.join([selection]+['{0}_passMedium'.format(lep) for lep in leps]) for selection in selections]
+    mcscale = '*'.join(['genWeight','pileupWeight','triggerEfficiency'] + ['{0}_mediumScale'.format(lep) for lep in leps])
 
-    return result
+    return counter.getCountTable('none',fullSelections,mcscalefactor=mcscale)
 
@@ -184,10 +184,12 @@ latestHistograms = {}
 
 def getNewFlatHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
     flat = 'newflat/{0}/{1}.root'.format(analysis,sample)
+    if shift: flat = 'newflat/{0}/{1}/{2}.root'.format(analysis,shift,sample)
     return flat
 
 def getNewProjectionHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
     flat = 'newflat/{0}/{1}.root'.format(analysis,sample)
+    if shift: flat = 'newflat/{0}/{1}/{2}.root'.format(analysis,shift,sample)
     return flat
         
 def getFlatHistograms(analysis,sample,version=getCMSSWVersion(),shift=''):
@@ -300,7 +302,7 @@ def getSkimJson(analysis,sample,version=getCMSSWVersion(),shift=''):
         if len(fnames)==0:
             raise Exception('No such path {0}'.format(jpath))
         for fname in fnames:
-            if 'json' in fname: jfile = fname
+            if 'json' in fname and '.profile.' not in fname: jfile = fname
     #else:
     #    raise Exception('Unrecognized {0}'.format(':'.join([analysis,sample,version,shift])))
     return jfile
@@ -314,11 +316,30 @@ def getSkimPickle(analysis,sample,version=getCMSSWVersion(),shift=''):
         if len(fnames)==0:
             raise Exception('No such path {0}'.format(ppath))
         for fname in fnames:
-            if 'pkl' in fname: pfile = fname
+            if 'pkl' in fname and '.profile.' not in fname: pfile = fname
     #else:
     #    raise Exception('Unrecognized {0}'.format(':'.join([analysis,sample,version,shift])))
     return pfile
 
+def getSkimStore(analysis,sample,version=getCMSSWVersion(),shift=''):
+    sfile = 'skims/{0}/{1}.skim'.format(analysis,sample)
+    if shift and shift in latestSkims.get(version,{}).get(analysis,{}):
+        baseDir = '/hdfs/store/user/dntaylor'
+        spath = os.path.join(baseDir,latestSkims[version][analysis][shift],sample)
+        fnames = glob.glob('{0}/*.root'.format(spath))
+        if len(fnames)==0:
+            raise Exception('No such path {0}'.format(spath))
+        # no store for outputs without one, the local store has the nominal counts
+        sfile = ''
+        for fname in fnames:
+            if fname.endswith('.skim.root'): sfile = fname
+    return sfile
+
+def getSlimNtuple(analysis,sample,version=getCMSSWVersion(),shift=''):
+    slim = 'slim/{0}/{1}.root'.format(analysis,sample)
+    if shift: slim = 'slim/{0}/{1}/{2}.root'.format(analysis,shift,sample)
+    return slim
+
 treeMap = {
     ''               : 'Tree',
     'Charge'         : 'ChargeTree',
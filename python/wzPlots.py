@@ -19,6 +19,8 @@ doMC = True
 doNMinusOne = True
 doControls = True
 doVBS = True
+plotParallel = False # queue the plots and make them at the end on plotJobs processes
+plotJobs = 8
 
 plotStyles = {
     # Z
@@ -61,7 +63,7 @@ def plotCounts(plotter,baseDir='default',saveDir='',datadriven=False,postfix='')
     countLabels = ['Total'] + chanLabels
     savename = '/'.join([x for x in [saveDir,'individualChannels'] if x])
     if postfix: savename += '_{0}'.format(postfix)
-    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=0,legendpos=34,labelsOption='v')
+    plotter.plotCounts(countVars,countLabels,savename,numcol=3,logy=0,legendpos=34,labelsOption='v',defer=plotParallel)
 
 # n-1 cuts
 nMinusOneCuts = ['zptCut','wptCut','bvetoCut','metCut','zmassCut','3lmassCut','wmllCut']
@@ -104,25 +106,25 @@ if doMC:
     for plot in plotStyles:
         plotname = 'default/{0}'.format(plot)
         savename = 'mc/{0}'.format(plot)
-        wzPlotter.plot(plotname,savename,**plotStyles[plot])
+        wzPlotter.plot(plotname,savename,defer=plotParallel,**plotStyles[plot])
         plotname = 'default-vbs/{0}'.format(plot)
         savename = 'vbs/{0}'.format(plot)
-        if doVBS: wzPlotter.plot(plotname,savename,**plotStyles[plot])
+        if doVBS: wzPlotter.plot(plotname,savename,defer=plotParallel,**plotStyles[plot])
         for cut in nMinusOneCuts:
             plotname = 'default/{0}/{1}'.format(cut,plot)
             savename = 'nMinusOne/{0}/{1}'.format(cut,plot)
-            if doNMinusOne: wzPlotter.plot(plotname,savename,**plotStyles[plot])
+            if doNMinusOne: wzPlotter.plot(plotname,savename,defer=plotParallel,**plotStyles[plot])
         for cut in vbsNMinusOneCuts:
             plotname = 'default-vbs/{0}/{1}'.format(cut,plot)
             savename = 'vbsNMinusOne/{0}/{1}'.format(cut,plot)
-            if doNMinusOne and doVBS: wzPlotter.plot(plotname,savename,**plotStyles[plot])
+            if doNMinusOne and doVBS: wzPlotter.plot(plotname,savename,defer=plotParallel,**plotStyles[plot])
         for control in controls:
             plotname = '{0}/{1}'.format(control,plot)
             savename = '{0}/{1}'.format(control,plot)
-            if doControls: wzPlotter.plot(plotname,savename,**plotStyles[plot])
+            if doControls: wzPlotter.plot(plotname,savename,defer=plotParallel,**plotStyles[plot])
             plotname = control+'-vbs/{0}'.format(plot)
             savename = control+'-vbs/{0}'.format(plot)
-            if doVBS and doControls: wzPlotter.plot(plotname,savename,**plotStyles[plot])
+            if doVBS and doControls: wzPlotter.plot(plotname,savename,defer=plotParallel,**plotStyles[plot])
 
 ##################
 ### Datadriven ###
@@ -155,25 +157,27 @@ if doDatadriven:
     for plot in plotStyles:
         plotvars = getDataDrivenPlot('default/{0}'.format(plot))
         savename = 'datadriven/{0}'.format(plot)
-        wzPlotter.plot(plotvars,savename,**plotStyles[plot])
+        wzPlotter.plot(plotvars,savename,defer=plotParallel,**plotStyles[plot])
         plotvars = getDataDrivenPlot('default-vbs/{0}'.format(plot))
         savename = 'vbs-datadriven/{0}'.format(plot)
-        if doVBS: wzPlotter.plot(plotvars,savename,**plotStyles[plot])
+        if doVBS: wzPlotter.plot(plotvars,savename,defer=plotParallel,**plotStyles[plot])
         for cut in nMinusOneCuts:
             plotvars = getDataDrivenPlot('default/{0}/{1}'.format(cut,plot))
             savename = 'nMinusOne-datadriven/{0}/{1}'.format(cut,plot)
-            if doNMinusOne: wzPlotter.plot(plotvars,savename,**plotStyles[plot])
+            if doNMinusOne: wzPlotter.plot(plotvars,savename,defer=plotParallel,**plotStyles[plot])
         for cut in vbsNMinusOneCuts:
             plotvars = getDataDrivenPlot('default-vbs/{0}/{1}'.format(cut,plot))
             savename = 'vbsNMinusOne-datadriven/{0}/{1}'.format(cut,plot)
-            if doNMinusOne and doVBS: wzPlotter.plot(plotvars,savename,**plotStyles[plot])
+            if doNMinusOne and doVBS: wzPlotter.plot(plotvars,savename,defer=plotParallel,**plotStyles[plot])
         for control in controls:
             plotvars = getDataDrivenPlot('{0}/{1}'.format(control,plot))
             savename = '{0}-datadriven/{1}'.format(control,plot)
-            if doControls: wzPlotter.plot(plotvars,savename,**plotStyles[plot])
+            if doControls: wzPlotter.plot(plotvars,savename,defer=plotParallel,**plotStyles[plot])
             plotvars = getDataDrivenPlot(control+'-vbs/{0}'.format(plot))
             savename = control+'-vbs-datadriven/{0}'.format(plot)
-            if doVBS and doControls: wzPlotter.plot(plotvars,savename,**plotStyles[plot])
+            if doVBS and doControls: wzPlotter.plot(plotvars,savename,defer=plotParallel,**plotStyles[plot])
 
 wzPlotter.clearHistograms()
 
+# make the deferred plots
+wzPlotter.run(jobs=plotJobs)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import os
+import sys
+import logging
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+from DevTools.Plotter.Benchmark import Benchmark, benchmarkSamples, benchmarkSteps, getBenchmarkHistory, loadHistory, getComparableRuns, printComparison
+
+logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+def parse_command_line(argv):
+    parser = argparse.ArgumentParser(description='Benchmark flattening, skimming, counting and plotting on synthetic ntuples')
+
+    parser.add_argument('analysis', type=str, choices=sorted(benchmarkSamples.keys()), help='Analysis to benchmark')
+    parser.add_argument('--events', type=int, default=10000, help='Events per sample')
+    parser.add_argument('--files', type=int, default=2, help='Files per sample')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic ntuples')
+    parser.add_argument('--steps', nargs='+', type=str, default=benchmarkSteps, choices=benchmarkSteps, help='Steps to benchmark')
+    parser.add_argument('--selections', nargs='+', type=str, default=['default'], help='Selections to flatten and count')
+    parser.add_argument('--batch', action='store_true', help='Flatten all histograms of a sample in a single pass')
+    parser.add_argument('--columnar', action='store_true', help='Process the trees in chunks of columns instead of row by row')
+    parser.add_argument('--workDirectory', type=str, default='', help='Directory of the synthetic ntuples and outputs')
+    parser.add_argument('--history', type=str, default=getBenchmarkHistory(), help='JSON history of benchmark runs')
+    parser.add_argument('--compare', action='store_true', help='Only compare the last two comparable runs in the history')
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    args = parse_command_line(argv)
+
+    history = os.path.abspath(args.history)
+
+    if args.compare:
+        runs = [run for run in loadHistory(history) if run['config']['analysis']==args.analysis]
+        if not runs:
+            logging.error('No {0} runs in {1}'.format(args.analysis,history))
+            return 1
+        run = runs[-1]
+    else:
+        kwargs = {}
+        if args.workDirectory: kwargs['workDirectory'] = args.workDirectory
+        benchmark = Benchmark(
+            args.analysis,
+            events=args.events,
+            nfiles=args.files,
+            seed=args.seed,
+            steps=args.steps,
+            selections=args.selections,
+            batch=args.batch,
+            columnar=args.columnar,
+            history=history,
+            **kwargs
+        )
+        run = benchmark.run()
+
+    references = getComparableRuns(loadHistory(history),run)
+    if references:
+        printComparison(run,references[-1])
+    else:
+        logging.info('No earlier comparable run in {0}'.format(history))
+
+    return 0
+
+if __name__ == "__main__":
+    status = main()
+    sys.exit(status)
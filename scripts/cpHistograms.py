@@ -38,7 +38,8 @@ def main(argv=None):
         if not os.path.isdir(directory): continue
         destname = os.path.basename(os.path.normpath(directory))
         logging.info('Copying sample {0} of {1}: {2}'.format(i+1,len(alldirs),destname))
-        files = glob.glob('{0}/*.root'.format(directory))
+        # profile reports of the jobs are not histograms
+        files = [x for x in glob.glob('{0}/*.root'.format(directory)) if '.profile.' not in x]
         flats = [x for x in files if '_projection.root' not in x]
         projs = [x for x in files if '_projection.root' in x]
         if flats:
@@ -8,6 +8,7 @@ import os
 import sys
 import logging
 from DevTools.Utilities.utilities import runCommand, python_mkdir
+from DevTools.Plotter.SkimStore import mergeSkimStores
 
 logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
@@ -30,8 +31,10 @@ def main(argv=None):
 
     jdir = 'jsons/{0}/skims'.format(args.analysis)
     pdir = 'pickles/{0}/skims'.format(args.analysis)
+    sdir = 'skims/{0}'.format(args.analysis)
     python_mkdir(jdir)
     python_mkdir(pdir)
+    python_mkdir(sdir)
 
 
     alldirs = sorted(glob.glob('{0}/*'.format(args.input)))
@@ -40,9 +43,11 @@ def main(argv=None):
         if not os.path.isdir(directory): continue
         destname = os.path.basename(os.path.normpath(directory))
         logging.info('Copying sample {0} of {1}: {2}'.format(i+1,len(alldirs),destname))
-        files = glob.glob('{0}/*.root'.format(directory))
+        # profile reports of the jobs are not skims
+        files = [x for x in glob.glob('{0}/*.root'.format(directory)) if '.profile.' not in x]
         jsons = [x for x in files if '.json' in x]
         pickles = [x for x in files if '.pkl' in x]
+        stores = [x for x in files if x.endswith('.skim.root')]
         if jsons:
             jsonfile = '{0}/{1}.json'.format(jdir,destname)
             command = 'cp {0} {1}'.format(jsons[0],jsonfile)
@@ -51,6 +56,13 @@ def main(argv=None):
             pklfile = '{0}/{1}.pkl'.format(pdir,destname)
             command = 'cp {0} {1}'.format(pickles[0],pklfile)
             runCommand(command)
+        storefile = '{0}/{1}.skim'.format(sdir,destname)
+        if stores:
+            # split jobs are summed
+            mergeSkimStores(storefile,stores)
+        elif pickles and os.path.isfile(storefile):
+            # do not leave a store from older outputs next to the new pickle
+            os.remove(storefile)
 
 
 if __name__ == "__main__":
@@ -14,6 +14,8 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True
 from DevTools.Plotter.histParams import getHistParams, getHistSelections, getProjectionParams
 from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName
 from DevTools.Plotter.FlattenTree import FlattenTree
+from DevTools.Plotter.FlattenPool import FlattenPool
+from DevTools.Plotter.NtupleStaging import getNtupleStaging
 
 try:
     from DevTools.Utilities.MultiProgress import MultiProgress
@@ -35,6 +37,11 @@ def flatten(analysis,sample,**kwargs):
     job = kwargs.pop('job',0)
     multi = kwargs.pop('multi',False)
     useProof = kwargs.pop('useProof',False)
+    batch = kwargs.pop('batch',False)
+    pool = kwargs.pop('pool',None)
+    fingerprint = kwargs.pop('fingerprint','metadata')
+    staging = kwargs.pop('staging','')
+    stagingSize = kwargs.pop('stagingSize',0)
     if hasProgress and multi:
         pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' histograms ',Percentage(),' ',Bar(),' ',ETA()]))
     else:
@@ -43,9 +50,9 @@ def flatten(analysis,sample,**kwargs):
     if outputFile:
         flat = outputFile
         proj = outputFile.replace('.root','_projection.root')
-        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,flat=flat,proj=proj,shift=shift,countOnly=countOnly,useProof=useProof)
+        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,flat=flat,proj=proj,shift=shift,countOnly=countOnly,useProof=useProof,fingerprint=fingerprint,staging=staging,stagingSize=stagingSize)
     else:
-        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,shift=shift,countOnly=countOnly,useProof=useProof)
+        flattener = FlattenTree(analysis,sample,inputFileList=inputFileList,shift=shift,countOnly=countOnly,useProof=useProof,fingerprint=fingerprint,staging=staging,stagingSize=stagingSize)
 
     for histName, params in histParams.iteritems():
         flattener.addHistogram(histName,**params)
@@ -53,7 +60,8 @@ def flatten(analysis,sample,**kwargs):
     for selName, sel in histSelections.iteritems():
         if sel: flattener.addSelection(selName,**sel['kwargs'])
 
-    flattener.flattenAll(progressbar=pbar,njobs=njobs,job=job,multi=multi)
+    flattener.flattenAll(progressbar=pbar,njobs=njobs,job=job,multi=multi,batch=batch,pool=pool)
+    return flattener
 
 def getSampleDirectories(analysis,sampleList):
     source = getNtupleDirectory(analysis)
@@ -100,7 +108,12 @@ def parse_command_line(argv):
     parser.add_argument('--selections', nargs='+', type=str, default=['all'], help='Selections to flatten.')
     parser.add_argument('--channels', nargs='+', type=str, default=['all'], help='Channels to project.')
     parser.add_argument('--skipProjection', action='store_true', help='Skip projecting')
+    parser.add_argument('--batch', action='store_true', help='Fill all histograms of a sample in a single pass over the tree')
+    parser.add_argument('--chunkSize', type=int, default=500000, help='Number of events per task when running --batch with -j')
+    parser.add_argument('--fingerprint', type=str, default='metadata', choices=['metadata','sampled','full'], help='How input files are identified when deciding whether to refill a histogram')
     #parser.add_argument('--useProof', action='store_true', help='Use PROOF')
+    parser.add_argument('--stage', type=str, default='', help='Stage the ntuples to this local scratch directory, prefetching the next sample in the background')
+    parser.add_argument('--stageSize', type=float, default=100, help='Size of the staging directory in GB, least recently used ntuples are evicted')
     parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
 
     return parser.parse_args(argv)
@@ -111,6 +124,7 @@ def main(argv=None):
         argv = sys.argv[1:]
 
     args = parse_command_line(argv)
+    stagingSize = int(args.stageSize*1024**3)
 
     logging.info('Preparing to flatten {0}'.format(args.analysis))
 
@@ -148,7 +162,33 @@ def main(argv=None):
                 countOnly=args.countOnly,
                 njobs=njobs,
                 job=job,
+                batch=args.batch,
+                fingerprint=args.fingerprint,
                 )
+    elif args.j>1 and args.batch:
+        # split all samples into chunks of events and fill them on a shared pool
+        pool = FlattenPool(args.j,chunkSize=args.chunkSize)
+        staging = getNtupleStaging(args.stage,maxSize=stagingSize)
+        flatteners = []
+        for d,directory in enumerate(directories):
+            sample = directory.split('/')[-1]
+            if sample.endswith('.root'): sample = sample[:-5]
+            if staging and d+1<len(directories): staging.prefetchDirectory(directories[d+1])
+            histParams = getSelectedHistParams(args.analysis,args.hists,sample,shift=args.shift,countOnly=args.countOnly)
+            histSelections = getSelectedHistSelections(args.analysis,args.selections,sample,shift=args.shift,countOnly=args.countOnly)
+            flatteners += [flatten(args.analysis,
+                                   sample,
+                                   histParams=histParams,
+                                   histSelections=histSelections,
+                                   shift=args.shift,
+                                   countOnly=args.countOnly,
+                                   batch=args.batch,
+                                   pool=pool,
+                                   fingerprint=args.fingerprint,
+                                   staging=args.stage,
+                                   stagingSize=stagingSize,
+                                   )]
+        pool.join()
     elif args.j>1 and hasProgress:
         multi = MultiProgress(args.j)
         for directory in directories:
@@ -156,12 +196,14 @@ def main(argv=None):
             if sample.endswith('.root'): sample = sample[:-5]
             histParams = getSelectedHistParams(args.analysis,args.hists,sample,shift=args.shift,countOnly=args.countOnly)
             histSelections = getSelectedHistSelections(args.analysis,args.selections,sample,shift=args.shift,countOnly=args.countOnly)
-            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'histParams':histParams,'histSelections':histSelections,'shift':args.shift,'countOnly':args.countOnly,'multi':True,})
+            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'histParams':histParams,'histSelections':histSelections,'shift':args.shift,'countOnly':args.countOnly,'multi':True,'batch':args.batch,'fingerprint':args.fingerprint,'staging':args.stage,'stagingSize':stagingSize,})
         multi.retrieve()
     else:
-        for directory in directories:
+        staging = getNtupleStaging(args.stage,maxSize=stagingSize)
+        for d,directory in enumerate(directories):
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
+            if staging and d+1<len(directories): staging.prefetchDirectory(directories[d+1])
             histParams = getSelectedHistParams(args.analysis,args.hists,sample,shift=args.shift,countOnly=args.countOnly)
             histSelections = getSelectedHistSelections(args.analysis,args.selections,sample,shift=args.shift,countOnly=args.countOnly)
             flatten(args.analysis,
@@ -171,6 +213,10 @@ def main(argv=None):
                     shift=args.shift,
                     countOnly=args.countOnly,
                     multi=False,
+                    batch=args.batch,
+                    fingerprint=args.fingerprint,
+                    staging=args.stage,
+                    stagingSize=stagingSize,
                     #useProof=args.useProof,
                     )
 
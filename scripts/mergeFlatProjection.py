@@ -41,6 +41,8 @@ def main(argv=None):
         return 0
 
 
+    # profile reports of the jobs are not histograms
+    args.inputFiles = [x for x in args.inputFiles if '.profile.' not in x]
     flats = [x for x in args.inputFiles if '_projection.root' not in x]
     projs = [x for x in args.inputFiles if '_projection.root' in x]
     if flats:
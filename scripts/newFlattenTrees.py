@@ -15,6 +15,9 @@ from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName
 from DevTools.Plotter.WZFlattener import WZFlattener
 from DevTools.Plotter.Hpp3lFlattener import Hpp3lFlattener
 from DevTools.Plotter.Hpp4lFlattener import Hpp4lFlattener
+from DevTools.Plotter.WeightShifts import weightShifts
+from DevTools.Plotter.NtupleStaging import getNtupleStaging
+from DevTools.Plotter.Profiler import getProfileReport, getProfileSummary, mergeReportFiles
 
 try:
     from DevTools.Utilities.MultiProgress import MultiProgress
@@ -35,18 +38,23 @@ def flatten(analysis,sample,**kwargs):
     inputFileList = kwargs.pop('inputFileList','')
     outputFile = kwargs.pop('outputFile','')
     shift = kwargs.pop('shift','')
+    shifts = kwargs.pop('shifts',[])
     njobs = kwargs.pop('njobs',1)
     job = kwargs.pop('job',0)
     multi = kwargs.pop('multi',False)
+    columnar = kwargs.pop('columnar',False)
+    profile = kwargs.pop('profile',False)
+    staging = kwargs.pop('staging','')
+    stagingSize = kwargs.pop('stagingSize',0)
     if hasProgress:
         pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' ',Percentage(),' ',Bar(),' ',ETA()]))
     else:
         pbar = None
 
     if outputFile:
-        flattener = flatteners[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar)
+        flattener = flatteners[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,shifts=shifts,progressbar=pbar,columnar=columnar,profile=profile,staging=staging,stagingSize=stagingSize)
     else:
-        flattener = flatteners[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar)
+        flattener = flatteners[analysis](sample,inputFileList=inputFileList,shift=shift,shifts=shifts,progressbar=pbar,columnar=columnar,profile=profile,staging=staging,stagingSize=stagingSize)
 
     flattener.flatten()
 
@@ -64,6 +72,11 @@ def parse_command_line(argv):
     parser.add_argument('analysis', type=str, choices=['WZ','Hpp3l','Hpp4l',], help='Analysis to process')
     parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
     parser.add_argument('--samples', nargs='+', type=str, default=['*'], help='Samples to flatten. Supports unix style wildcards.')
+    parser.add_argument('--shifts', nargs='*', type=str, default=[], choices=weightShifts, help='Weight shifts to fill in the same pass as the shift, each into its own output file')
+    parser.add_argument('--columnar', action='store_true', help='Process the trees in chunks of columns instead of row by row')
+    parser.add_argument('--profile', action='store_true', help='Time the event loop and write JSON profile reports')
+    parser.add_argument('--stage', type=str, default='', help='Stage the ntuples to this local scratch directory, prefetching the next sample in the background')
+    parser.add_argument('--stageSize', type=float, default=100, help='Size of the staging directory in GB, least recently used ntuples are evicted')
     parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
 
     return parser.parse_args(argv)
@@ -74,6 +87,7 @@ def main(argv=None):
         argv = sys.argv[1:]
 
     args = parse_command_line(argv)
+    stagingSize = int(args.stageSize*1024**3)
 
     logging.info('Preparing to flatten {0}'.format(args.analysis))
 
@@ -97,24 +111,39 @@ def main(argv=None):
                 #inputFileList=inputFileList,
                 outputFile=outputFile,
                 shift=args.shift,
+                shifts=args.shifts,
+                columnar=args.columnar,
+                profile=args.profile,
                 )
     elif args.j>1 and hasProgress:
         multi = MultiProgress(args.j)
         for directory in directories:
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
-            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,})
+            multi.addJob(sample,flatten,args=(args.analysis,sample,),kwargs={'shift':args.shift,'shifts':args.shifts,'multi':True,'columnar':args.columnar,'profile':args.profile,'staging':args.stage,'stagingSize':stagingSize,})
         multi.retrieve()
     else:
-        for directory in directories:
+        staging = getNtupleStaging(args.stage,maxSize=stagingSize)
+        for d,directory in enumerate(directories):
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
+            if staging and d+1<len(directories): staging.prefetchDirectory(directories[d+1])
             flatten(args.analysis,
                     sample,
                     shift=args.shift,
+                    shifts=args.shifts,
                     multi=False,
+                    columnar=args.columnar,
+                    profile=args.profile,
+                    staging=args.stage,
+                    stagingSize=stagingSize,
                     )
 
+    if args.profile and not grid:
+        samples = [directory.split('/')[-1] for directory in directories]
+        samples = [sample[:-5] if sample.endswith('.root') else sample for sample in samples]
+        mergeReportFiles(getProfileSummary('flatten',args.analysis,shift=args.shift),[getProfileReport('flatten',args.analysis,sample,shift=args.shift) for sample in samples],name='{0} flatten'.format(args.analysis))
+
     logging.info('Finished')
 
 if __name__ == "__main__":
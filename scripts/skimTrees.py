@@ -15,6 +15,8 @@ from DevTools.Plotter.utilities import getNtupleDirectory, getTreeName
 from DevTools.Plotter.Hpp3lSkimmer import Hpp3lSkimmer
 from DevTools.Plotter.Hpp4lSkimmer import Hpp4lSkimmer
 from DevTools.Plotter.WZSkimmer import WZSkimmer
+from DevTools.Plotter.NtupleStaging import getNtupleStaging
+from DevTools.Plotter.Profiler import getProfileReport, getProfileSummary, mergeReportFiles
 
 try:
     from DevTools.Utilities.MultiProgress import MultiProgress
@@ -30,6 +32,10 @@ def skim(analysis,sample,**kwargs):
     outputFile = kwargs.pop('outputFile','')
     shift = kwargs.pop('shift','')
     multi = kwargs.pop('multi',False)
+    writeJson = kwargs.pop('writeJson',False)
+    profile = kwargs.pop('profile',False)
+    staging = kwargs.pop('staging','')
+    stagingSize = kwargs.pop('stagingSize',0)
     if hasProgress and multi:
         pbar = kwargs.pop('progressbar',ProgressBar(widgets=['{0}: '.format(sample),' ',SimpleProgress(),' events ',Percentage(),' ',Bar(),' ',ETA()]))
     else:
@@ -45,9 +51,9 @@ def skim(analysis,sample,**kwargs):
         return
 
     if outputFile:
-        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar)
+        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,outputFile=outputFile,shift=shift,progressbar=pbar,writeJson=writeJson,profile=profile,staging=staging,stagingSize=stagingSize)
     else:
-        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar)
+        skimmer = skimMap[analysis](sample,inputFileList=inputFileList,shift=shift,progressbar=pbar,writeJson=writeJson,profile=profile,staging=staging,stagingSize=stagingSize)
 
     skimmer.skim()
 
@@ -65,7 +71,11 @@ def parse_command_line(argv):
     parser.add_argument('analysis', type=str, choices=['WZ','ZZ','DY','Charge','TauCharge','Hpp3l','Hpp4l','Electron','Muon','Tau','DijetFakeRate','WTauFakeRate','WFakeRate'], help='Analysis to process')
     parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
     parser.add_argument('--samples', nargs='+', type=str, default=['*'], help='Samples to flatten. Supports unix style wildcards.')
+    parser.add_argument('--stage', type=str, default='', help='Stage the ntuples to this local scratch directory, prefetching the next sample in the background')
+    parser.add_argument('--stageSize', type=float, default=100, help='Size of the staging directory in GB, least recently used ntuples are evicted')
     parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
+    parser.add_argument('--json', action='store_true', help='Also write the counts as JSON')
+    parser.add_argument('--profile', action='store_true', help='Time the event loop and write JSON profile reports')
 
     return parser.parse_args(argv)
 
@@ -75,6 +85,7 @@ def main(argv=None):
         argv = sys.argv[1:]
 
     args = parse_command_line(argv)
+    stagingSize = int(args.stageSize*1024**3)
 
     logging.info('Preparing to flatten {0}'.format(args.analysis))
 
@@ -97,24 +108,37 @@ def main(argv=None):
              sample,
              outputFile=outputFile,
              shift=args.shift,
+             writeJson=args.json,
+             profile=args.profile,
              )
     elif args.j>1 and hasProgress:
         multi = MultiProgress(args.j)
         for directory in directories:
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
-            multi.addJob(sample,skim,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,})
+            multi.addJob(sample,skim,args=(args.analysis,sample,),kwargs={'shift':args.shift,'multi':True,'writeJson':args.json,'profile':args.profile,'staging':args.stage,'stagingSize':stagingSize,})
         multi.retrieve()
     else:
-        for directory in directories:
+        staging = getNtupleStaging(args.stage,maxSize=stagingSize)
+        for d,directory in enumerate(directories):
             sample = directory.split('/')[-1]
             if sample.endswith('.root'): sample = sample[:-5]
+            if staging and d+1<len(directories): staging.prefetchDirectory(directories[d+1])
             skim(args.analysis,
                  sample,
                  shift=args.shift,
                  multi=False,
+                 writeJson=args.json,
+                 profile=args.profile,
+                 staging=args.stage,
+                 stagingSize=stagingSize,
                  )
 
+    if args.profile and not grid:
+        samples = [directory.split('/')[-1] for directory in directories]
+        samples = [sample[:-5] if sample.endswith('.root') else sample for sample in samples]
+        mergeReportFiles(getProfileSummary('skim',args.analysis,shift=args.shift),[getProfileReport('skim',args.analysis,sample,shift=args.shift) for sample in samples],name='{0} skim'.format(args.analysis))
+
     logging.info('Finished')
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import os
+import sys
+import glob
+import logging
+import argparse
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+from DevTools.Plotter.utilities import getNtupleDirectory
+from DevTools.Plotter.NtupleWrapper import NtupleWrapper
+from DevTools.Plotter.SlimNtuple import getSlimSelection, getSlimBranches
+
+try:
+    from DevTools.Utilities.MultiProgress import MultiProgress
+    hasProgress = True
+except:
+    hasProgress = False
+
+logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s.%(msecs)03d %(levelname)s %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+def slim(analysis,sample,**kwargs):
+    shift = kwargs.pop('shift','')
+    selection = kwargs.pop('selection','')
+    branches = kwargs.pop('branches',[])
+    staging = kwargs.pop('staging','')
+    stagingSize = kwargs.pop('stagingSize',0)
+
+    ntuple = NtupleWrapper(analysis,sample,shift=shift,useSlim=False,staging=staging,stagingSize=stagingSize)
+    if not selection: selection = getSlimSelection(analysis)
+    keep = getSlimBranches(analysis,sample,ntuple.getTree(),shift=shift,branches=branches)
+    ntuple.writeSlim(selection,keep)
+
+def getSampleDirectories(analysis,sampleList):
+    source = getNtupleDirectory(analysis)
+    directories = []
+    for s in sampleList:
+        for d in glob.glob(os.path.join(source,s)):
+            directories += [d]
+    return directories
+
+def parse_command_line(argv):
+    parser = argparse.ArgumentParser(description='Write slim ntuples of the events passing a loose preselection and the branches read by the histograms and selections')
+
+    parser.add_argument('analysis', type=str, choices=['WZ','ZZ','DY','Charge','TauCharge','Hpp3l','Hpp4l','Electron','Muon','Tau','DijetFakeRate','WTauFakeRate','WFakeRate','ZFakeRate','ThreeLepton','TriggerCount'], help='Analysis to process')
+    parser.add_argument('shift', type=str, default='', nargs='?', help='Shift to apply to scale factors')
+    parser.add_argument('--samples', nargs='+', type=str, default=['*'], help='Samples to slim. Supports unix style wildcards.')
+    parser.add_argument('--selection', type=str, default='', help='Preselection, defaults to the one of the analysis. Only selections with all its && terms are read from the slim ntuple.')
+    parser.add_argument('--branches', nargs='*', type=str, default=[], help='Branches to keep besides the ones read by the histograms and selections')
+    parser.add_argument('--stage', type=str, default='', help='Stage the ntuples to this local scratch directory')
+    parser.add_argument('--stageSize', type=float, default=100, help='Size of the staging directory in GB, least recently used ntuples are evicted')
+    parser.add_argument('-j',type=int,default=1,help='Number of cores to use')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    args = parse_command_line(argv)
+    stagingSize = int(args.stageSize*1024**3)
+
+    logging.info('Preparing to slim {0}'.format(args.analysis))
+
+    directories = getSampleDirectories(args.analysis,args.samples)
+    logging.info('Will slim {0} samples'.format(len(directories)))
+
+    samples = [directory.split('/')[-1] for directory in directories]
+    samples = [sample[:-5] if sample.endswith('.root') else sample for sample in samples]
+    kwargs = {'shift':args.shift,'selection':args.selection,'branches':args.branches,'staging':args.stage,'stagingSize':stagingSize,}
+    if args.j>1 and hasProgress:
+        multi = MultiProgress(args.j)
+        for sample in samples:
+            multi.addJob(sample,slim,args=(args.analysis,sample,),kwargs=kwargs)
+        multi.retrieve()
+    else:
+        for sample in samples:
+            slim(args.analysis,sample,**kwargs)
+
+    logging.info('Finished')
+
+if __name__ == "__main__":
+    status = main()
+    sys.exit(status)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+import unittest
+
+from DevTools.Plotter.BranchPruning import getExpressionBranches
+from DevTools.Plotter.SlimNtuple import SlimNtuple, splitSelection
+
+def getSlimNtuple(selection,sourceBranches,branches):
+    '''A SlimNtuple with the given metadata, without a file'''
+    slim = SlimNtuple.__new__(SlimNtuple)
+    slim.selection = selection
+    slim.terms = splitSelection(selection)
+    slim.sourceBranches = set(sourceBranches)
+    slim.branches = set(branches)
+    return slim
+
+class TestSlimNtuple(unittest.TestCase):
+
+    sourceBranches = ['3l_mass','4l_mass','l_mass','z_mass','hpp1_pt','genWeight']
+
+    def test_digitBranches(self):
+        self.assertEqual(getExpressionBranches(set(self.sourceBranches),['3l_mass>100']),set(['3l_mass']))
+        self.assertEqual(getExpressionBranches(set(self.sourceBranches),['4l_mass>100 && z_mass>50.','genWeight*1.5']),set(['4l_mass','z_mass','genWeight']))
+        self.assertEqual(getExpressionBranches(set(self.sourceBranches),['l_mass>100']),set(['l_mass']))
+
+    def test_covers(self):
+        slim = getSlimNtuple('3l_mass>100',self.sourceBranches,['3l_mass','hpp1_pt','genWeight'])
+        self.assertTrue(slim.covers(['3l_mass>100 && hpp1_pt>20'],['genWeight']))
+        self.assertFalse(slim.covers(['hpp1_pt>20'],['genWeight']))
+        self.assertFalse(slim.covers(['3l_mass>100'],['4l_mass']))
+
+    def test_coversMissingBranch(self):
+        # written without the branch of its own preselection
+        slim = getSlimNtuple('3l_mass>100',self.sourceBranches,['l_mass','hpp1_pt','genWeight'])
+        self.assertFalse(slim.covers(['3l_mass>100 && hpp1_pt>20'],['genWeight']))
+        slim = getSlimNtuple('4l_mass>100',self.sourceBranches,['l_mass','genWeight'])
+        self.assertFalse(slim.covers(['4l_mass>100'],['genWeight']))
+
+    def test_coversWithoutSource(self):
+        slim = getSlimNtuple('3l_mass>100',[],['3l_mass','genWeight'])
+        self.assertFalse(slim.covers(['3l_mass>100'],['genWeight']))
+
+if __name__ == '__main__':
+    unittest.main()